@@ -1,64 +1,215 @@
+import hashlib
+import os
+import numpy as np
 import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from psycopg2.errors import CheckViolation
+from urllib3.util.retry import Retry
+from io import BytesIO, StringIO
 from datetime import datetime, timedelta
-from db import connect_to_postgres
+from db import get_connection
+from schema import ensure_schema
+from cache import notify_user_data_changed
+from versions import bump_data_version
+from metrics import habitica_stage_latency
+from partitions import ensure_partitions, reload_known_months, retention_cutoff
+from habitica_history import HabiticaHistory, EPOCH
+import logging
 
-def fetch_user_data(user_id):
-    """Fetch all data for a user at once"""
-    conn = connect_to_postgres()
-    cursor = conn.cursor()
+logger = logging.getLogger(__name__)
+
+HABITICA_EXPORT_URL = os.getenv('habitica_export_url', "https://habitica.com/export/history.csv")
+# Seconds to wait on habitica.com before giving up on an export download
+HABITICA_TIMEOUT = float(os.getenv('habitica_timeout', 30))
+HABITICA_CONNECT_TIMEOUT = float(os.getenv('habitica_connect_timeout', 5))
+CSV_CHUNK_ROWS = int(os.getenv('habitica_csv_chunk_rows', 5000))
+
+# Returned by fetch_habitica_data when the export is unchanged since last sync
+NOT_MODIFIED = object()
+
+def _make_session():
+    """Keep-alive session for habitica.com with retry and backoff on transient errors"""
+    session = requests.Session()
+    retry = Retry(
+        total=int(os.getenv('habitica_retries', 3)),
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        respect_retry_after_header=True
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=16)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+http_session = _make_session()
+
+CREDENTIALS_SQL = """
+    SELECT api_id, api_key
+    FROM api_records
+    WHERE users_id = %s AND api_type = 'habitica'
+    LIMIT 1
+"""
+
+def get_habitica_credentials(user_id):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute(CREDENTIALS_SQL, (user_id,))
+        
+        result = cursor.fetchone()
+        cursor.close()
     
-    try:
-        # Log latest date in database
+    if not result:
+        return None
+    return {"api_id": result[0], "api_key": result[1]}
+
+def get_upstream_validators(user_id):
+    """ETag / Last-Modified of the export we last ingested for this user"""
+    ensure_schema()
+    with get_connection() as conn:
+        cursor = conn.cursor()
         cursor.execute("""
-            SELECT MAX(record_date) FROM habitica_records WHERE users_id = %s
-        """, [user_id])
-        latest_date = cursor.fetchone()[0]
-        print(f"Latest date in database for user {user_id}: {latest_date}")
-
-        query = """
-            SELECT 
-                task_name,
-                task_value,
-                record_date,
-                task_type
-            FROM habitica_records 
+            SELECT upstream_etag, upstream_last_modified
+            FROM habitica_sync_state
             WHERE users_id = %s
-            AND record_date >= CURRENT_DATE - INTERVAL '30 days'
-            ORDER BY record_date DESC
-        """
-        cursor.execute(query, [user_id])
-        records = cursor.fetchall()
-        
-        df = pd.DataFrame(records, columns=['task_name', 'task_value', 'record_date', 'task_type'])
-        if not df.empty:
-            df['record_date'] = pd.to_datetime(df['record_date'])
-            latest_record = df['record_date'].max()
-            print(f"Latest record date for user {user_id}: {latest_record}")
-        
-        return df
-    finally:
+        """, [user_id])
+        row = cursor.fetchone()
         cursor.close()
-        conn.close()
+    if not row:
+        return {}
+    return {"etag": row[0], "last_modified": row[1]}
 
-def filter_and_format_data(df, task_type=None, time_range='month'):
-    """Filter DataFrame based on criteria"""
+@habitica_stage_latency.time(stage='parse')
+def parse_export(source):
+    """Parse a history.csv export from a file-like object, chunk by chunk"""
+    try:
+        chunks = pd.read_csv(source, chunksize=CSV_CHUNK_ROWS)
+        df = pd.concat(chunks, ignore_index=True)
+    except pd.errors.EmptyDataError:
+        return None
+    except Exception as e:
+        logger.error("DataFrame error: %s", e)
+        return None
     if df.empty:
-        print("Empty dataframe received")  # Debug log
+        return None
+
+    # Convert and sort dates
+    df['Date'] = pd.to_datetime(df['Date'])
+    latest_api_date = df['Date'].max()
+    logger.debug("Latest date from Habitica API: %s", latest_api_date)
+    return df
+
+def export_headers(credentials, validators=None):
+    """Auth, compression and conditional headers for the export request"""
+    headers = {
+        "x-api-user": credentials["api_id"],
+        "x-api-key": credentials["api_key"],
+        "Accept-Encoding": "gzip, deflate"
+    }
+    validators = validators or {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+@habitica_stage_latency.time(stage='fetch')
+def fetch_habitica_data(credentials, validators=None, timeout=None):
+    """Download and parse the user's history export.
+
+    Sends If-None-Match / If-Modified-Since from `validators` and returns
+    NOT_MODIFIED on a 304. The body is parsed in chunks straight off the
+    (gzip-decoded) socket; the response's own validators are attached as
+    df.attrs['validators'] so ingest can store them.
+    """
+    try:
+        with http_session.get(
+            HABITICA_EXPORT_URL,
+            headers=export_headers(credentials, validators),
+            timeout=(HABITICA_CONNECT_TIMEOUT, timeout or HABITICA_TIMEOUT),
+            stream=True
+        ) as response:
+            if response.status_code == 304:
+                logger.info("Habitica export not modified since last sync")
+                return NOT_MODIFIED
+            if response.status_code != 200:
+                logger.warning("Habitica API error", extra={"status": response.status_code})
+                return None
+            
+            response.raw.decode_content = True
+            df = parse_export(response.raw)
+        if df is None:
+            return None
+
+        df.attrs['validators'] = {
+            "etag": response.headers.get('ETag'),
+            "last_modified": response.headers.get('Last-Modified')
+        }
+        return df
+            
+    except Exception as e:
+        logger.error("Habitica request error: %s", e)
+        return None
+
+# The last 30 days of records plus the user's sync watermark in one round
+# trip, laid out as HabiticaHistory.CSV_COLUMNS with dates as day numbers.
+# The single-row subquery keeps the watermark even when the window is
+# empty; that row has NULL record columns and is dropped.
+USER_DATA_SQL = """
+    SELECT s.last_record_date - DATE '1970-01-01', r.task_name, r.task_value,
+           r.record_date - DATE '1970-01-01', r.task_type
+    FROM habitica_records r
+    RIGHT JOIN (SELECT %(user_id)s::int AS users_id) u ON r.users_id = u.users_id
+        AND r.record_date >= CURRENT_DATE - INTERVAL '30 days'
+    LEFT JOIN habitica_sync_state s ON s.users_id = u.users_id
+    ORDER BY r.record_date DESC
+"""
+
+def copy_history(cursor, query, params):
+    """Run `query` as COPY ... TO STDOUT and parse it straight into a HabiticaHistory"""
+    buffer = BytesIO()
+    statement = cursor.mogrify(query, params).decode()
+    cursor.copy_expert(f"COPY ({statement}) TO STDOUT WITH (FORMAT csv)", buffer)
+    buffer.seek(0)
+    return HabiticaHistory.from_csv(buffer)
+
+def fetch_user_data(user_id):
+    """The user's last 30 days of records, newest first, as a HabiticaHistory.
+
+    attrs['watermark'] is the newest record date ingested for the user
+    (None before the first sync).
+    """
+    ensure_schema()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            history = copy_history(cursor, USER_DATA_SQL, {"user_id": user_id})
+        finally:
+            cursor.close()
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Loaded Habitica window for user %s", user_id, extra={
+            "rows": len(history), "watermark": history.attrs['watermark'],
+            "latest_in_window": history.latest_date(), "bytes": history.nbytes
+        })
+    return history
+
+def filter_and_format_data(history, task_type=None, time_range='month'):
+    """Filter a HabiticaHistory based on criteria"""
+    if history.empty:
+        logger.debug("Empty history received")
         return {"Keys": [], "Values": [], "Dates": []}
     
     # Apply time filter
     today = pd.Timestamp.today()
     
     if time_range.lower() == 'day':
-        # Get the latest date in the dataset
-        latest_date = df['record_date'].max()
-        if pd.isnull(latest_date):
-            return {"Keys": [], "Values": [], "Dates": []}
-            
         # Set the threshold to the start of the latest date
-        threshold = latest_date.replace(hour=0, minute=0, second=0)
+        threshold = history.latest_date()
         end_date = threshold + pd.Timedelta(days=1)
-        print(f"Fetching latest data for {threshold.date()}")  # Debug log
+        logger.debug("Fetching latest data for %s", threshold.date())
     elif time_range.lower() == 'month':
         threshold = today - pd.Timedelta(days=30)
         end_date = today
@@ -70,110 +221,290 @@ def filter_and_format_data(df, task_type=None, time_range='month'):
         end_date = today
 
     # Filter data between threshold and end_date
-    filtered_df = df[
-        (df['record_date'] >= threshold) & 
-        (df['record_date'] < end_date)
-    ]
+    filtered = history.between(threshold, end_date)
     
-    print(f"Filtered data for {time_range}: {len(filtered_df)} records")  # Debug log
+    logger.debug("Filtered data for %s: %d records", time_range, len(filtered))
     
-    if filtered_df.empty:
-        print(f"No data found for {time_range} timeframe")  # Debug log
+    if filtered.empty:
+        logger.debug("No data found for %s timeframe", time_range)
         return {"Keys": [], "Values": [], "Dates": []}
 
     # Apply task type filter if specified
     if task_type:
-        filtered_df = filtered_df[filtered_df['task_type'].str.lower() == task_type.lower()]
-        print(f"After task type filter: {len(filtered_df)} records")  # Debug log
-
-    # Get unique tasks
-    unique_tasks = filtered_df['task_name'].unique()
+        filtered = filtered.of_type(task_type)
+        logger.debug("After task type filter: %d records", len(filtered))
 
     # For daily view, we just need the latest date's data
     if time_range.lower() == 'day':
-        date_range = [threshold]
+        date_range = pd.DatetimeIndex([threshold])
     else:
         date_range = pd.date_range(start=threshold, end=end_date)
 
-    # Prepare data lists
-    keys = []
-    values = []
-    dates = []
-
-    # Iterate through date range and tasks
-    for date in date_range:
-        for task in unique_tasks:
-            # Check if record exists for the current date and task
-            record = filtered_df[
-                (filtered_df['record_date'].dt.date == date.date()) & 
-                (filtered_df['task_name'] == task)
-            ]
-            
-            if not record.empty:
-                keys.append(task)
-                values.append(record['task_value'].values[0])
-                dates.append(date.strftime('%Y-%m-%d'))
-            else:
-                keys.append(task)
-                values.append(0.0)
-                dates.append(date.strftime('%Y-%m-%d'))
+    return build_task_grid(filtered, date_range)
+
+def build_task_grid(history, date_range):
+    """Lay records out on a dense date x task grid, zero-filling gaps.
+
+    Output is date-major, tasks in first-seen order; when several records
+    share a day and task the first one wins.
+    """
+    grid_days = (pd.DatetimeIndex(date_range).normalize() - EPOCH).days.to_numpy()
+
+    # Grid columns: task codes in order of first appearance
+    seen, first_seen = np.unique(history.name_codes, return_index=True)
+    task_order = seen[np.argsort(first_seen, kind='stable')]
+    task_column = np.zeros(len(history.task_names), dtype=np.intp)
+    task_column[task_order] = np.arange(len(task_order))
 
+    day_idx = np.searchsorted(grid_days, history.days)
+    on_grid = day_idx < len(grid_days)
+    on_grid[on_grid] = grid_days[day_idx[on_grid]] == history.days[on_grid]
+    task_idx = task_column[history.name_codes]
+
+    # First record per (day, task) among those on the grid
+    cells = day_idx[on_grid] * len(task_order) + task_idx[on_grid]
+    cells, first = np.unique(cells, return_index=True)
+    grid = np.zeros(len(grid_days) * len(task_order), dtype=float)
+    grid[cells] = history.values[on_grid][first]
+
+    task_names = np.array(history.task_names, dtype=object)[task_order]
+    date_labels = pd.DatetimeIndex(date_range).strftime('%Y-%m-%d')
+    # Values stay a float64 array; the JSON provider writes it without a list
     return {
-        "Keys": keys,
-        "Values": [float(v) for v in values],
-        "Dates": dates
+        "Keys": np.tile(task_names, len(grid_days)).tolist(),
+        "Values": grid,
+        "Dates": np.repeat(date_labels.to_numpy(dtype=object), len(task_order)).tolist()
     }
 
-def fetch_latest_records(user_id, task_type=None, time_range='month'):
+# pandas frequency whose periods line up with date_trunc(bucket, ...) in SQL
+ROLLUP_FREQ = {'day': 'D', 'week': 'W-MON', 'month': 'MS'}
+
+# Rollups in HabiticaHistory.CSV_COLUMNS layout; there is no watermark
+ROLLUP_DATA_SQL = """
+    SELECT NULL::int, task_name, task_value, period_start - DATE '1970-01-01', task_type
+    FROM habitica_rollups
+    WHERE users_id = %s
+    AND bucket = %s
+    AND period_start >= %s
+    ORDER BY period_start DESC
+"""
+
+def rollup_periods(bucket, days=365):
+    """Start dates of every bucket overlapping the last `days` days"""
+    today = pd.Timestamp.today().normalize()
+    start = today - pd.Timedelta(days=days)
+    if bucket == 'week':
+        start -= pd.Timedelta(days=start.weekday())
+    elif bucket == 'month':
+        start = start.replace(day=1)
+    return pd.date_range(start=start, end=today, freq=ROLLUP_FREQ[bucket])
+
+def fetch_rollup_data(user_id, bucket='week', days=365):
+    """Fetch pre-aggregated per-task series as a HabiticaHistory of period starts"""
+    ensure_schema()
+    since = rollup_periods(bucket, days)[0].date()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            return copy_history(cursor, ROLLUP_DATA_SQL, [user_id, bucket, since])
+        finally:
+            cursor.close()
+
+def format_rollup_series(history, task_type=None, bucket='week', days=365):
+    """Zero-filled per-task series over rollup periods, one point per bucket"""
+    if history.empty:
+        return {"Keys": [], "Values": [], "Dates": []}
+    if task_type:
+        history = history.of_type(task_type)
+    periods = rollup_periods(bucket, days)
+    return build_task_grid(history.between(periods[0]), periods)
+
+def fetch_latest_records(user_id, task_type=None, time_range='month', bucket='week'):
     """Main function to fetch and filter data"""
-    df = fetch_user_data(user_id)
-    return filter_and_format_data(df, task_type, time_range)
+    if time_range.lower() == 'year':
+        history = fetch_rollup_data(user_id, bucket)
+        return format_rollup_series(history, task_type, bucket)
+    history = fetch_user_data(user_id)
+    return filter_and_format_data(history, task_type, time_range)
+
+def history_hash(df):
+    """Order-independent digest of export rows (task, timestamp, value)"""
+    if df.empty:
+        return None
+    row_hashes = pd.util.hash_pandas_object(
+        df[['Task ID', 'Date', 'Value']].astype(str), index=False
+    ).to_numpy()
+    row_hashes.sort()
+    return hashlib.sha256(row_hashes.tobytes()).hexdigest()
+
+def prepare_records(df, user_id):
+    """Convert export rows to habitica_records columns in one vectorized pass"""
+    records = pd.DataFrame({
+        'users_id': user_id,
+        'record_date': pd.to_datetime(df['Date'], errors='coerce').dt.normalize(),
+        'task_name': df['Task Name'].astype(str),
+        'task_type': df['Task Type'].astype(str),
+        'task_value': pd.to_numeric(df['Value'], errors='coerce'),
+        'task_id': df['Task ID'].astype(str)
+    }, index=df.index)
+
+    invalid = records['record_date'].isna() | records['task_value'].isna()
+    if invalid.any():
+        logger.warning("Skipping %d rows with unparseable date or value", int(invalid.sum()))
+        records = records[~invalid]
+
+    # One row per task per day; later export rows win, as with row-by-row upserts
+    return records.drop_duplicates(subset=['task_id', 'record_date'], keep='last')
 
+def copy_records(cursor, records):
+    """Stream records into a staging table with COPY and merge them in one statement"""
+    buffer = StringIO()
+    # 17 significant digits round-trip float64 exactly
+    records.to_csv(buffer, index=False, header=False, date_format='%Y-%m-%d', float_format='%.17g')
+    buffer.seek(0)
+
+    cursor.execute("""
+        CREATE TEMP TABLE habitica_staging (
+            users_id INTEGER,
+            record_date DATE,
+            task_name TEXT,
+            task_type TEXT,
+            task_value DOUBLE PRECISION,
+            task_id TEXT
+        ) ON COMMIT DROP
+    """)
+    cursor.copy_expert("""
+        COPY habitica_staging
+        (users_id, record_date, task_name, task_type, task_value, task_id)
+        FROM STDIN WITH (FORMAT csv)
+    """, buffer)
+    cursor.execute("""
+        INSERT INTO habitica_records 
+        (users_id, record_date, task_name, task_type, task_value, task_id)
+        SELECT users_id, record_date, task_name, task_type, task_value, task_id
+        FROM habitica_staging
+        ON CONFLICT (users_id, task_id, record_date) 
+        DO UPDATE SET task_value = EXCLUDED.task_value
+    """)
+
+def refresh_rollups(cursor, user_id, since=None):
+    """Recompute rollup buckets touched by records on or after `since` (all if None)"""
+    for bucket in ROLLUP_FREQ:
+        cursor.execute("""
+            INSERT INTO habitica_rollups
+            (users_id, bucket, task_type, period_start, task_name, task_value)
+            SELECT users_id, %(bucket)s, task_type,
+                   date_trunc(%(bucket)s, record_date)::date,
+                   task_name, AVG(task_value)::double precision
+            FROM habitica_records
+            WHERE users_id = %(user_id)s
+            AND (%(since)s::date IS NULL OR record_date >= date_trunc(%(bucket)s, %(since)s::date))
+            GROUP BY users_id, task_type, date_trunc(%(bucket)s, record_date), task_name
+            ON CONFLICT (users_id, bucket, period_start, task_type, task_name)
+            DO UPDATE SET task_value = EXCLUDED.task_value
+        """, {"bucket": bucket, "user_id": user_id, "since": since})
+
+@habitica_stage_latency.time(stage='ingest')
 def process_habitica_data(df, user_id):
-    """Process incoming CSV data and sync with database"""
+    """Process incoming CSV data and sync with database.
+
+    Only rows on or after the user's sync watermark are written, unless the
+    history before the watermark no longer matches its stored hash, in
+    which case everything is re-synced. Returns written/skipped row counts.
+    """
     if df is None or df.empty:
-        print("No data to process")
-        return
-        
-    conn = connect_to_postgres()
-    cursor = conn.cursor()
-    
-    try:
-        # Process new records
-        records_to_insert = []
-        for _, row in df.iterrows():
-            try:
-                records_to_insert.append((user_id, pd.to_datetime(row['Date']).date(), str(row['Task Name']), str(row['Task Type']), float(row['Value']), str(row['Task ID'])))
-            except Exception as e:
-                print(f"Error processing row: {e}")
-                continue
-
-        # Batch insert new records
-        if records_to_insert:
-            try:
-                cursor.executemany("""
-                    INSERT INTO habitica_records 
-                    (users_id, record_date, task_name, task_type, task_value, task_id)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (users_id, task_id, record_date) 
-                    DO UPDATE SET task_value = EXCLUDED.task_value
-                """, records_to_insert)
-                conn.commit()
-            except Exception as e:
-                print(f"Database insertion error: {e}")
-                conn.rollback()
+        logger.info("No data to process")
+        return {"written": 0, "skipped": 0}
+
+    ensure_schema()
+    record_days = pd.to_datetime(df['Date'], errors='coerce').dt.normalize()
+    # Months past retention have no partition and are not stored
+    cutoff = retention_cutoff()
+    kept_days = record_days[record_days >= pd.Timestamp(cutoff)] if cutoff else record_days.dropna()
+    for attempt in range(2):
+        if not kept_days.empty:
+            # DDL in its own short transaction, before the ingest takes a connection
+            ensure_partitions(kept_days.min().date(), kept_days.max().date())
+        try:
+            return ingest_habitica_data(df, user_id, record_days, cutoff)
+        except CheckViolation:
+            # "no partition found for row": another process detached a month
+            # this one still had cached. Re-read the catalog and try once more
+            if attempt:
+                logger.exception("Habitica ingest failed for user %s", user_id)
                 raise
-    except Exception as e:
-        print(f"Process error: {e}")
-        conn.rollback()
-        raise
-    finally:
-        cursor.close()
-        conn.close()
+            logger.warning("Missing habitica_records partition for user %s, reloading", user_id)
+            reload_known_months()
+        except Exception:
+            logger.exception("Habitica ingest failed for user %s", user_id)
+            raise
+
+def ingest_habitica_data(df, user_id, record_days, cutoff):
+    """The transactional part of process_habitica_data"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+    
+        try:
+            cursor.execute("""
+                SELECT last_record_date, history_hash
+                FROM habitica_sync_state
+                WHERE users_id = %s
+            """, [user_id])
+            state = cursor.fetchone()
+
+            to_sync = df
+            if state and state[0] is not None:
+                watermark = pd.Timestamp(state[0])
+                before_watermark = record_days < watermark
+                if history_hash(df[before_watermark]) == state[1]:
+                    to_sync = df[~before_watermark]
+                else:
+                    logger.info("History before %s changed for user %s, full re-sync", state[0], user_id)
+
+            records = prepare_records(to_sync, user_id)
+            if cutoff:
+                records = records[records['record_date'] >= pd.Timestamp(cutoff)]
+            if not records.empty:
+                copy_records(cursor, records)
+
+                # Rebuild every bucket the first time, then only the touched ones
+                cursor.execute("SELECT 1 FROM habitica_rollups WHERE users_id = %s LIMIT 1", [user_id])
+                since = records['record_date'].min().date() if cursor.fetchone() else None
+                refresh_rollups(cursor, user_id, since)
+                bump_data_version(cursor, user_id, 'habitica')
+
+            # The latest day can still change upstream, so the new watermark
+            # hash only covers rows strictly before it.
+            new_watermark = record_days.max()
+            validators = df.attrs.get('validators', {})
+            cursor.execute("""
+                INSERT INTO habitica_sync_state
+                (users_id, last_record_date, history_hash, upstream_etag, upstream_last_modified, synced_at)
+                VALUES (%s, %s, %s, %s, %s, NOW())
+                ON CONFLICT (users_id)
+                DO UPDATE SET last_record_date = EXCLUDED.last_record_date,
+                              history_hash = EXCLUDED.history_hash,
+                              upstream_etag = EXCLUDED.upstream_etag,
+                              upstream_last_modified = EXCLUDED.upstream_last_modified,
+                              synced_at = EXCLUDED.synced_at
+            """, [user_id, new_watermark.date(), history_hash(df[record_days < new_watermark]),
+                  validators.get('etag'), validators.get('last_modified')])
+            conn.commit()
+            notify_user_data_changed(user_id, 'habitica')
+
+            written = len(records)
+            logger.info("Inserted/Updated %d records, skipped %d unchanged", written, len(df) - len(to_sync),
+                        extra={"user_id": user_id, "written": written, "skipped": len(df) - len(to_sync)})
+            return {"written": written, "skipped": len(df) - len(to_sync)}
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
 
-def graph_fetch(task_type=None, user_id=None, time_range='month'):
+def graph_fetch(task_type=None, user_id=None, time_range='month', bucket='week'):
     """Main function to fetch graph data with time range support"""
     if not user_id:
         return {"Keys": [], "Values": [], "Dates": []}
-    return fetch_latest_records(user_id, task_type, time_range)
+    return fetch_latest_records(user_id, task_type, time_range, bucket)
 
@@ -0,0 +1,134 @@
+from quart import Quart, Response, jsonify, request, g
+from quart.wrappers.response import DataBody
+from auth import register_user, login_user, issue_token, JWT_SECRET
+from async_db import close_async_pool
+from async_routes import (
+    async_api_bp,
+    async_sleep_bp,
+    async_gym_bp,
+    async_habitica_bp,
+    async_fallback_bp,
+    token_required,
+    close_http_client
+)
+from schema import ensure_schema
+from metrics import render, observe_request, CONTENT_TYPE
+from serialization import OrjsonProvider, compressible, negotiate_encoding, apply_encoding
+from log import configure_logging, request_id_var, log_request
+from dotenv import load_dotenv
+import asyncio
+import os
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Async serving mode: run with `hypercorn asgi:app`. main.py stays the sync entry
+# point and the only one with every route; see async_routes for the few that
+# answer 501 here.
+load_dotenv('.env.local')
+configure_logging()
+
+secret_key_flask = os.getenv('secret_key_flask')
+
+if not secret_key_flask or not JWT_SECRET:
+    raise RuntimeError("Missing required secret keys in environment variables")
+
+app = Quart(__name__)
+app.config['SECRET_KEY'] = secret_key_flask
+app.json = OrjsonProvider(app)
+
+@app.before_request
+async def start_timer():
+    # Each request is its own task, so the context var needs no reset
+    request_id_var.set(request.headers.get('X-Request-ID') or uuid.uuid4().hex)
+    g.request_started = time.perf_counter()
+
+# The same policy main.py gets from CORS(app, origins="*") with Flask-CORS defaults
+CORS_METHODS = ['DELETE', 'GET', 'HEAD', 'OPTIONS', 'PATCH', 'POST', 'PUT']
+
+@app.after_request
+async def allow_cors(response):
+    origin = request.headers.get('Origin')
+    response.headers['Access-Control-Allow-Origin'] = origin or '*'
+    if origin:
+        response.vary.add('Origin')
+    # Preflight: Quart answers OPTIONS itself, without running the view
+    requested_method = request.headers.get('Access-Control-Request-Method', '').upper()
+    if request.method == 'OPTIONS' and requested_method in CORS_METHODS:
+        requested_headers = request.headers.get('Access-Control-Request-Headers')
+        if requested_headers:
+            response.headers['Access-Control-Allow-Headers'] = requested_headers
+        response.headers['Access-Control-Allow-Methods'] = ', '.join(CORS_METHODS)
+    return response
+
+@app.after_request
+async def record_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        observe_request(request.method, route, response.status_code, time.perf_counter() - started)
+        log_request(request.method, request.full_path.rstrip('?'), response.status_code, started)
+    response.headers['X-Request-ID'] = request_id_var.get() or ''
+    return response
+
+@app.after_request
+async def compress_response(response):
+    # Streamed bodies (exports) go out as they are produced
+    if not isinstance(response.response, DataBody) or not compressible(response, request.method):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is not None:
+        apply_encoding(response, await response.get_data(), encoding)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    return Response(render(), content_type=CONTENT_TYPE)
+
+# Password hashing already runs in the auth process pool; to_thread only
+# keeps the wait for it off the event loop
+@app.route('/register', methods=['POST'])
+async def register():
+    data = await request.get_json()
+    result = await asyncio.to_thread(
+        register_user, data.get('username'), data.get('password'), data.get('email')
+    )
+    if result.get('error_type') == 'busy':
+        return jsonify(result), 503
+    return jsonify(result)
+
+@app.route('/login', methods=['POST'])
+async def login():
+    data = await request.get_json()
+    result = await asyncio.to_thread(login_user, data.get('username'), data.get('password'))
+    if result['status'] == 'success':
+        result['token'] = issue_token(result['user_id'])
+    elif result.get('error_type') == 'busy':
+        return jsonify(result), 503
+    return jsonify(result)
+
+@app.route('/logout', methods=['POST'])
+@token_required
+async def logout(current_user_id):
+    return jsonify({"status": "success", "message": "Logged out successfully"})
+
+app.register_blueprint(async_api_bp)
+app.register_blueprint(async_habitica_bp)
+app.register_blueprint(async_sleep_bp)
+app.register_blueprint(async_gym_bp)
+app.register_blueprint(async_fallback_bp)
+
+@app.before_serving
+async def startup():
+    try:
+        await asyncio.to_thread(ensure_schema)
+    except Exception as e:
+        logger.error("Schema setup failed: %s", e)
+
+@app.after_serving
+async def shutdown():
+    await close_http_client()
+    await close_async_pool()
@@ -0,0 +1,41 @@
+import asyncpg
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+
+load_dotenv('.env.local')
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+async def get_async_pool():
+    """Process-wide asyncpg pool, sized like the sync pool (db_pool_min / db_pool_max)"""
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    database=os.getenv('dbname'),
+                    user=os.getenv('user_name'),
+                    password=os.getenv('password'),
+                    host='localhost',
+                    port=5432,
+                    min_size=int(os.getenv('db_pool_min', 1)),
+                    max_size=int(os.getenv('db_pool_max', 10)),
+                    timeout=float(os.getenv('db_pool_timeout', 5))
+                )
+    return _pool
+
+@asynccontextmanager
+async def async_connection():
+    """Borrow a pooled asyncpg connection; released even if the block raises"""
+    pool = await get_async_pool()
+    async with pool.acquire(timeout=float(os.getenv('db_pool_timeout', 5))) as conn:
+        yield conn
+
+async def close_async_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
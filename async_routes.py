@@ -0,0 +1,713 @@
+"""Quart counterparts of the Flask blueprints, served by asgi.py.
+
+ASGI mode serves /user/api, /user/sleep and /user/gym (create, page,
+week, series), /user/habitica with its daily, habit and sync routes, plus
+/register, /login, /logout and /metrics in asgi.py. GET routes carry the
+same ETags / 304s and use the same response cache entries as main.py.
+
+The batch and export routes and /user/dashboard are only served by
+main.py; here they answer 501 (see SYNC_ONLY_ROUTES).
+
+Habitica frames share habitica.user_data_cache, keyed on the data version
+like the sync routes, and sync job state is read and written through
+asyncpg. Only parsing and ingesting a downloaded export run in threads,
+on the pandas / psycopg2 COPY pipeline of Fetch_Habitica.
+"""
+from quart import Blueprint, current_app, jsonify, request, g
+from contextlib import asynccontextmanager
+from functools import wraps
+from datetime import datetime
+from io import BufferedReader, BytesIO, RawIOBase
+import asyncio
+import json
+import os
+import httpx
+import orjson
+from async_db import async_connection
+from auth import verify_token
+from cache import CACHED_HEADERS, notify_user_data_changed, response_cache, response_key_prefix
+from export import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, page_cursor, parse_page_cursor
+from habitica_sync import (
+    SYNC_BACKOFF_BASE,
+    SYNC_BACKOFF_MAX,
+    SYNC_LOCK_NAMESPACE,
+    SYNC_STALE_AFTER,
+    CLAIM_JOB_SQL,
+    LOAD_JOB_SQL,
+    MARK_RUNNING_SQL,
+    RECORD_DONE_SQL,
+    RECORD_FAILED_SQL,
+    SyncInProgress,
+    SyncJob
+)
+from metrics import habitica_stage_latency
+from habitica import user_data_cache, format_task_series, SYNC_MAX_AGE
+from habitica_history import HabiticaHistory
+from serialization import rows_payload
+from api_page import API_RECORD_COLUMNS
+from gym import GYM_COLUMNS, GYM_PAGE_SQL, GYM_SERIES_AGGREGATE
+from sleep import SLEEP_SERIES_AGGREGATE
+from series import SERIES_SQL, series_params, series_payload, series_window
+from versions import DATA_VERSIONS_SQL, version_tag
+from Fetch_Habitica import (
+    HABITICA_EXPORT_URL,
+    HABITICA_TIMEOUT,
+    HABITICA_CONNECT_TIMEOUT,
+    ROLLUP_FREQ,
+    NOT_MODIFIED,
+    USER_DATA_SQL,
+    ROLLUP_DATA_SQL,
+    export_headers,
+    parse_export,
+    process_habitica_data,
+    rollup_periods
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+async_api_bp = Blueprint('async_api', __name__)
+async_sleep_bp = Blueprint('async_sleep', __name__)
+async_gym_bp = Blueprint('async_gym', __name__)
+async_habitica_bp = Blueprint('async_habitica', __name__)
+async_fallback_bp = Blueprint('async_fallback', __name__)
+
+def asyncpg_query(query, names):
+    """`query` with its %(name)s placeholders numbered $1, $2, ... in `names` order"""
+    for number, name in enumerate(names, 1):
+        query = query.replace(f'%({name})s', f'${number}')
+    return query
+
+BUMP_VERSION_SQL = """
+    INSERT INTO user_data_versions (users_id, domain, version)
+    VALUES ($1, $2, 1)
+    ON CONFLICT (users_id, domain)
+    DO UPDATE SET version = user_data_versions.version + 1
+"""
+
+# series.SERIES_SQL placeholders in asyncpg form, in series_params() order.
+# Dates are cast explicitly; asyncpg won't bind a date to a timestamp
+SERIES_PLACEHOLDERS = (
+    ('%(user_id)s', '$1'), ('%(bucket)s', '$2'), ('%(start)s', '$3::date'), ('%(end)s', '$4::date')
+)
+
+async def date_series(user_id, aggregate, days, bucket='day'):
+    """Async counterpart of series.date_series"""
+    query = SERIES_SQL.replace('{aggregate}', aggregate)
+    for name, placeholder in SERIES_PLACEHOLDERS:
+        query = query.replace(name, placeholder)
+    params = series_params(user_id, days, bucket)
+    async with async_connection() as conn:
+        records = await conn.fetch(query, params['user_id'], params['bucket'], params['start'], params['end'])
+    return series_payload(records)
+
+def token_required(f):
+    """Async counterpart of auth.token_required, sharing its verified-token cache"""
+    @wraps(f)
+    async def decorated(*args, **kwargs):
+        token = request.headers.get('Authorization')
+        if not token:
+            return jsonify({'message': 'Token is missing'}), 401
+        try:
+            token = token.split()[1]  # Remove 'Bearer ' prefix
+            payload = verify_token(token)
+            current_user_id = payload['user_id']
+        except Exception:
+            return jsonify({'message': 'Token is invalid'}), 401
+        g.user_id = current_user_id
+        g.token_payload = payload
+        return await f(current_user_id, *args, **kwargs)
+    return decorated
+
+async def data_versions(user_id, domains):
+    """Async counterpart of versions.data_versions"""
+    async with async_connection() as conn:
+        rows = await conn.fetch(DATA_VERSIONS_SQL.replace('%s', '$1', 1).replace('%s', '$2', 1),
+                                user_id, list(domains))
+    versions = {domain: version for domain, version in rows}
+    return [versions.get(domain, 0) for domain in domains]
+
+def conditional_get(*domains):
+    """Async counterpart of versions.conditional_get, with the same ETags,
+    so a tag from either app is honoured by the other"""
+    def decorator(f):
+        @wraps(f)
+        async def decorated(current_user_id, *args, **kwargs):
+            if request.method != 'GET':
+                return await f(current_user_id, *args, **kwargs)
+            versions = await data_versions(current_user_id, domains)
+            g.data_versions = dict(zip(domains, versions))
+            tag = version_tag(current_user_id, domains, versions, request.full_path)
+            g.data_version_tag = tag
+            if request.if_none_match.contains_weak(tag):
+                response = current_app.response_class(status=304)
+                response.set_etag(tag)
+                return response
+            response = await current_app.make_response(await f(current_user_id, *args, **kwargs))
+            if response.status_code == 200 and not g.get('response_uncacheable'):
+                response.set_etag(tag)
+            return response
+        return decorated
+    return decorator
+
+def cached_response(domain):
+    """Async counterpart of cache.cached_response, on the same cache and keys"""
+    def decorator(f):
+        @wraps(f)
+        async def decorated(current_user_id, *args, **kwargs):
+            key = response_key_prefix(current_user_id, domain) + request.full_path
+            if 'data_version_tag' in g:
+                key += '|' + g.data_version_tag
+            entry = response_cache.get(key)
+            if entry is not None:
+                headers, body = entry.split(b'\n', 1)
+                response = current_app.response_class(body, mimetype='application/json')
+                response.headers.update(json.loads(headers))
+                response.headers['X-Cache'] = 'HIT'
+                return response
+            response = await current_app.make_response(await f(current_user_id, *args, **kwargs))
+            if (response.status_code == 200 and response.mimetype == 'application/json'
+                    and not g.get('response_uncacheable')):
+                headers = {h: response.headers[h] for h in CACHED_HEADERS if h in response.headers}
+                response_cache.set(key, json.dumps(headers).encode() + b'\n' + await response.get_data())
+                response.headers['X-Cache'] = 'MISS'
+            return response
+        return decorated
+    return decorator
+
+def page_limit():
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return None
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+# --- api records ---
+
+@async_api_bp.route('/user/api', methods=['GET', 'POST', 'PUT', 'DELETE'])
+@token_required
+@conditional_get('api')
+async def handle_api_records(current_user_id):
+    async with async_connection() as conn:
+        if request.method == 'GET':
+            records = await conn.fetch("""
+                SELECT api_record_id, api_type, api_id, api_key
+                FROM api_records
+                WHERE users_id = $1
+            """, current_user_id)
+            return jsonify(rows_payload(API_RECORD_COLUMNS, records, request.args))
+
+        data = await request.get_json()
+        try:
+            async with conn.transaction():
+                if request.method == 'POST':
+                    new_id = await conn.fetchval("""
+                        INSERT INTO api_records (api_type, users_id, api_id, api_key)
+                        VALUES ($1, $2, $3, $4)
+                        RETURNING api_record_id
+                    """, data['type'], current_user_id, data['api_id'], data['api_key'])
+                    result = {'id': new_id, 'message': 'API record created successfully'}
+                elif request.method == 'PUT':
+                    await conn.execute("""
+                        UPDATE api_records
+                        SET api_type = $1, api_id = $2, api_key = $3
+                        WHERE api_record_id = $4 AND users_id = $5
+                    """, data['type'], data['api_id'], data['api_key'], data['id'], current_user_id)
+                    result = {'message': 'API record updated successfully'}
+                else:
+                    await conn.execute("""
+                        DELETE FROM api_records
+                        WHERE api_record_id = $1 AND users_id = $2
+                    """, data['id'], current_user_id)
+                    result = {'message': 'API record deleted successfully'}
+                await conn.execute(BUMP_VERSION_SQL, current_user_id, 'api')
+            return jsonify(result)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 400
+
+# --- sleep ---
+
+@async_sleep_bp.route('/user/sleep', methods=['POST'])
+@token_required
+async def add_sleep_record(current_user_id):
+    data = await request.get_json()
+    hours = data.get('hours')
+    date = data.get('date')
+
+    if not all([hours, date]):
+        return jsonify({"error": "Missing required fields"}), 400
+
+    try:
+        hours = int(hours)
+        date = datetime.strptime(date, '%Y-%m-%d').date()
+    except (ValueError, TypeError):
+        return jsonify({"error": "Invalid data format"}), 400
+
+    try:
+        async with async_connection() as conn:
+            async with conn.transaction():
+                record_id = await conn.fetchval("""
+                    INSERT INTO sleep_records (users_id, hours, record_date)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (users_id, record_date)
+                    DO UPDATE SET hours = EXCLUDED.hours
+                    RETURNING sleep_record_id
+                """, current_user_id, hours, date)
+                await conn.execute(BUMP_VERSION_SQL, current_user_id, 'sleep')
+        notify_user_data_changed(current_user_id, 'sleep')
+        return jsonify({"message": "Sleep record saved", "id": record_id}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@async_sleep_bp.route('/user/sleep', methods=['GET'])
+@token_required
+@conditional_get('sleep')
+@cached_response('sleep')
+async def get_sleep_records(current_user_id):
+    limit = page_limit()
+    before = request.args.get('before')
+    try:
+        before = datetime.strptime(before, '%Y-%m-%d').date() if before else None
+    except ValueError:
+        return jsonify({"error": "Invalid data format"}), 400
+    if limit is None:
+        return jsonify({"error": "Invalid data format"}), 400
+
+    try:
+        async with async_connection() as conn:
+            records = await conn.fetch("""
+                SELECT hours, record_date
+                FROM sleep_records
+                WHERE users_id = $1
+                AND ($2::date IS NULL OR record_date < $2::date)
+                ORDER BY record_date DESC
+                LIMIT $3
+            """, current_user_id, before, limit)
+        response = jsonify(rows_payload(['hours', 'date'], records, request.args))
+        if len(records) == limit:
+            response.headers['X-Next-Before'] = records[-1][1].isoformat()
+        return response, 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@async_sleep_bp.route('/user/sleep/week', methods=['GET'])
+@token_required
+@conditional_get('sleep')
+@cached_response('sleep')
+async def get_weekly_sleep(current_user_id):
+    """Same zero-filled series as sleep.weekly_sleep_series"""
+    try:
+        return jsonify(await date_series(current_user_id, SLEEP_SERIES_AGGREGATE, 7)), 200
+    except Exception as e:
+        logger.exception("Error in get_weekly_sleep")
+        return jsonify({"error": str(e)}), 500
+
+@async_sleep_bp.route('/user/sleep/series', methods=['GET'])
+@token_required
+@conditional_get('sleep')
+@cached_response('sleep')
+async def get_sleep_series(current_user_id):
+    """Same series as sleep.get_sleep_series"""
+    bucket = request.args.get('bucket', 'day')
+    days, error = series_window(request.args.get('range', 'month'), bucket)
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        return jsonify(await date_series(current_user_id, SLEEP_SERIES_AGGREGATE, days, bucket)), 200
+    except Exception as e:
+        logger.exception("Error in get_sleep_series")
+        return jsonify({"error": str(e)}), 500
+
+# --- gym ---
+
+@async_gym_bp.route('/user/gym', methods=['POST'])
+@token_required
+async def add_gym_record(current_user_id):
+    data = await request.get_json()
+    start_time = data.get('start_time')
+    end_time = data.get('end_time')
+    exercise_title = data.get('exercise_title')
+    exercise_notes = data.get('exercise_notes')
+
+    if not all([start_time, end_time, exercise_title]):
+        return jsonify({"error": "Missing required fields"}), 400
+
+    try:
+        start_time = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
+        end_time = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
+    except ValueError:
+        return jsonify({"error": "Invalid datetime format"}), 400
+
+    try:
+        async with async_connection() as conn:
+            async with conn.transaction():
+                record_id = await conn.fetchval("""
+                    INSERT INTO gym_records
+                    (users_id, start_time, end_time, exercise_title, exercise_notes)
+                    VALUES ($1, $2, $3, $4, $5)
+                    RETURNING gym_record_id
+                """, current_user_id, start_time, end_time, exercise_title, exercise_notes)
+                await conn.execute(BUMP_VERSION_SQL, current_user_id, 'gym')
+        notify_user_data_changed(current_user_id, 'gym')
+        return jsonify({"message": "Gym record saved", "id": record_id}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# gym.GYM_PAGE_SQL with asyncpg placeholders
+ASYNC_GYM_PAGE_SQL = (
+    GYM_PAGE_SQL.replace('%(user_id)s', '$1').replace('%(before)s', '$2')
+    .replace('%(before_id)s', '$3::int').replace('%(limit)s', '$4')
+)
+
+@async_gym_bp.route('/user/gym', methods=['GET'])
+@token_required
+@conditional_get('gym')
+@cached_response('gym')
+async def get_gym_records(current_user_id):
+    limit = page_limit()
+    before = request.args.get('before')
+    try:
+        before, before_id = parse_page_cursor(before) if before else (None, None)
+    except ValueError:
+        return jsonify({"error": "Invalid datetime format"}), 400
+    if limit is None:
+        return jsonify({"error": "Invalid data format"}), 400
+
+    try:
+        async with async_connection() as conn:
+            records = await conn.fetch(ASYNC_GYM_PAGE_SQL, current_user_id, before, before_id, limit)
+        response = jsonify(rows_payload(GYM_COLUMNS, [r[:4] for r in records], request.args))
+        if len(records) == limit:
+            response.headers['X-Next-Before'] = page_cursor(records[-1][0], records[-1][4])
+        return response, 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@async_gym_bp.route('/user/gym/week', methods=['GET'])
+@token_required
+@conditional_get('gym')
+@cached_response('gym')
+async def get_weekly_gym(current_user_id):
+    """Same zero-filled series as gym.weekly_gym_series"""
+    try:
+        return jsonify(await date_series(current_user_id, GYM_SERIES_AGGREGATE, 8)), 200
+    except Exception as e:
+        logger.exception("Error in get_weekly_gym")
+        return jsonify({"error": str(e)}), 500
+
+@async_gym_bp.route('/user/gym/series', methods=['GET'])
+@token_required
+@conditional_get('gym')
+@cached_response('gym')
+async def get_gym_series(current_user_id):
+    """Same series as gym.get_gym_series"""
+    bucket = request.args.get('bucket', 'day')
+    days, error = series_window(request.args.get('range', 'month'), bucket)
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        return jsonify(await date_series(current_user_id, GYM_SERIES_AGGREGATE, days, bucket)), 200
+    except Exception as e:
+        logger.exception("Error in get_gym_series")
+        return jsonify({"error": str(e)}), 500
+
+# --- habitica ---
+
+# One AsyncClient per worker: keep-alive, gzip, and connect retries
+_http_client = None
+
+def http_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HABITICA_TIMEOUT, connect=HABITICA_CONNECT_TIMEOUT),
+            transport=httpx.AsyncHTTPTransport(retries=int(os.getenv('habitica_retries', 3)))
+        )
+    return _http_client
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+async def _next_chunk(chunks):
+    try:
+        return await chunks.__anext__()
+    except StopAsyncIteration:
+        return None
+
+class StreamReader(RawIOBase):
+    """Blocking file-like view of an async byte stream, for a worker thread.
+
+    Each read pulls the next chunk through the event loop, so the parser
+    only ever holds one chunk and the loop is never blocked.
+    """
+
+    def __init__(self, chunks, loop):
+        self._chunks = chunks
+        self._loop = loop
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            chunk = asyncio.run_coroutine_threadsafe(_next_chunk(self._chunks), self._loop).result()
+            if chunk is None:
+                return 0
+            self._pending = chunk
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+async def fetch_habitica_data(credentials, validators=None):
+    """Async export download; same contract as Fetch_Habitica.fetch_habitica_data.
+
+    The (decoded) body is parsed chunk by chunk in a worker thread as it
+    arrives, like the sync path, instead of being buffered whole.
+    """
+    with habitica_stage_latency.time(stage='fetch'):
+        async with http_client().stream(
+            'GET', HABITICA_EXPORT_URL, headers=export_headers(credentials, validators)
+        ) as response:
+            if response.status_code == 304:
+                return NOT_MODIFIED
+            if response.status_code != 200:
+                logger.warning("Habitica API error", extra={"status": response.status_code})
+                return None
+            reader = BufferedReader(StreamReader(response.aiter_bytes(), asyncio.get_running_loop()))
+            df = await asyncio.to_thread(parse_export, reader)
+    if df is not None:
+        df.attrs['validators'] = {
+            "etag": response.headers.get('ETag'),
+            "last_modified": response.headers.get('Last-Modified')
+        }
+    return df
+
+async def habitica_credentials(user_id):
+    async with async_connection() as conn:
+        return await conn.fetchrow("""
+            SELECT api_id, api_key
+            FROM api_records
+            WHERE users_id = $1 AND api_type = 'habitica'
+            LIMIT 1
+        """, user_id)
+
+async def sync_user(user_id):
+    async with async_connection() as conn:
+        credentials = await conn.fetchrow("""
+            SELECT api_id, api_key
+            FROM api_records
+            WHERE users_id = $1 AND api_type = 'habitica'
+            LIMIT 1
+        """, user_id)
+        state = await conn.fetchrow("""
+            SELECT upstream_etag, upstream_last_modified
+            FROM habitica_sync_state
+            WHERE users_id = $1
+        """, user_id)
+    if not credentials:
+        raise LookupError("No Habitica API credentials found")
+    validators = {"etag": state[0], "last_modified": state[1]} if state else {}
+    df = await fetch_habitica_data({"api_id": credentials[0], "api_key": credentials[1]}, validators)
+    if df is NOT_MODIFIED:
+        return {"written": 0, "skipped": 0, "not_modified": True}
+    if df is None:
+        raise RuntimeError("Failed to fetch Habitica data")
+    # Ingest shares the COPY-based sync pipeline; it is short next to the download
+    return await asyncio.to_thread(process_habitica_data, df, user_id)
+
+@asynccontextmanager
+async def user_sync_lock(user_id):
+    """asyncpg counterpart of habitica_sync.user_sync_lock"""
+    async with async_connection() as conn:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock($1, $2)", SYNC_LOCK_NAMESPACE, user_id):
+            raise SyncInProgress(f"Habitica sync already running for user {user_id}")
+        try:
+            yield
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1, $2)", SYNC_LOCK_NAMESPACE, user_id)
+
+def job_from_record(user_id, record):
+    """SyncJob from an asyncpg row of habitica_sync.JOB_COLUMNS; jsonb arrives as text"""
+    values = list(record)
+    if values[4] is not None:
+        values[4] = orjson.loads(values[4])
+    return SyncJob.from_row(user_id, values)
+
+async def load_job(user_id):
+    """Async counterpart of habitica_sync.load_job"""
+    async with async_connection() as conn:
+        row = await conn.fetchrow(asyncpg_query(LOAD_JOB_SQL, ['user_id']), user_id)
+    if row is None or row[0] is None:
+        return None
+    return job_from_record(user_id, row)
+
+async def claim_job(user_id, max_age=None):
+    """Async counterpart of habitica_sync.claim_job, in the same single statement"""
+    async with async_connection() as conn:
+        row = await conn.fetchrow(
+            asyncpg_query(CLAIM_JOB_SQL, ['user_id', 'stale', 'max_age']),
+            user_id, SYNC_STALE_AFTER, float(max_age) if max_age is not None else None
+        )
+    if row is None:
+        # The row was inserted concurrently, after this statement's snapshot
+        return await load_job(user_id), False
+    return job_from_record(user_id, row[1:]), row[0]
+
+async def mark_running(user_id):
+    async with async_connection() as conn:
+        await conn.execute(asyncpg_query(MARK_RUNNING_SQL, ['user_id']), user_id)
+
+async def record_result(user_id, result=None, error=None):
+    """Async counterpart of habitica_sync.record_result"""
+    async with async_connection() as conn:
+        if error is None:
+            await conn.execute(asyncpg_query(RECORD_DONE_SQL, ['result', 'user_id']),
+                               orjson.dumps(result).decode(), user_id)
+        else:
+            await conn.execute(asyncpg_query(RECORD_FAILED_SQL, ['error', 'base', 'max', 'user_id']),
+                               error, SYNC_BACKOFF_BASE, SYNC_BACKOFF_MAX, user_id)
+
+async def _run_sync(user_id):
+    """Async counterpart of habitica_sync.run_job; job state is shared with the sync workers"""
+    await mark_running(user_id)
+    try:
+        async with user_sync_lock(user_id):
+            result = await sync_user(user_id)
+    except SyncInProgress:
+        logger.info("Habitica sync for user %s already running elsewhere", user_id)
+        return
+    except Exception as e:
+        logger.error("Habitica sync failed for user %s: %s", user_id, e)
+        await record_result(user_id, None, str(e))
+        return
+    await record_result(user_id, result)
+
+# Strong references to running sync tasks; the loop only keeps weak ones
+_sync_tasks = set()
+
+async def submit_sync(user_id, max_age=None):
+    """Start a background sync unless one is in flight (or fresh or backing off, given max_age)"""
+    job, claimed = await claim_job(user_id, max_age)
+    if claimed:
+        task = asyncio.get_running_loop().create_task(_run_sync(user_id))
+        _sync_tasks.add(task)
+        task.add_done_callback(_sync_tasks.discard)
+    return job
+
+async def copy_history(conn, query, *args):
+    """asyncpg counterpart of Fetch_Habitica.copy_history"""
+    chunks = []
+
+    async def collect(data):
+        chunks.append(data)
+    await conn.copy_from_query(query, *args, output=collect, format='csv')
+    return HabiticaHistory.from_csv(BytesIO(b''.join(chunks)))
+
+async def fetch_user_data(user_id):
+    """Same single round trip as Fetch_Habitica.fetch_user_data, watermark included"""
+    async with async_connection() as conn:
+        return await copy_history(conn, USER_DATA_SQL.replace('%(user_id)s', '$1'), user_id)
+
+async def fetch_rollup_data(user_id, bucket):
+    async with async_connection() as conn:
+        return await copy_history(conn, ROLLUP_DATA_SQL % ('$1', '$2', '$3'),
+                                  user_id, bucket, rollup_periods(bucket)[0].date())
+
+async def habitica_version(user_id):
+    """Async counterpart of versions.current_version(user_id, 'habitica')"""
+    known = g.get('data_versions') or {}
+    if 'habitica' in known:
+        return known['habitica']
+    return (await data_versions(user_id, ['habitica']))[0]
+
+async def habitica_frame(user_id, time_range, bucket):
+    """Same cache and version-keyed entries as the sync routes; loads go through asyncpg on a miss"""
+    version = await habitica_version(user_id)
+    if time_range.lower() == 'year':
+        key, loader = (user_id, 'rollup', bucket, version), lambda: fetch_rollup_data(user_id, bucket)
+    else:
+        key, loader = (user_id, 'records', version), lambda: fetch_user_data(user_id)
+    history = user_data_cache.get(key)
+    if history is None:
+        history = await loader()
+        user_data_cache.set(key, history)
+    return history
+
+async def task_series(user_id, task_type):
+    time_range = request.args.get('time_range', 'month')
+    bucket = request.args.get('bucket', 'week')
+    if bucket not in ROLLUP_FREQ:
+        return jsonify({"error": "Invalid bucket", "Keys": [], "Values": [], "Dates": []}), 400
+    try:
+        history = await habitica_frame(user_id, time_range, bucket)
+        return jsonify(format_task_series(history, task_type, time_range, bucket))
+    except Exception as e:
+        return jsonify({"error": str(e), "Keys": [], "Values": [], "Dates": []}), 500
+
+@async_habitica_bp.route('/user/habitica', methods=['GET'])
+@token_required
+async def get_habitica_stats(current_user_id):
+    time_range = request.args.get('time_range', 'month')
+    bucket = request.args.get('bucket', 'week')
+    if bucket not in ROLLUP_FREQ:
+        return jsonify({"error": "Invalid bucket"}), 400
+    if not await habitica_credentials(current_user_id):
+        return jsonify({"error": "No Habitica API credentials found"}), 404
+    job = await submit_sync(current_user_id, max_age=SYNC_MAX_AGE)
+    try:
+        history = await habitica_frame(current_user_id, time_range, bucket)
+        data = format_task_series(history, None, time_range, bucket)
+        data["Sync"] = job.to_dict()
+        return jsonify(data)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@async_habitica_bp.route('/user/habitica/daily', methods=['GET'])
+@token_required
+@conditional_get('habitica')
+@cached_response('habitica')
+async def get_habitica_daily(current_user_id):
+    return await task_series(current_user_id, 'daily')
+
+@async_habitica_bp.route('/user/habitica/habit', methods=['GET'])
+@token_required
+@conditional_get('habitica')
+@cached_response('habitica')
+async def get_habitica_habit(current_user_id):
+    return await task_series(current_user_id, 'habit')
+
+@async_habitica_bp.route('/user/habitica/sync', methods=['POST'])
+@token_required
+async def trigger_habitica_sync(current_user_id):
+    job = await submit_sync(current_user_id)
+    return jsonify(job.to_dict()), 202
+
+@async_habitica_bp.route('/user/habitica/sync', methods=['GET'])
+@token_required
+async def get_habitica_sync(current_user_id):
+    job = await load_job(current_user_id)
+    if job is None:
+        return jsonify({"error": "No sync has been requested"}), 404
+    return jsonify(job.to_dict())
+
+# --- routes only main.py serves ---
+
+# Flask routes without an ASGI port: (rule, methods)
+SYNC_ONLY_ROUTES = [
+    ('/user/sleep/batch', ['POST']),
+    ('/user/sleep/export', ['GET']),
+    ('/user/gym/batch', ['POST']),
+    ('/user/gym/export', ['GET']),
+    ('/user/dashboard', ['GET']),
+]
+
+async def not_ported():
+    return jsonify({"error": "Not available in ASGI mode; this route is served by main.py"}), 501
+
+for rule, methods in SYNC_ONLY_ROUTES:
+    async_fallback_bp.add_url_rule(rule, rule.strip('/').replace('/', '_'), not_ported, methods=methods)
@@ -1,75 +1,227 @@
 from werkzeug.security import check_password_hash, generate_password_hash
-from db import connect_to_postgres
+from db import get_connection
+from flask import jsonify, request, g
+from functools import wraps
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import datetime
+from datetime import UTC
+import hashlib
+import threading
+import time
+import jwt
 import os
 from dotenv import load_dotenv
+import logging
+
+logger = logging.getLogger(__name__)
 
 load_dotenv('.env.local')
 
+# Loaded once; main.py refuses to start without it
+JWT_SECRET = os.getenv('secret_key_jwt')
+TOKEN_LIFETIME = datetime.timedelta(hours=24)
+
+class VerifiedTokenCache:
+    """Bounded LRU of already-verified token payloads, keyed by token digest.
+
+    Entries are dropped once the token's ``exp`` passes, so a cached token
+    never outlives the validity jwt.decode would grant it.
+    """
+
+    def __init__(self, max_entries=4096, default_ttl=300):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            payload, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return payload
+
+    def set(self, digest, payload):
+        expires_at = payload.get('exp', time.time() + self.default_ttl)
+        with self._lock:
+            self._entries[digest] = (payload, expires_at)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+token_cache = VerifiedTokenCache(max_entries=int(os.getenv('token_cache_size', 4096)))
+
+def issue_token(user_id):
+    return jwt.encode({
+        'user_id': user_id,
+        'exp': datetime.datetime.now(UTC) + TOKEN_LIFETIME
+    }, JWT_SECRET)
+
+def verify_token(token):
+    """Return the token's payload, verifying the signature only on a cache miss"""
+    digest = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(digest)
+    if payload is None:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        token_cache.set(digest, payload)
+    return payload
+
+def token_required(f):
+    """Require a Bearer token; passes user_id and sets g.user_id / g.token_payload"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        token = request.headers.get('Authorization')
+        if not token:
+            return jsonify({'message': 'Token is missing'}), 401
+        try:
+            token = token.split()[1]  # Remove 'Bearer ' prefix
+            payload = verify_token(token)
+            current_user_id = payload['user_id']
+        except Exception:
+            return jsonify({'message': 'Token is invalid'}), 401
+        g.user_id = current_user_id
+        g.token_payload = payload
+        return f(current_user_id, *args, **kwargs)
+    return decorated
+
+class HashingBusy(Exception):
+    """Too many password hashes are already queued"""
+
+# Werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000".
+# Stored hashes created under a different policy are upgraded on next login.
+PASSWORD_HASH_METHOD = os.getenv('password_hash_method', 'scrypt:32768:8:1')
+HASH_WORKERS = int(os.getenv('password_hash_workers', 2))
+HASH_MAX_PENDING = int(os.getenv('password_hash_max_pending', HASH_WORKERS * 8))
+HASH_QUEUE_TIMEOUT = float(os.getenv('password_hash_queue_timeout', 2))
+
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+_hash_slots = threading.BoundedSemaphore(max(HASH_MAX_PENDING, 1))
+_policy_prefix = None
+
+def _get_hash_pool():
+    global _hash_pool
+    if _hash_pool is None:
+        with _hash_pool_lock:
+            if _hash_pool is None:
+                # spawn, not fork: the web server process is multi-threaded
+                _hash_pool = ProcessPoolExecutor(
+                    max_workers=HASH_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+    return _hash_pool
+
+def _run_hashing(fn, *args):
+    """Run a CPU-bound hash call in the process pool, or inline if it is disabled.
+
+    At most HASH_MAX_PENDING calls may be queued or running; callers wait up
+    to HASH_QUEUE_TIMEOUT seconds for a slot and then get HashingBusy.
+    """
+    if HASH_WORKERS <= 0:
+        return fn(*args)
+    if not _hash_slots.acquire(timeout=HASH_QUEUE_TIMEOUT):
+        raise HashingBusy("Password hashing queue is full")
+    try:
+        return _get_hash_pool().submit(fn, *args).result()
+    finally:
+        _hash_slots.release()
+
+def hash_password(password):
+    return _run_hashing(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def verify_password(stored_hash, password):
+    return _run_hashing(check_password_hash, stored_hash, password)
+
+def needs_rehash(stored_hash):
+    """True if stored_hash was not produced by the current hashing policy"""
+    global _policy_prefix
+    if _policy_prefix is None:
+        # Werkzeug expands defaults ("pbkdf2" -> "pbkdf2:sha256:600000"), so
+        # ask it for the normalised method string instead of parsing ourselves
+        _policy_prefix = generate_password_hash('', PASSWORD_HASH_METHOD).split('$', 1)[0]
+    return stored_hash.split('$', 1)[0] != _policy_prefix
+
+BUSY_RESULT = {
+    "status": "error",
+    "error_type": "busy",
+    "message": "Server is busy, please try again shortly."
+}
+
 def register_user(username, password, email):
-    connection = connect_to_postgres(
-        os.getenv('dbname'), 
-        os.getenv('user_name'), 
-        os.getenv('password')
-    )
-    if connection is None:
-        return {"status": "error", "message": "Database connection failed"}
-    
     try:
-        cursor = connection.cursor()
-        
-        # Check if user exists
-        cursor.execute("SELECT id FROM users WHERE name = %s", (username,))
-        if cursor.fetchone():
+        # Hash before borrowing a connection so it isn't held during the work
+        hashed_password = hash_password(password)
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            
+            # Check if user exists
+            cursor.execute("SELECT id FROM users WHERE name = %s", (username,))
+            if cursor.fetchone():
+                cursor.close()
+                return {
+                    "status": "error", 
+                    "error_type": "duplicate_user",
+                    "message": f"Username '{username}' is already taken. Please choose another username."
+                }
+            
+            # If user doesn't exist, create new user
+            cursor.execute(
+                "INSERT INTO users (name, password, email) VALUES (%s, %s, %s)",
+                (username, hashed_password, email)
+            )
+            connection.commit()
             cursor.close()
-            connection.close()
-            return {
-                "status": "error", 
-                "error_type": "duplicate_user",
-                "message": f"Username '{username}' is already taken. Please choose another username."
-            }
-        
-        # If user doesn't exist, create new user
-        hashed_password = generate_password_hash(password)
-        cursor.execute(
-            "INSERT INTO users (name, password, email) VALUES (%s, %s, %s)",
-            (username, hashed_password, email)
-        )
-        connection.commit()
-        cursor.close()
-        connection.close()
-        return {"status": "success", "message": "Registration successful"}
+            return {"status": "success", "message": "Registration successful"}
+    except HashingBusy:
+        return BUSY_RESULT
     except Exception as error:
-        print(f"Error registering user: {error}")
+        logger.error("Error registering user: %s", error)
         return {
             "status": "error",
             "error_type": "database_error",
             "message": "An error occurred during registration. Please try again."
         }
 
+LOGIN_SQL = "SELECT id, password FROM users WHERE name = %s"
+
 def login_user(username, password):
-    connection = connect_to_postgres(
-        os.getenv('dbname'), 
-        os.getenv('user_name'), 
-        os.getenv('password')
-    )
-    if connection is None:
-        return {"status": "error", "message": "Database connection failed"}
-    
     try:
-        cursor = connection.cursor()
-        cursor.execute(
-            "SELECT id, password FROM users WHERE name = %s",
-            (username,)
-        )
-        result = cursor.fetchone()
-        cursor.close()
-        connection.close()
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(LOGIN_SQL, (username,))
+            result = cursor.fetchone()
+            cursor.close()
         
-        if result and check_password_hash(result[1], password):
+        if result and verify_password(result[1], password):
+            if needs_rehash(result[1]):
+                rehash_password(result[0], password)
             return {"status": "success", "message": "Login successful", "user_id": result[0]}
         else:
             return {"status": "error", "message": "Invalid username or password"}
+    except HashingBusy:
+        return BUSY_RESULT
     except Exception as error:
-        print(f"Error logging in user: {error}")
+        logger.error("Error logging in user: %s", error)
         return {"status": "error", "message": "Login failed"}
 
+def rehash_password(user_id, password):
+    """Upgrade a stored hash to the current policy; failures don't block login"""
+    try:
+        hashed_password = hash_password(password)
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                "UPDATE users SET password = %s WHERE id = %s",
+                (hashed_password, user_id)
+            )
+            connection.commit()
+            cursor.close()
+    except Exception as error:
+        logger.error("Error rehashing password for user %s: %s", user_id, error)
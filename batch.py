@@ -0,0 +1,56 @@
+from flask import request
+import json
+import os
+
+# Rows per INSERT statement; a whole batch is still one transaction
+BATCH_CHUNK_SIZE = int(os.getenv('batch_chunk_size', 1000))
+MAX_BATCH_ITEMS = int(os.getenv('batch_max_items', 50000))
+
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+def read_batch_payload():
+    """Parse a batch request body: a JSON array, or NDJSON (one object per line).
+
+    Returns (items, error); a malformed NDJSON line yields None in its slot
+    so the caller can report it per item.
+    """
+    if request.mimetype in NDJSON_TYPES:
+        items = []
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+            if len(items) > MAX_BATCH_ITEMS:
+                return None, f"Batch exceeds {MAX_BATCH_ITEMS} items"
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            return None, "Expected a JSON array or NDJSON body"
+        if len(items) > MAX_BATCH_ITEMS:
+            return None, f"Batch exceeds {MAX_BATCH_ITEMS} items"
+    if not items:
+        return None, "Batch is empty"
+    return items, None
+
+def item_field(items, field):
+    """Column of `field` across items; non-object items give None"""
+    return [item.get(field) if isinstance(item, dict) else None for item in items]
+
+def chunked(rows, size=None):
+    size = size or BATCH_CHUNK_SIZE
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+def batch_result(statuses):
+    """Summarise per-item statuses; 400 only when nothing could be saved"""
+    saved = sum(1 for s in statuses if s["status"] == "saved")
+    body = {
+        "saved": saved,
+        "failed": sum(1 for s in statuses if s["status"] == "error"),
+        "items": statuses
+    }
+    return body, (200 if saved else 400)
@@ -0,0 +1,195 @@
+"""habitica_records partitioning benchmark.
+
+Grows habitica_records server-side (INSERT ... SELECT generate_series) for
+a set of benchmark users up to each requested total row count, spread over
+--months of history, then times the 30-day window load as fetch_user_data
+runs it (Fetch_Habitica.USER_DATA_SQL through COPY) and reports p50/p99
+plus how many partitions the plan touches, so window latency can be
+compared across table sizes. Results are printed as
+JSON, tagged with the current commit.
+
+    python benchmarks/habitica_partitions.py --rows 1000000 10000000 30000000
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from db import get_connection
+from Fetch_Habitica import USER_DATA_SQL, copy_history
+from partitions import add_months, ensure_partitions, month_start
+
+BENCH_USER_PREFIX = 'habitica_partition_benchmark_'
+# One row per (user, task, day): row n of a user is task n % tasks on day
+# n / tasks counted back from today. tasks is fixed for the whole run, so
+# each step continues where the previous one stopped without key collisions
+GROW_SQL = """
+    INSERT INTO habitica_records (users_id, task_id, record_date, task_name, task_type, task_value)
+    SELECT u.id,
+           'bench-' || (n %% %(tasks)s),
+           CURRENT_DATE - (n / %(tasks)s)::int,
+           'Benchmark task ' || (n %% %(tasks)s),
+           CASE WHEN n %% 3 = 0 THEN 'habit' ELSE 'daily' END,
+           random() * 2
+    FROM unnest(%(user_ids)s::int[]) AS u(id)
+    CROSS JOIN generate_series(%(first)s::bigint, %(last)s::bigint) AS n
+"""
+
+def bench_user_ids(count):
+    ids = []
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        for i in range(count):
+            name = f"{BENCH_USER_PREFIX}{i}"
+            cursor.execute("""
+                INSERT INTO users (name, password, email) VALUES (%s, '!', %s)
+                ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
+                RETURNING id
+            """, [name, f"{name}@localhost"])
+            ids.append(cursor.fetchone()[0])
+        conn.commit()
+        cursor.close()
+    return ids
+
+def reset_user_data(user_ids):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM habitica_records WHERE users_id = ANY(%s)", [user_ids])
+        conn.commit()
+        cursor.close()
+
+def grow(user_ids, per_user_from, per_user_to, tasks):
+    """Insert rows [per_user_from, per_user_to) for every benchmark user"""
+    if per_user_to <= per_user_from:
+        return
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(GROW_SQL, {
+            "user_ids": user_ids,
+            "tasks": tasks,
+            "first": per_user_from,
+            "last": per_user_to - 1,
+        })
+        cursor.execute("ANALYZE habitica_records")
+        conn.commit()
+        cursor.close()
+
+def partitions_scanned(cursor, user_id):
+    """(partitions in the plan, partitions attached) for the window query"""
+    cursor.execute("EXPLAIN (FORMAT JSON) " + USER_DATA_SQL, {"user_id": user_id})
+    plan = cursor.fetchone()[0]
+    scanned = set()
+
+    def walk(node):
+        relation = node.get('Relation Name')
+        if relation:
+            scanned.add(relation)
+        for child in node.get('Plans', []):
+            walk(child)
+    walk(plan[0]['Plan'])
+    cursor.execute("""
+        SELECT count(*) FROM pg_inherits WHERE inhparent = 'habitica_records'::regclass
+    """)
+    return len(scanned), cursor.fetchone()[0]
+
+def window_latency(user_ids, queries):
+    latencies = []
+    rows = 0
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        for i in range(queries):
+            user_id = user_ids[i % len(user_ids)]
+            start = time.perf_counter()
+            rows = len(copy_history(cursor, USER_DATA_SQL, {"user_id": user_id}))
+            latencies.append(time.perf_counter() - start)
+        scanned, attached = partitions_scanned(cursor, user_ids[0])
+        cursor.close()
+    latencies.sort()
+    return {
+        "queries": queries,
+        "rows_per_query": rows,
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000, 3),
+        "partitions_scanned": scanned,
+        "partitions_attached": attached,
+    }
+
+def table_size():
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COALESCE(SUM(pg_total_relation_size(relid)), 0)
+            FROM pg_partition_tree('habitica_records')
+        """)
+        size = cursor.fetchone()[0]
+        cursor.close()
+    return int(size)
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000, 10000000, 30000000],
+                        help="Total benchmark rows after each step")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--months', type=int, default=36, help="History length per user")
+    parser.add_argument('--queries', type=int, default=200, help="Window queries per step")
+    parser.add_argument('--keep-data', action='store_true', help="Leave the benchmark rows in place")
+    parser.add_argument('--output', help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    days = (date.today() - add_months(month_start(date.today()), -args.months)).days
+    user_ids = bench_user_ids(args.users)
+    reset_user_data(user_ids)
+    ensure_partitions(add_months(month_start(date.today()), -args.months), date.today())
+
+    # Enough tasks per user that the largest step still fits in --months
+    tasks = max(-(-max(args.rows) // (len(user_ids) * days)), 1)
+    runs = []
+    loaded = 0
+    try:
+        for total in sorted(args.rows):
+            per_user = total // len(user_ids)
+            start = time.perf_counter()
+            grow(user_ids, loaded, per_user, tasks)
+            load_s = time.perf_counter() - start
+            loaded = max(loaded, per_user)
+            run = {
+                "rows": loaded * len(user_ids),
+                "tasks_per_user": tasks,
+                "load_s": round(load_s, 3),
+                "table_bytes": table_size(),
+            }
+            run.update(window_latency(user_ids, args.queries))
+            runs.append(run)
+            print(f"{run['rows']} rows: p50 {run['p50_ms']} ms", file=sys.stderr)
+    finally:
+        if not args.keep_data:
+            reset_user_data(user_ids)
+
+    results = {
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "users": len(user_ids),
+        "months": args.months,
+        "runs": runs
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""Habitica pipeline and read endpoint benchmark.
+
+Builds synthetic histories shaped like the bundled history.csv (same
+columns and task names, padded with generated tasks) at several sizes and
+times each pipeline stage: CSV parsing, ingest, fetch_user_data,
+filter_and_format_data for day/month/year, plus request throughput of the
+Habitica read endpoints through the Flask test client. Stages that need
+the database are skipped with --no-db. Query budgets are enforced
+(query_budget_strict), so an endpoint that gains a round trip shows up as
+a 500 in its statuses. Results are printed as JSON, tagged with the
+current commit, for comparison between revisions.
+
+    python benchmarks/habitica_pipeline.py --rows 859 10000 100000 --tasks 300
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('query_budget_strict', '1')
+
+import Fetch_Habitica
+from Fetch_Habitica import parse_export, filter_and_format_data
+from habitica_history import HabiticaHistory
+
+BENCH_USER = 'habitica_benchmark'
+ENDPOINTS = (
+    '/user/habitica/daily?time_range=day',
+    '/user/habitica/daily?time_range=month',
+    '/user/habitica/habit?time_range=year&bucket=week',
+)
+
+def synthetic_history(rows, tasks, days, seed=0):
+    """CSV bytes with `rows` records over `tasks` tasks and the last `days` days"""
+    rng = np.random.default_rng(seed)
+    sample = pd.read_csv(os.path.join(ROOT, 'history.csv'))
+    catalog = sample[['Task Name', 'Task ID', 'Task Type']].drop_duplicates('Task ID')
+    extra = max(tasks - len(catalog), 0)
+    catalog = pd.concat([catalog.head(tasks), pd.DataFrame({
+        'Task Name': [f"Synthetic task {i}" for i in range(extra)],
+        'Task ID': [f"synthetic-{i:06d}" for i in range(extra)],
+        'Task Type': rng.choice(['daily', 'habit'], size=extra),
+    })], ignore_index=True)
+
+    picks = catalog.iloc[rng.integers(0, len(catalog), size=rows)].reset_index(drop=True)
+    now = pd.Timestamp.today().floor('s')
+    offsets = pd.to_timedelta(rng.integers(0, days * 86400, size=rows), unit='s')
+    picks['Date'] = (now - offsets).strftime('%Y-%m-%d %H:%M:%S')
+    picks['Value'] = rng.normal(1.0, 0.6, size=rows)
+    picks = picks.sort_values(['Task ID', 'Date'], kind='stable')
+    return picks[sample.columns].to_csv(index=False).encode()
+
+def timed(fn, repeat):
+    """Run fn `repeat` times; return its last result and timing summary"""
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, {
+        "min_s": round(min(times), 6),
+        "median_s": round(statistics.median(times), 6),
+        "max_s": round(max(times), 6),
+    }
+
+def as_records_frame(df):
+    """The export frame in fetch_user_data's column layout"""
+    return pd.DataFrame({
+        'task_name': df['Task Name'],
+        'task_value': df['Value'].astype(float),
+        'record_date': df['Date'],
+        'task_type': df['Task Type'],
+    }).sort_values('record_date', ascending=False, ignore_index=True)
+
+def bench_user_id():
+    from db import get_connection
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM users WHERE name = %s", [BENCH_USER])
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute(
+                "INSERT INTO users (name, password, email) VALUES (%s, %s, %s) RETURNING id",
+                [BENCH_USER, '!', 'benchmark@localhost']
+            )
+            row = cursor.fetchone()
+            conn.commit()
+        cursor.close()
+    return row[0]
+
+def reset_user_data(user_id):
+    from db import get_connection
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        for table in ('habitica_records', 'habitica_rollups', 'habitica_sync_state'):
+            cursor.execute(f"DELETE FROM {table} WHERE users_id = %s", [user_id])
+        conn.commit()
+        cursor.close()
+
+def clear_caches():
+    from cache import response_cache
+    from habitica import user_data_cache
+    user_data_cache.clear()
+    response_cache.clear()
+
+def endpoint_throughput(client, headers, path, requests, cold):
+    latencies = []
+    statuses = set()
+    start = time.perf_counter()
+    for _ in range(requests):
+        if cold:
+            clear_caches()
+        t = time.perf_counter()
+        response = client.get(path, headers=headers)
+        latencies.append(time.perf_counter() - t)
+        statuses.add(response.status_code)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "path": path,
+        "cache": "cold" if cold else "warm",
+        "requests": requests,
+        "statuses": sorted(statuses),
+        "requests_per_second": round(requests / elapsed, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000, 3),
+    }
+
+def run_size(rows, args, user_id, client, headers):
+    result = {"rows": rows, "tasks": args.tasks, "days": args.days}
+    csv_bytes = synthetic_history(rows, args.tasks, args.days, seed=args.seed)
+    result["csv_bytes"] = len(csv_bytes)
+
+    df, result["read_csv"] = timed(lambda: parse_export(BytesIO(csv_bytes)), args.repeat)
+    frame = as_records_frame(df)
+    history = HabiticaHistory.from_frame(frame)
+    # What the frame cache holds per user: the old DataFrame vs the compact history
+    result["memory_bytes"] = {
+        "dataframe": int(frame.memory_usage(deep=True).sum()),
+        "history": history.nbytes,
+    }
+    result["filter_and_format_data"] = {
+        time_range: timed(lambda: filter_and_format_data(history, time_range=time_range), args.repeat)[1]
+        for time_range in ('day', 'month', 'year')
+    }
+
+    if user_id is None:
+        return result
+
+    reset_user_data(user_id)
+    ingest, result["ingest_full"] = timed(lambda: Fetch_Habitica.process_habitica_data(df, user_id), 1)
+    result["ingest_full"]["written"] = ingest["written"]
+    ingest, result["ingest_unchanged"] = timed(lambda: Fetch_Habitica.process_habitica_data(df, user_id), args.repeat)
+    result["ingest_unchanged"]["written"] = ingest["written"]
+    _, result["fetch_user_data"] = timed(lambda: Fetch_Habitica.fetch_user_data(user_id), args.repeat)
+
+    result["endpoints"] = [
+        endpoint_throughput(client, headers, path, args.requests, cold)
+        for path in ENDPOINTS
+        for cold in (True, False)
+    ]
+    return result
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[859, 10000, 100000])
+    parser.add_argument('--tasks', type=int, default=300)
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--requests', type=int, default=50, help="Requests per endpoint and cache state")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-db', action='store_true', help="Only run the stages that need no database")
+    parser.add_argument('--keep-data', action='store_true', help="Leave the benchmark user's rows in place")
+    parser.add_argument('--output', help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    user_id = client = headers = None
+    runs = []
+    # Pipeline code prints progress; keep stdout for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        if not args.no_db:
+            import main as app_main
+            from auth import issue_token
+            user_id = bench_user_id()
+            client = app_main.app.test_client()
+            headers = {'Authorization': f"Bearer {issue_token(user_id)}"}
+        try:
+            for rows in args.rows:
+                runs.append(run_size(rows, args, user_id, client, headers))
+        finally:
+            if user_id is not None and not args.keep_data:
+                reset_user_data(user_id)
+
+    results = {
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "pandas": pd.__version__,
+        "database": not args.no_db,
+        "runs": runs
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Login throughput benchmark for password verification.
+
+Simulates a login storm: ``--logins`` concurrent verify_password calls
+while a background thread keeps issuing small "API" requests, and reports
+login throughput plus API latency percentiles, inline vs. process pool.
+
+    python benchmarks/login_throughput.py --logins 64 --threads 16
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auth
+from werkzeug.security import generate_password_hash
+
+def api_probe(stop, latencies):
+    """Stand-in for regular API traffic: small pure-Python work per request"""
+    payload = {"dates": [f"2024-01-{d:02d}" for d in range(1, 29)], "hours": list(range(28))}
+    while not stop.is_set():
+        start = time.perf_counter()
+        json.dumps(payload)
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.001)
+
+def run(mode, stored_hash, password, logins, threads):
+    auth.HASH_WORKERS = 0 if mode == 'inline' else max(auth.HASH_WORKERS, 1)
+    if mode == 'pool':
+        auth.verify_password(stored_hash, password)  # start the workers
+
+    stop = threading.Event()
+    latencies = []
+    probe = threading.Thread(target=api_probe, args=(stop, latencies), daemon=True)
+    probe.start()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(lambda _: auth.verify_password(stored_hash, password), range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    probe.join()
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "logins": logins,
+        "ok": sum(results),
+        "seconds": round(elapsed, 4),
+        "logins_per_second": round(logins / elapsed, 2),
+        "api_requests": len(latencies),
+        "api_p50_ms": round(statistics.median(latencies) * 1000, 4) if latencies else None,
+        "api_p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 4) if latencies else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--method', default=auth.PASSWORD_HASH_METHOD)
+    parser.add_argument('--output', help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    password = "correct horse battery staple"
+    stored_hash = generate_password_hash(password, args.method)
+    results = {
+        "method": args.method,
+        "workers": auth.HASH_WORKERS,
+        "runs": [run(mode, stored_hash, password, args.logins, args.threads) for mode in ('inline', 'pool')]
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+import pandas as pd
+from flask import current_app, request, g
+from metrics import register_cache
+import logging
+
+logger = logging.getLogger(__name__)
+
+def frame_size(value):
+    """Approximate in-memory size of a cached value, in bytes"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(getattr(value, 'nbytes', None), int):
+        return value.nbytes
+    return 1024
+
+def frame_copy(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=True)
+    return value
+
+class TTLCache:
+    """Thread-safe cache with per-entry TTL and LRU eviction.
+
+    Entries expire ``ttl`` seconds after being stored. The cache holds at
+    most ``max_entries`` entries and ``max_bytes`` total (as measured by
+    ``sizeof``), evicting least recently used entries first. Values are
+    copied on the way in and out so callers can never mutate a shared entry.
+    """
+
+    def __init__(self, ttl=300, max_entries=1024, max_bytes=64 * 1024 * 1024,
+                 sizeof=frame_size, copy=frame_copy):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._copy = copy
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # Bumped on every invalidation so loads that raced one are not stored
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def _drop(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            value, expires_at, _ = entry
+            if expires_at <= time.monotonic():
+                self._drop(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+        return self._copy(value)
+
+    def set(self, key, value):
+        value = self._copy(value)
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def get_or_load(self, key, loader):
+        value = self.get(key)
+        if value is None:
+            generation = self._generation
+            value = loader()
+            if generation == self._generation:
+                self.set(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            if key in self._entries:
+                self._drop(key)
+                self._stats["invalidations"] += 1
+
+    def invalidate_where(self, predicate):
+        with self._lock:
+            self._generation += 1
+            for key in [k for k in self._entries if predicate(k)]:
+                self._drop(key)
+                self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries), bytes=self._bytes)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+class MemoryBackend:
+    """Response cache local to this process"""
+
+    def __init__(self, ttl=300, max_bytes=64 * 1024 * 1024):
+        self._cache = TTLCache(ttl=ttl, max_entries=100000, max_bytes=max_bytes, copy=lambda v: v)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value):
+        self._cache.set(key, value)
+
+    def delete_prefix(self, prefix):
+        self._cache.invalidate_where(lambda key: key.startswith(prefix))
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+class SQLiteBackend:
+    """Response cache in a SQLite file, shared by every worker on the host"""
+
+    def __init__(self, path, ttl=300):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+        self._writes = 0
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value FROM response_cache WHERE key = ? AND expires_at > ?",
+            (key, time.time())
+        ).fetchone()
+        self._count("hits" if row else "misses")
+        return row[0] if row else None
+
+    def set(self, key, value):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, time.time() + self.ttl)
+        )
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % 500 == 0
+        if prune:
+            conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+
+    def delete_prefix(self, prefix):
+        # Range scan on the primary key instead of LIKE, which would need escaping
+        self._conn().execute(
+            "DELETE FROM response_cache WHERE key >= ? AND key < ?",
+            (prefix, prefix + '\uffff')
+        )
+        self._count("invalidations")
+
+    def clear(self):
+        self._conn().execute("DELETE FROM response_cache")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+def make_backend():
+    """Build the response cache selected by cache_backend (memory or sqlite)"""
+    ttl = float(os.getenv('response_cache_ttl', 300))
+    backend = os.getenv('cache_backend', 'memory').lower()
+    if backend == 'sqlite':
+        return SQLiteBackend(os.getenv('cache_path', 'response_cache.sqlite3'), ttl=ttl)
+    if backend == 'memory':
+        return MemoryBackend(ttl=ttl, max_bytes=int(os.getenv('response_cache_mb', 64)) * 1024 * 1024)
+    raise ValueError(f"Unknown cache_backend: {backend}")
+
+response_cache = make_backend()
+register_cache('response', response_cache.stats)
+
+def response_key_prefix(user_id, domain):
+    return f"user:{user_id}:{domain}:"
+
+# Response headers that are part of a cached entry, e.g. pagination cursors
+CACHED_HEADERS = ('X-Next-Before',)
+
+def mark_uncacheable():
+    """Keep this request's response out of the caches and without an ETag,
+    e.g. a 200 that carries a degraded section"""
+    g.response_uncacheable = True
+
+def cached_response(domain):
+    """Serve a token_required JSON route from the shared response cache.
+
+    Only successful JSON responses are stored, unless mark_uncacheable() was
+    called; the key covers the user, the domain and the full request path
+    including the query string.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(current_user_id, *args, **kwargs):
+            key = response_key_prefix(current_user_id, domain) + request.full_path
+            if 'data_version_tag' in g:
+                key += '|' + g.data_version_tag
+            entry = response_cache.get(key)
+            if entry is not None:
+                headers, body = entry.split(b'\n', 1)
+                response = current_app.response_class(body, mimetype='application/json')
+                response.headers.update(json.loads(headers))
+                response.headers['X-Cache'] = 'HIT'
+                return response
+            response = current_app.make_response(f(current_user_id, *args, **kwargs))
+            if (response.status_code == 200 and response.mimetype == 'application/json'
+                    and not g.get('response_uncacheable')):
+                headers = {h: response.headers[h] for h in CACHED_HEADERS if h in response.headers}
+                response_cache.set(key, json.dumps(headers).encode() + b'\n' + response.get_data())
+                response.headers['X-Cache'] = 'MISS'
+            return response
+        return decorated
+    return decorator
+
+# Callbacks run after a user's data changes, e.g. cache invalidation.
+# Each is called as hook(user_id, domain) with domain 'habitica', 'sleep', ...
+_invalidation_hooks = []
+
+def register_invalidation_hook(hook):
+    _invalidation_hooks.append(hook)
+    return hook
+
+def notify_user_data_changed(user_id, domain):
+    for hook in _invalidation_hooks:
+        try:
+            hook(user_id, domain)
+        except Exception as e:
+            logger.exception("Invalidation hook error")
+
+@register_invalidation_hook
+def invalidate_responses(user_id, domain):
+    response_cache.delete_prefix(response_key_prefix(user_id, domain))
@@ -0,0 +1,80 @@
+from flask import Blueprint, jsonify, request
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from auth import token_required
+from versions import conditional_get, current_version
+from cache import mark_uncacheable
+from metrics import query_budget
+from sleep import weekly_sleep_series
+from gym import weekly_gym_series
+from habitica import habitica_frame, format_task_series
+from Fetch_Habitica import ROLLUP_FREQ
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+dashboard_bp = Blueprint('dashboard', __name__)
+
+# Shared by all requests; each section borrows its own pooled connection
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('dashboard_workers', 8)),
+    thread_name_prefix='dashboard'
+)
+
+def _submit(fn, *args):
+    # Run in a copy of this request's context so logs keep its request ID
+    # and the section's queries count toward the request
+    return _executor.submit(contextvars.copy_context().run, fn, *args)
+
+# What a failed section shows the client; the exception is only logged
+SECTION_ERROR = {"error": "Section temporarily unavailable"}
+
+def _section_failed(name):
+    logger.exception("Dashboard %s section error", name)
+    # A partial dashboard must not be revalidated or cached as the current data
+    mark_uncacheable()
+    return dict(SECTION_ERROR)
+
+def _section(name, future):
+    try:
+        return future.result()
+    except Exception:
+        return _section_failed(name)
+
+@dashboard_bp.route('/user/dashboard', methods=['GET'])
+@token_required
+@query_budget(4)
+@conditional_get('sleep', 'gym', 'habitica')
+def get_dashboard(current_user_id):
+    """Sleep, gym and Habitica charts in one payload, queried concurrently.
+
+    A failing section is reported as {"error": ...} without failing the rest;
+    such a response gets no ETag and is not cached. Repeat polls are answered with 304 from the data versions alone.
+    """
+    time_range = request.args.get('time_range', 'month')
+    bucket = request.args.get('bucket', 'week')
+    if bucket not in ROLLUP_FREQ:
+        return jsonify({"error": "Invalid bucket"}), 400
+
+    sleep = _submit(weekly_sleep_series, current_user_id)
+    gym = _submit(weekly_gym_series, current_user_id)
+    # Read by conditional_get already; the section thread keys the frame cache on it
+    version = current_version(current_user_id, 'habitica')
+    frame = _submit(habitica_frame, current_user_id, time_range, bucket, version)
+
+    try:
+        # Both views are formatted from the one frame
+        history = frame.result()
+        habitica = {
+            task_type: format_task_series(history, task_type, time_range, bucket)
+            for task_type in ('daily', 'habit')
+        }
+    except Exception:
+        habitica = _section_failed('habitica')
+
+    return jsonify({
+        "sleep": _section('sleep', sleep),
+        "gym": _section('gym', gym),
+        "habitica": habitica
+    })
@@ -1,26 +1,293 @@
 import psycopg2
 from psycopg2 import sql
+from psycopg2 import extensions
 import os
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from metrics import query_latency, query_rows, query_labels, count_query, Gauge
+import logging
+
+logger = logging.getLogger(__name__)
 
 load_dotenv('.env.local')
 
+# Queries slower than this are logged as warnings with their text, duration
+# and row count; 0 disables the log
+SLOW_QUERY_MS = float(os.getenv('slow_query_ms', 0))
+
+class InstrumentedCursor(extensions.cursor):
+    """Cursor that records each statement's latency and row count, and counts it for the request"""
+
+    def _observe(self, query, start):
+        elapsed = time.perf_counter() - start
+        if isinstance(query, sql.Composable):
+            query = query.as_string(self)
+        labels = query_labels(query)
+        count_query()
+        query_latency.observe(elapsed, **labels)
+        if self.rowcount > 0:
+            query_rows.inc(self.rowcount, **labels)
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+            logger.warning("Slow query: %s", ' '.join(str(query).split()), extra={
+                "duration_ms": round(elapsed * 1000, 3), "rows": self.rowcount
+            })
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._observe(query, start)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._observe(query, start)
+
+    def copy_expert(self, query, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(query, file, size)
+        finally:
+            self._observe(query, start)
+
 def connect_to_postgres(dbname=None, user=None, password=None, host='localhost', port=5432):
     dbname = dbname or os.getenv('dbname')
     user = user or os.getenv('user_name')
     password = password or os.getenv('password')
-    
+
     try:
         connection = psycopg2.connect(
             dbname=dbname,
             user=user,
             password=password,
             host=host,
-            port=port
+            port=port,
+            cursor_factory=InstrumentedCursor
         )
-        print(f"Connected {dbname}")
+        logger.debug("Connected %s", dbname)
         return connection
     except Exception as error:
-        print(f"Error connecting to PostgreSQL database: {error}")
+        logger.error("Error connecting to PostgreSQL database: %s", error)
         return None
 
+
+class PoolExhausted(psycopg2.OperationalError):
+    """No connection became available within the checkout timeout"""
+
+
+class ConnectionPool:
+    """Thread-safe, bounded pool of PostgreSQL connections.
+
+    Keeps up to ``maxconn`` connections open and pre-opens ``minconn`` of
+    them. When every connection is checked out, callers wait up to
+    ``timeout`` seconds for one to be returned before PoolExhausted is raised.
+    """
+
+    def __init__(self, minconn=1, maxconn=10, timeout=5.0, health_check=True, connect=None):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Invalid pool size: need 0 <= minconn <= maxconn and maxconn >= 1")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check = health_check
+        self._connect = connect or connect_to_postgres
+        self._idle = []
+        self._size = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            "checkouts": 0,
+            "created": 0,
+            "discarded": 0,
+            "overflow": 0,
+            "timeouts": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+        }
+        for _ in range(minconn):
+            conn = self._connect()
+            if conn is None:
+                break
+            self._idle.append(conn)
+            self._size += 1
+            self._stats["created"] += 1
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        if not self.health_check:
+            return True
+        try:
+            # Plain cursor: pool upkeep is not part of any request's queries
+            with conn.cursor(cursor_factory=extensions.cursor) as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._in_use -= 1
+            self._cond.notify()
+
+    def getconn(self):
+        """Check out a healthy connection, waiting while the pool is at capacity"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    conn = None
+                    self._size += 1
+                    break
+                if not waited:
+                    self._stats["overflow"] += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolExhausted(
+                        f"No database connection available after {self.timeout}s "
+                        f"({self.maxconn} in use)"
+                    )
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self._stats["checkouts"] += 1
+            wait_time = time.monotonic() - start
+            self._stats["wait_time_total"] += wait_time
+            self._stats["wait_time_max"] = max(self._stats["wait_time_max"], wait_time)
+
+        # Connecting and health checks happen outside the lock; the slot is
+        # already reserved so the pool cannot grow past maxconn meanwhile.
+        if conn is not None and not self._is_healthy(conn):
+            with self._cond:
+                self._stats["discarded"] += 1
+            try:
+                conn.close()
+            except Exception:
+                pass
+            conn = None
+        if conn is None:
+            conn = self._connect()
+            if conn is None:
+                self._release_slot()
+                raise psycopg2.OperationalError("Database connection failed")
+            with self._cond:
+                self._stats["created"] += 1
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """Return a connection to the pool, rolling back any open transaction"""
+        if not conn.closed and not discard:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        if conn.closed or discard:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            with self._cond:
+                self._stats["discarded"] += 1
+            self._release_slot()
+            return
+        with self._cond:
+            self._idle.append(conn)
+            self._in_use -= 1
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(
+                size=self._size,
+                in_use=self._in_use,
+                idle=len(self._idle),
+                minconn=self.minconn,
+                maxconn=self.maxconn,
+            )
+        checkouts = stats["checkouts"]
+        stats["wait_time_avg"] = stats["wait_time_total"] / checkouts if checkouts else 0.0
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Process-wide pool, sized from db_pool_min / db_pool_max / db_pool_timeout"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    minconn=int(os.getenv('db_pool_min', 1)),
+                    maxconn=int(os.getenv('db_pool_max', 10)),
+                    timeout=float(os.getenv('db_pool_timeout', 5)),
+                    health_check=os.getenv('db_pool_health_check', '1') != '0',
+                )
+    return _pool
+
+@contextmanager
+def get_connection():
+    """Borrow a pooled connection; it is always returned, even on errors.
+
+    Uncommitted work is rolled back when the block exits, so callers must
+    commit explicitly.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
+    finally:
+        pool.putconn(conn)
+
+def pool_stats():
+    return get_pool().stats()
+
+pool_gauge = Gauge('db_pool_connections', 'Pooled connections by state', ('state',))
+
+@pool_gauge.add_callback
+def _pool_connections():
+    if _pool is None:
+        return {}
+    stats = _pool.stats()
+    return {(state,): stats[state] for state in ('size', 'in_use', 'idle')}
+
+pool_wait_gauge = Gauge('db_pool_wait_seconds', 'Time spent waiting for a pooled connection', ('stat',))
+
+@pool_wait_gauge.add_callback
+def _pool_wait():
+    if _pool is None:
+        return {}
+    stats = _pool.stats()
+    return {(stat,): stats[f"wait_time_{stat}"] for stat in ('avg', 'max')}
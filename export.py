@@ -0,0 +1,100 @@
+from flask import Response, request
+from db import get_connection
+from serialization import OrjsonProvider
+import base64
+import csv
+import os
+import orjson
+import uuid
+from datetime import datetime, timezone
+from io import StringIO
+
+EXPORT_CHUNK_SIZE = int(os.getenv('export_chunk_size', 2000))
+DEFAULT_PAGE_SIZE = 30
+MAX_PAGE_SIZE = 500
+
+def page_limit():
+    """?limit= clamped to 1..MAX_PAGE_SIZE, or None if it is not a number"""
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return None
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def page_cursor(timestamp, record_id):
+    """Opaque, URL-safe ?before= token for the page after (timestamp, record_id)"""
+    stamp = timestamp.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+    return base64.urlsafe_b64encode(f"{stamp}|{record_id}".encode()).decode().rstrip('=')
+
+def parse_page_cursor(value):
+    """(timestamp, record_id) from a page_cursor() token, or (timestamp, None)
+    from a bare ISO timestamp; ValueError if it is neither"""
+    try:
+        stamp, record_id = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode().split('|')
+        return datetime.fromisoformat(stamp.replace('Z', '+00:00')), int(record_id)
+    except (ValueError, UnicodeDecodeError):
+        return datetime.fromisoformat(value.replace('Z', '+00:00')), None
+
+def stream_query(query, params, chunk_size=None):
+    """Yield row chunks from a server-side (named) cursor.
+
+    Only one chunk is held in memory at a time. The pooled connection is
+    kept until the generator is exhausted or closed.
+    """
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    with get_connection() as conn:
+        cursor = conn.cursor(name=f"export_{uuid.uuid4().hex}")
+        cursor.itersize = chunk_size
+        try:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+            conn.rollback()
+
+def json_stream(chunks, to_dict):
+    """A JSON array of to_dict(row), encoded chunk by chunk exactly as
+    OrjsonProvider encodes response bodies"""
+    yield b'['
+    first = True
+    for rows in chunks:
+        body = b','.join(
+            orjson.dumps(to_dict(r), default=OrjsonProvider.default, option=OrjsonProvider.option)
+            for r in rows
+        )
+        yield body if first else b',' + body
+        first = False
+    yield b']'
+
+def csv_stream(chunks, header, to_row):
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for rows in chunks:
+        writer.writerows(to_row(r) for r in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def export_response(query, params, name, columns, to_row):
+    """Stream a query as JSON (default) or CSV, per ?format=.
+
+    CSV rows go through to_row; JSON rows keep their query values, so dates
+    and datetimes are formatted as on every other JSON endpoint.
+    """
+    chunks = stream_query(query, params)
+    if request.args.get('format', 'json').lower() == 'csv':
+        return Response(
+            csv_stream(chunks, columns, to_row),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename={name}.csv'}
+        )
+    return Response(
+        json_stream(chunks, lambda r: dict(zip(columns, r))),
+        mimetype='application/json'
+    )
@@ -1,7 +1,18 @@
 from flask import Blueprint, jsonify, request
-from db import connect_to_postgres
-from api_page import token_required
-from datetime import datetime, timedelta
+from db import get_connection
+from auth import token_required
+from versions import bump_data_version, conditional_get
+from cache import cached_response, notify_user_data_changed
+from batch import read_batch_payload, item_field, chunked, batch_result
+from export import page_limit, page_cursor, parse_page_cursor, export_response
+from serialization import rows_payload
+from series import date_series, series_window
+from psycopg2.extras import execute_values
+from datetime import datetime
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
 
 gym_bp = Blueprint('gym', __name__)
 
@@ -23,103 +34,201 @@ def add_gym_record(current_user_id):
     except ValueError:
         return jsonify({"error": "Invalid datetime format"}), 400
         
-    conn = connect_to_postgres()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
     
-    try:
-        cursor.execute("""
-            INSERT INTO gym_records 
-            (users_id, start_time, end_time, exercise_title, exercise_notes)
-            VALUES (%s, %s, %s, %s, %s)
-            RETURNING gym_record_id
-        """, (current_user_id, start_time, end_time, exercise_title, exercise_notes))
+        try:
+            cursor.execute("""
+                INSERT INTO gym_records 
+                (users_id, start_time, end_time, exercise_title, exercise_notes)
+                VALUES (%s, %s, %s, %s, %s)
+                RETURNING gym_record_id
+            """, (current_user_id, start_time, end_time, exercise_title, exercise_notes))
         
-        record_id = cursor.fetchone()[0]
-        conn.commit()
-        return jsonify({"message": "Gym record saved", "id": record_id}), 200
+            record_id = cursor.fetchone()[0]
+            bump_data_version(cursor, current_user_id, 'gym')
+            conn.commit()
+            notify_user_data_changed(current_user_id, 'gym')
+            return jsonify({"message": "Gym record saved", "id": record_id}), 200
         
-    except Exception as e:
-        conn.rollback()
-        return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"error": str(e)}), 500
+        finally:
+            cursor.close()
+
+@gym_bp.route('/user/gym/batch', methods=['POST'])
+@token_required
+def add_gym_records_batch(current_user_id):
+    """Save many gym records in one transaction; body is a JSON array or NDJSON"""
+    items, error = read_batch_payload()
+    if error:
+        return jsonify({"error": error}), 400
+
+    raw_start = pd.Series(item_field(items, 'start_time'), dtype=object)
+    raw_end = pd.Series(item_field(items, 'end_time'), dtype=object)
+    titles = pd.Series(item_field(items, 'exercise_title'), dtype=object)
+    notes = pd.Series(item_field(items, 'exercise_notes'), dtype=object)
+
+    # Parsed only to validate; Postgres receives the ISO strings, exactly as
+    # add_gym_record would send them
+    start_times = pd.to_datetime(raw_start.where(raw_start.map(type) == str), format='ISO8601', utc=True, errors='coerce')
+    end_times = pd.to_datetime(raw_end.where(raw_end.map(type) == str), format='ISO8601', utc=True, errors='coerce')
+
+    missing = ~(raw_start.astype(bool) & raw_end.astype(bool) & titles.astype(bool))
+    invalid = ~missing & (start_times.isna() | end_times.isna())
+    # Text columns take strings only; a number, object or array would make
+    # the INSERT fail for the whole batch
+    bad_text = ~missing & ~invalid & (
+        (titles.map(type) != str) | ~notes.map(lambda note: note is None or type(note) is str)
+    )
+    valid = ~missing & ~invalid & ~bad_text
+
+    rows = [
+        (current_user_id, start.replace('Z', '+00:00'), end.replace('Z', '+00:00'), title, note)
+        for start, end, title, note, ok in zip(raw_start, raw_end, titles, notes, valid)
+        if ok
+    ]
+    saved_ids = []
+    if rows:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                for chunk in chunked(rows):
+                    returned = execute_values(cursor, """
+                        INSERT INTO gym_records 
+                        (users_id, start_time, end_time, exercise_title, exercise_notes)
+                        VALUES %s
+                        RETURNING gym_record_id
+                    """, chunk, page_size=len(chunk), fetch=True)
+                    saved_ids.extend(r[0] for r in returned)
+                bump_data_version(cursor, current_user_id, 'gym')
+                conn.commit()
+                notify_user_data_changed(current_user_id, 'gym')
+            except Exception as e:
+                conn.rollback()
+                return jsonify({"error": str(e)}), 500
+            finally:
+                cursor.close()
+
+    statuses = []
+    new_ids = iter(saved_ids)
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            statuses.append({"index": index, "status": "error", "error": "Item must be a JSON object"})
+        elif missing[index]:
+            statuses.append({"index": index, "status": "error", "error": "Missing required fields"})
+        elif invalid[index]:
+            statuses.append({"index": index, "status": "error", "error": "Invalid datetime format"})
+        elif bad_text[index]:
+            statuses.append({"index": index, "status": "error", "error": "Invalid data format"})
+        else:
+            statuses.append({"index": index, "status": "saved", "id": next(new_ids, None)})
+    body, status = batch_result(statuses)
+    return jsonify(body), status
+
+GYM_COLUMNS = ['start_time', 'end_time', 'exercise_title', 'exercise_notes']
+# Keyset page, newest first. gym_record_id breaks start_time ties, so rows
+# sharing the boundary timestamp are not skipped; a bare ISO ?before= has
+# no id and pages strictly before that time (ids start at 1)
+GYM_PAGE_SQL = """
+    SELECT start_time, end_time, exercise_title, exercise_notes, gym_record_id
+    FROM gym_records
+    WHERE users_id = %(user_id)s
+    AND (%(before)s::timestamptz IS NULL
+         OR (start_time, gym_record_id) < (%(before)s::timestamptz, COALESCE(%(before_id)s, 0)))
+    ORDER BY start_time DESC, gym_record_id DESC
+    LIMIT %(limit)s
+"""
 
 @gym_bp.route('/user/gym', methods=['GET'])
 @token_required
+@conditional_get('gym')
+@cached_response('gym')
 def get_gym_records(current_user_id):
-    conn = connect_to_postgres()
-    cursor = conn.cursor()
-    
+    """Newest records first; page back with ?before=<X-Next-Before>&limit=N, ?format=columns for arrays"""
+    limit = page_limit()
+    before = request.args.get('before')
     try:
-        cursor.execute("""
-            SELECT start_time, end_time, exercise_title, exercise_notes
-            FROM gym_records
-            WHERE users_id = %s
-            ORDER BY start_time DESC
-            LIMIT 30
-        """, (current_user_id,))
+        before, before_id = parse_page_cursor(before) if before else (None, None)
+    except ValueError:
+        return jsonify({"error": "Invalid datetime format"}), 400
+    if limit is None:
+        return jsonify({"error": "Invalid data format"}), 400
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+    
+        try:
+            cursor.execute(GYM_PAGE_SQL, {
+                "user_id": current_user_id, "before": before, "before_id": before_id, "limit": limit
+            })
         
-        records = cursor.fetchall()
-        result = [{
-            "start_time": r[0].isoformat(),
-            "end_time": r[1].isoformat(),
-            "exercise_title": r[2],
-            "exercise_notes": r[3]
-        } for r in records]
-        return jsonify(result), 200
+            records = cursor.fetchall()
+            response = jsonify(rows_payload(GYM_COLUMNS, [r[:4] for r in records], request.args))
+            if len(records) == limit:
+                response.headers['X-Next-Before'] = page_cursor(records[-1][0], records[-1][4])
+            return response, 200
         
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        finally:
+            cursor.close()
+
+@gym_bp.route('/user/gym/export', methods=['GET'])
+@token_required
+def export_gym_records(current_user_id):
+    """Full gym history, streamed as JSON or ?format=csv"""
+    return export_response("""
+        SELECT start_time, end_time, exercise_title, exercise_notes
+        FROM gym_records
+        WHERE users_id = %s
+        ORDER BY start_time DESC
+    """, (current_user_id,), 'gym_records',
+        ['start_time', 'end_time', 'exercise_title', 'exercise_notes'],
+        lambda r: (r[0].isoformat(), r[1].isoformat(), r[2], r[3]))
+
+# Total hours trained in each bucket, by workout start date
+GYM_SERIES_AGGREGATE = """
+    SELECT date_trunc(%(bucket)s, start_time::date::timestamp) AS period,
+           SUM(EXTRACT(EPOCH FROM (end_time - start_time))) / 3600 AS value
+    FROM gym_records
+    WHERE users_id = %(user_id)s
+    AND start_time >= date_trunc(%(bucket)s, %(start)s::timestamp)
+    AND start_time < %(end)s::date + 1
+    GROUP BY 1
+"""
+
+def gym_series(user_id, days, bucket='day'):
+    return date_series(user_id, GYM_SERIES_AGGREGATE, days, bucket)
+
+def weekly_gym_series(user_id):
+    """Hours trained per day for the last 8 days, zero-filled"""
+    return gym_series(user_id, 8)
 
 @gym_bp.route('/user/gym/week', methods=['GET'])
 @token_required
+@conditional_get('gym')
+@cached_response('gym')
 def get_weekly_gym(current_user_id):
-    conn = connect_to_postgres()
-    cursor = conn.cursor()
-    
     try:
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=7)
-        
-        cursor.execute("""
-            SELECT DATE(start_time), 
-                   COUNT(*) as workout_count,
-                   SUM(EXTRACT(EPOCH FROM (end_time - start_time)))/3600 as total_hours
-            FROM gym_records
-            WHERE users_id = %s 
-            AND start_time >= %s
-            GROUP BY DATE(start_time)
-            ORDER BY DATE(start_time)
-        """, (current_user_id, start_date))
-        
-        records = cursor.fetchall()
-        
-        # Create date range with zeros for missing dates
-        date_range = {
-            (start_date + timedelta(days=x)).strftime('%Y-%m-%d'): 0 
-            for x in range(8)
-        }
-        
-        # Fill in actual values
-        for record in records:
-            date_str = record[0].strftime('%Y-%m-%d')
-            if date_str in date_range:
-                date_range[date_str] = float(record[2])  # Use hours spent
-        
-        result = {
-            "dates": list(date_range.keys()),
-            "hours": list(date_range.values())
-        }
-        
-        return jsonify(result), 200
-        
+        return jsonify(weekly_gym_series(current_user_id)), 200
+    except Exception as e:
+        logger.exception("Error in get_weekly_gym")
+        return jsonify({"error": str(e)}), 500
+
+@gym_bp.route('/user/gym/series', methods=['GET'])
+@token_required
+@conditional_get('gym')
+@cached_response('gym')
+def get_gym_series(current_user_id):
+    """Total hours trained per day/week/month; ?range=week|month|year|<days>&bucket=day|week|month"""
+    bucket = request.args.get('bucket', 'day')
+    days, error = series_window(request.args.get('range', 'month'), bucket)
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        return jsonify(gym_series(current_user_id, days, bucket)), 200
     except Exception as e:
-        print(f"Error in get_weekly_gym: {e}")
+        logger.exception("Error in get_gym_series")
         return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
@@ -1,161 +1,95 @@
 from flask import Blueprint, jsonify, request
-from db import connect_to_postgres
-import requests
 from Fetch_Habitica import (
-    graph_fetch, 
-    process_habitica_data, 
+    get_habitica_credentials,
     fetch_user_data,
-    filter_and_format_data
+    fetch_rollup_data,
+    filter_and_format_data,
+    format_rollup_series,
+    ROLLUP_FREQ
 )
-from api_page import token_required  # Add this import
-import pandas as pd
-from io import StringIO
-from functools import lru_cache
-import time
+from habitica_sync import scheduler
+from auth import token_required  # Add this import
+from versions import conditional_get, current_version
+from cache import TTLCache, cached_response, register_invalidation_hook
+from metrics import register_cache, query_budget
+import os
+import logging
+
+logger = logging.getLogger(__name__)
 
 habitica_bp = Blueprint('habitica', __name__)
 
-def get_habitica_credentials(user_id):
-    conn = connect_to_postgres()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT api_id, api_key 
-        FROM api_records 
-        WHERE users_id = %s AND api_type = 'habitica'
-        LIMIT 1
-    """, (user_id,))
-    
-    result = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    
-    if not result:
-        return None
-    return {"api_id": result[0], "api_key": result[1]}
-
-def fetch_habitica_data(credentials):
-    try:
-        # Get latest date from database first
-        conn = connect_to_postgres()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT MAX(record_date) FROM habitica_records
-        """)
-        latest_db_date = cursor.fetchone()[0]
-        print(f"Latest date in database before fetch: {latest_db_date}")
-
-        api_url = "https://habitica.com/export/history.csv"
-        headers = {
-            "x-api-user": credentials["api_id"],
-            "x-api-key": credentials["api_key"]
-        }
-        
-        response = requests.get(api_url, headers=headers)
-        if response.status_code != 200:
-            print(f"API Error: {response.status_code}")
-            return None
-            
-        try:
-            df = pd.read_csv(StringIO(response.text))
-            if df.empty:
-                return None
-
-            # Convert and sort dates
-            df['Date'] = pd.to_datetime(df['Date'])
-            latest_api_date = df['Date'].max()
-            print(f"Latest date from Habitica API: {latest_api_date}")
-            
-            return df
-            
-        except Exception as e:
-            print(f"DataFrame Error: {e}")
-            return None
-            
-    except Exception as e:
-        print(f"Request Error: {e}")
-        return None
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
-
-def process_habitica_data(df, user_id):
-    if df is None or df.empty:
-        print("No data to process")
-        return
-        
-    conn = connect_to_postgres()
-    cursor = conn.cursor()
-    
-    try:
-        # Get current latest date
-        cursor.execute("SELECT MAX(record_date) FROM habitica_records WHERE users_id = %s", [user_id])
-        before_date = cursor.fetchone()[0]
-        print(f"Latest date in database before insert: {before_date}")
-
-        records_to_insert = []
-        for _, row in df.iterrows():
-            try:
-                record = (
-                    user_id,
-                    pd.to_datetime(row['Date']).date(),
-                    str(row['Task Name']),
-                    str(row['Task Type']),
-                    float(row['Value']),
-                    str(row['Task ID'])
-                )
-                records_to_insert.append(record)
-            except Exception as e:
-                print(f"Error processing row: {e}")
-                continue
-
-        if records_to_insert:
-            cursor.executemany("""
-                INSERT INTO habitica_records 
-                (users_id, record_date, task_name, task_type, task_value, task_id)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                ON CONFLICT (users_id, task_id, record_date) 
-                DO UPDATE SET task_value = EXCLUDED.task_value
-            """, records_to_insert)
-            
-            conn.commit()
-            print(f"Inserted/Updated {len(records_to_insert)} records")
-
-            # Get new latest date
-            cursor.execute("SELECT MAX(record_date) FROM habitica_records WHERE users_id = %s", [user_id])
-            after_date = cursor.fetchone()[0]
-            print(f"Latest date in database after insert: {after_date}")
-            
-    except Exception as e:
-        print(f"Process error: {e}")
-        conn.rollback()
-        raise
-    finally:
-        cursor.close()
-        conn.close()
-
-@lru_cache(maxsize=100)
-def get_cached_user_data(user_id, timestamp):
-    """Cache user data for 5 minutes"""
-    return fetch_user_data(user_id)
+# Page views trigger a background refresh once the last sync is older than this
+SYNC_MAX_AGE = float(os.getenv('habitica_sync_max_age', 300))
+
+# Per-user HabiticaHistory objects, dropped as soon as an ingest writes new rows
+user_data_cache = TTLCache(
+    ttl=float(os.getenv('habitica_cache_ttl', 300)),
+    max_entries=int(os.getenv('habitica_cache_entries', 1024)),
+    max_bytes=int(os.getenv('habitica_cache_mb', 64)) * 1024 * 1024
+)
+register_cache('habitica_frames', user_data_cache.stats)
+
+@register_invalidation_hook
+def invalidate_user_data(user_id, domain):
+    if domain == 'habitica':
+        user_data_cache.invalidate_where(lambda key: key[0] == user_id)
+
+def get_cached_user_data(user_id, version):
+    """The user's cached Habitica history; read-only, so shared between requests.
+
+    Keyed on the user's habitica data version: invalidation only reaches this
+    process, so an ingest elsewhere is noticed through the version instead.
+    """
+    return user_data_cache.get_or_load((user_id, 'records', version), lambda: fetch_user_data(user_id))
+
+def get_cached_rollup_data(user_id, bucket, version):
+    return user_data_cache.get_or_load(
+        (user_id, 'rollup', bucket, version), lambda: fetch_rollup_data(user_id, bucket)
+    )
+
+def habitica_frame(user_id, time_range, bucket, version=None):
+    """The cached history a time range is charted from; year ranges use the rollup table"""
+    if version is None:
+        version = current_version(user_id, 'habitica')
+    if time_range.lower() == 'year':
+        return get_cached_rollup_data(user_id, bucket, version)
+    return get_cached_user_data(user_id, version)
+
+def format_task_series(history, task_type, time_range, bucket):
+    if time_range.lower() == 'year':
+        return format_rollup_series(history, task_type=task_type, bucket=bucket)
+    return filter_and_format_data(history, task_type=task_type, time_range=time_range)
+
+def task_series(user_id, task_type, time_range, bucket):
+    """Chart data for one task type"""
+    return format_task_series(habitica_frame(user_id, time_range, bucket), task_type, time_range, bucket)
+
+# Statements per request with a cold cache: the data version check plus one
+# frame load
+HABITICA_QUERY_BUDGET = 2
+# /user/habitica has no ETag but looks up the credentials and claims a
+# background refresh when one is due
+HABITICA_STATS_QUERY_BUDGET = HABITICA_QUERY_BUDGET + 2
 
 @habitica_bp.route('/user/habitica', methods=['GET'])
 @token_required
+@query_budget(HABITICA_STATS_QUERY_BUDGET)
 def get_habitica_stats(current_user_id):
     time_range = request.args.get('time_range', 'month')  # Get from query params
+    bucket = request.args.get('bucket', 'week')
+    if bucket not in ROLLUP_FREQ:
+        return jsonify({"error": "Invalid bucket"}), 400
     credentials = get_habitica_credentials(current_user_id)
     if not credentials:
         return jsonify({"error": "No Habitica API credentials found"}), 404
         
-    df = fetch_habitica_data(credentials)
-    if df is None:
-        return jsonify({"error": "Failed to fetch Habitica data"}), 500
+    # Upstream fetch and ingest run in the background; serve what we have
+    job = scheduler.refresh(current_user_id, SYNC_MAX_AGE)
         
     try:
-        process_habitica_data(df, current_user_id)
-        data = graph_fetch(user_id=current_user_id, time_range=time_range)
+        data = task_series(current_user_id, None, time_range, bucket)
+        data["Sync"] = job.to_dict()
         return jsonify(data)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -163,29 +97,49 @@ def get_habitica_stats(current_user_id):
 
 @habitica_bp.route('/user/habitica/daily', methods=['GET'])
 @token_required
+@query_budget(HABITICA_QUERY_BUDGET)
+@conditional_get('habitica')
+@cached_response('habitica')
 def get_habitica_daily(current_user_id):
     time_range = request.args.get('time_range', 'month')
+    bucket = request.args.get('bucket', 'week')
+    if bucket not in ROLLUP_FREQ:
+        return jsonify({"error": "Invalid bucket", "Keys": [], "Values": [], "Dates": []}), 400
     try:
         # Get cached data or fetch new data
-        cache_timestamp = int(time.time() / 300)  # Changes every 5 minutes
-        df = get_cached_user_data(current_user_id, cache_timestamp)
-        
-        data = filter_and_format_data(df, task_type='daily', time_range=time_range)
+        data = task_series(current_user_id, 'daily', time_range, bucket)
         return jsonify(data)
     except Exception as e:
-        print(f"Daily Route Error: {e}")
+        logger.exception("Daily route error")
         return jsonify({"error": str(e), "Keys": [], "Values": [], "Dates": []}), 500
 
 @habitica_bp.route('/user/habitica/habit', methods=['GET'])
 @token_required
+@query_budget(HABITICA_QUERY_BUDGET)
+@conditional_get('habitica')
+@cached_response('habitica')
 def get_habitica_habit(current_user_id):
     time_range = request.args.get('time_range', 'month')
+    bucket = request.args.get('bucket', 'week')
+    if bucket not in ROLLUP_FREQ:
+        return jsonify({"error": "Invalid bucket", "Keys": [], "Values": [], "Dates": []}), 400
     try:
         # Get cached data or fetch new data
-        cache_timestamp = int(time.time() / 300)  # Changes every 5 minutes
-        df = get_cached_user_data(current_user_id, cache_timestamp)
-        
-        data = filter_and_format_data(df, task_type='habit', time_range=time_range)
+        data = task_series(current_user_id, 'habit', time_range, bucket)
         return jsonify(data)
     except Exception as e:
         return jsonify({"error": str(e), "Keys": [], "Values": [], "Dates": []}), 500
+
+@habitica_bp.route('/user/habitica/sync', methods=['POST'])
+@token_required
+def trigger_habitica_sync(current_user_id):
+    job = scheduler.submit(current_user_id)
+    return jsonify(job.to_dict()), 202
+
+@habitica_bp.route('/user/habitica/sync', methods=['GET'])
+@token_required
+def get_habitica_sync(current_user_id):
+    job = scheduler.status(current_user_id)
+    if job is None:
+        return jsonify({"error": "No sync has been requested"}), 404
+    return jsonify(job.to_dict())
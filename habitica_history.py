@@ -0,0 +1,116 @@
+"""Compact, column-oriented Habitica records for the frame cache."""
+import sys
+import numpy as np
+import pandas as pd
+
+EPOCH = pd.Timestamp('1970-01-01')
+
+# Column order of the COPY output from_csv() parses. Dates arrive as day
+# numbers (date - DATE '1970-01-01'), so nothing is parsed as a date here.
+CSV_COLUMNS = ['watermark', 'task_name', 'task_value', 'day', 'task_type']
+
+def day_number(timestamp):
+    """First day number on or after `timestamp`"""
+    return (pd.Timestamp(timestamp).ceil('D') - EPOCH).days
+
+def _codes(labels):
+    """(smallest unsigned codes array, tuple of distinct labels)"""
+    codes, uniques = pd.factorize(labels, sort=False)
+    dtype = np.min_scalar_type(max(len(uniques) - 1, 0))
+    return codes.astype(dtype), tuple(uniques)
+
+class HabiticaHistory:
+    """One user's records as parallel arrays, in the order they were loaded.
+
+    Task names and types are stored once and referenced by small integer
+    codes, dates as int32 day numbers and values as float64. The arrays are
+    read-only, so one instance can be shared by every request.
+    """
+
+    __slots__ = ('task_names', 'task_types', 'name_codes', 'type_codes', 'days', 'values', 'attrs')
+
+    def __init__(self, task_names, task_types, name_codes, type_codes, days, values, attrs=None):
+        self.task_names = task_names
+        self.task_types = task_types
+        self.name_codes = name_codes
+        self.type_codes = type_codes
+        self.days = days
+        self.values = values
+        self.attrs = attrs or {}
+        for array in (name_codes, type_codes, days, values):
+            array.flags.writeable = False
+
+    @classmethod
+    def from_columns(cls, task_names, task_values, days, task_types, attrs=None):
+        name_codes, names = _codes(np.asarray(task_names, dtype=object))
+        type_codes, types = _codes(np.asarray(task_types, dtype=object))
+        return cls(names, types, name_codes, type_codes,
+                   np.asarray(days, dtype=np.int32),
+                   np.asarray(task_values, dtype=np.float64), attrs)
+
+    @classmethod
+    def from_frame(cls, df):
+        """From a frame with task_name, task_value, record_date and task_type columns"""
+        days = pd.to_datetime(df['record_date']).to_numpy(dtype='datetime64[D]').astype(np.int64)
+        return cls.from_columns(df['task_name'], df['task_value'], days, df['task_type'])
+
+    @classmethod
+    def from_csv(cls, buffer):
+        """Parse COPY ... TO STDOUT (FORMAT csv) output laid out as CSV_COLUMNS.
+
+        A row without a day only carries the watermark (the user had no
+        records in the window); the watermark of the first row is kept.
+        """
+        # Only empty numeric fields (COPY's NULL) are missing. Task names such
+        # as "NA", "null" or "" are kept as written instead of turning into
+        # NaN and collapsing into one task
+        parsed = pd.read_csv(buffer, header=None, names=CSV_COLUMNS, dtype={
+            'watermark': 'Int32', 'task_name': object, 'task_value': np.float64,
+            'day': 'Int32', 'task_type': object
+        }, keep_default_na=False, na_values={'watermark': [''], 'task_value': [''], 'day': ['']})
+        watermark = None
+        if len(parsed) and not pd.isna(parsed['watermark'].iat[0]):
+            watermark = (EPOCH + pd.Timedelta(days=int(parsed['watermark'].iat[0]))).date()
+        parsed = parsed[parsed['day'].notna()]
+        return cls.from_columns(
+            parsed['task_name'].to_numpy(),
+            parsed['task_value'].to_numpy(),
+            parsed['day'].to_numpy(dtype=np.int32),
+            parsed['task_type'].to_numpy(),
+            {'watermark': watermark}
+        )
+
+    def __len__(self):
+        return len(self.days)
+
+    @property
+    def empty(self):
+        return len(self.days) == 0
+
+    @property
+    def nbytes(self):
+        arrays = self.name_codes.nbytes + self.type_codes.nbytes + self.days.nbytes + self.values.nbytes
+        return arrays + sum(sys.getsizeof(label) for label in self.task_names + self.task_types)
+
+    def take(self, mask):
+        return HabiticaHistory(
+            self.task_names, self.task_types, self.name_codes[mask], self.type_codes[mask],
+            self.days[mask], self.values[mask], self.attrs
+        )
+
+    def of_type(self, task_type):
+        """Records whose task type matches, case-insensitively"""
+        wanted = [code for code, name in enumerate(self.task_types) if name.lower() == task_type.lower()]
+        return self.take(np.isin(self.type_codes, wanted))
+
+    def between(self, start, end=None):
+        """Records dated on or after `start` and before `end` (timestamps; end may be None)"""
+        mask = self.days >= day_number(start)
+        if end is not None:
+            mask &= self.days < day_number(end)
+        return self.take(mask)
+
+    def latest_date(self):
+        if self.empty:
+            return None
+        return EPOCH + pd.Timedelta(days=int(self.days.max()))
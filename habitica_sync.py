@@ -0,0 +1,353 @@
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from psycopg2.extras import Json
+from db import get_connection
+from schema import ensure_schema
+from partitions import apply_retention, RETENTION_MONTHS
+from Fetch_Habitica import (
+    get_habitica_credentials,
+    get_upstream_validators,
+    fetch_habitica_data,
+    process_habitica_data,
+    NOT_MODIFIED
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Queued or running jobs older than this belong to a worker that died
+SYNC_STALE_AFTER = float(os.getenv('habitica_sync_stale_after', 900))
+# After n consecutive failures, scheduled syncs wait base * 2^(n-1) seconds, up to max
+SYNC_BACKOFF_BASE = float(os.getenv('habitica_sync_backoff', 60))
+SYNC_BACKOFF_MAX = float(os.getenv('habitica_sync_backoff_max', 3600))
+# First pg_advisory_lock key of the per-user sync lock; the user id is the second
+SYNC_LOCK_NAMESPACE = 72010422
+
+JOB_COLUMNS = """
+    sync_status, sync_queued_at, sync_started_at, sync_finished_at,
+    sync_result, sync_error, sync_failures, sync_retry_at
+"""
+
+def _epoch(value):
+    return value.timestamp() if value is not None else None
+
+class SyncJob:
+    """One Habitica refresh for one user, as recorded in habitica_sync_state"""
+
+    def __init__(self, user_id, status='queued', queued_at=None, started_at=None, finished_at=None,
+                 result=None, error=None, failures=0, retry_at=None):
+        self.user_id = user_id
+        self.status = status
+        self.queued_at = queued_at if queued_at is not None else time.time()
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self.result = result
+        self.error = error
+        self.failures = failures
+        self.retry_at = retry_at
+
+    @classmethod
+    def from_row(cls, user_id, row):
+        status, queued_at, started_at, finished_at, result, error, failures, retry_at = row
+        return cls(user_id, status, _epoch(queued_at), _epoch(started_at), _epoch(finished_at),
+                   result, error, failures, _epoch(retry_at))
+
+    @property
+    def in_flight(self):
+        if self.status not in ('queued', 'running'):
+            return False
+        return time.time() - max(self.queued_at or 0, self.started_at or 0) < SYNC_STALE_AFTER
+
+    def to_dict(self):
+        return {
+            "user_id": self.user_id,
+            "status": self.status,
+            "queued_at": self.queued_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+            "failures": self.failures,
+            "retry_at": self.retry_at
+        }
+
+LOAD_JOB_SQL = f"SELECT {JOB_COLUMNS} FROM habitica_sync_state WHERE users_id = %(user_id)s"
+
+# Queues a job unless one is in flight (or fresh, or backing off, given
+# max_age); returns (claimed, job columns...) for the queued or current job
+CLAIM_JOB_SQL = f"""
+    WITH claimed AS (
+        INSERT INTO habitica_sync_state AS s (users_id, sync_status, sync_queued_at)
+        VALUES (%(user_id)s, 'queued', NOW())
+        ON CONFLICT (users_id) DO UPDATE
+        SET sync_status = 'queued', sync_queued_at = NOW(), sync_started_at = NULL,
+            sync_finished_at = NULL, sync_result = NULL, sync_error = NULL
+        WHERE s.sync_status IS NULL
+        OR (s.sync_status IN ('queued', 'running')
+            AND GREATEST(s.sync_queued_at, s.sync_started_at) < NOW() - make_interval(secs => %(stale)s))
+        OR (s.sync_status NOT IN ('queued', 'running') AND %(max_age)s::float8 IS NULL)
+        OR (s.sync_status = 'done' AND s.sync_finished_at < NOW() - make_interval(secs => %(max_age)s))
+        OR (s.sync_status = 'failed' AND (s.sync_retry_at IS NULL OR s.sync_retry_at <= NOW()))
+        RETURNING {JOB_COLUMNS}
+    )
+    SELECT TRUE, * FROM claimed
+    UNION ALL
+    SELECT FALSE, {JOB_COLUMNS} FROM habitica_sync_state
+    WHERE users_id = %(user_id)s AND NOT EXISTS (SELECT 1 FROM claimed)
+"""
+
+MARK_RUNNING_SQL = """
+    UPDATE habitica_sync_state SET sync_status = 'running', sync_started_at = NOW()
+    WHERE users_id = %(user_id)s
+"""
+
+RECORD_DONE_SQL = """
+    UPDATE habitica_sync_state
+    SET sync_status = 'done', sync_finished_at = NOW(), sync_result = %(result)s,
+        sync_error = NULL, sync_failures = 0, sync_retry_at = NULL
+    WHERE users_id = %(user_id)s
+"""
+
+RECORD_FAILED_SQL = """
+    UPDATE habitica_sync_state
+    SET sync_status = 'failed', sync_finished_at = NOW(), sync_error = %(error)s,
+        sync_failures = sync_failures + 1,
+        sync_retry_at = NOW() + make_interval(
+            secs => LEAST(%(base)s * power(2, sync_failures), %(max)s))
+    WHERE users_id = %(user_id)s
+"""
+
+def load_job(user_id):
+    """The user's last sync job, or None if none was ever requested"""
+    ensure_schema()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(LOAD_JOB_SQL, {"user_id": user_id})
+        row = cursor.fetchone()
+        cursor.close()
+    if row is None or row[0] is None:
+        return None
+    return SyncJob.from_row(user_id, row)
+
+def claim_job(user_id, max_age=None):
+    """Mark a sync as queued unless one is in flight in any process.
+
+    With max_age, a job that finished successfully within max_age seconds,
+    or failed and is still backing off, is also left alone. Returns
+    (job, claimed): claimed is True when this call queued the job and the
+    caller must run it; otherwise job is the user's current one. One
+    statement either way.
+    """
+    ensure_schema()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(CLAIM_JOB_SQL, {"user_id": user_id, "stale": SYNC_STALE_AFTER, "max_age": max_age})
+        row = cursor.fetchone()
+        conn.commit()
+        cursor.close()
+    if row is None:
+        # The row was inserted concurrently, after this statement's snapshot
+        return load_job(user_id), False
+    return SyncJob.from_row(user_id, row[1:]), row[0]
+
+def mark_running(user_id):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(MARK_RUNNING_SQL, {"user_id": user_id})
+        conn.commit()
+        cursor.close()
+
+def record_result(user_id, result=None, error=None):
+    """Finish the user's job; a failure pushes sync_retry_at out exponentially"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        if error is None:
+            cursor.execute(RECORD_DONE_SQL, {"result": Json(result), "user_id": user_id})
+        else:
+            cursor.execute(RECORD_FAILED_SQL, {
+                "error": error, "base": SYNC_BACKOFF_BASE, "max": SYNC_BACKOFF_MAX, "user_id": user_id
+            })
+        conn.commit()
+        cursor.close()
+
+class SyncInProgress(Exception):
+    """Another process holds the user's sync lock"""
+
+@contextmanager
+def user_sync_lock(user_id):
+    """Session advisory lock on its own pooled connection, held for the whole sync"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_try_advisory_lock(%s, %s)", [SYNC_LOCK_NAMESPACE, user_id])
+        acquired = cursor.fetchone()[0]
+        conn.commit()
+        if not acquired:
+            cursor.close()
+            raise SyncInProgress(f"Habitica sync already running for user {user_id}")
+        try:
+            yield
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(%s, %s)", [SYNC_LOCK_NAMESPACE, user_id])
+            conn.commit()
+            cursor.close()
+
+def sync_user(user_id):
+    """Download the user's Habitica export and ingest it, one process at a time per user"""
+    with user_sync_lock(user_id):
+        credentials = get_habitica_credentials(user_id)
+        if not credentials:
+            raise LookupError("No Habitica API credentials found")
+        df = fetch_habitica_data(credentials, get_upstream_validators(user_id))
+        if df is NOT_MODIFIED:
+            return {"written": 0, "skipped": 0, "not_modified": True}
+        if df is None:
+            raise RuntimeError("Failed to fetch Habitica data")
+        return process_habitica_data(df, user_id)
+
+def run_job(user_id, sync=sync_user):
+    """Run a claimed job and record how it ended"""
+    mark_running(user_id)
+    try:
+        result = sync(user_id)
+    except SyncInProgress:
+        # The lock holder records the outcome on the same row
+        logger.info("Habitica sync for user %s already running elsewhere", user_id)
+        return
+    except Exception as e:
+        logger.error("Habitica sync failed for user %s: %s", user_id, e)
+        record_result(user_id, error=str(e))
+        return
+    record_result(user_id, result)
+
+class SyncScheduler:
+    """Worker pool that refreshes users' Habitica data off the request path.
+
+    Job state lives in habitica_sync_state, so at most one job per user is
+    queued or running across all processes, and a per-user advisory lock
+    guards the sync itself. Failed jobs back off exponentially before page
+    views or the schedule retry them. When ``interval`` is set, every user
+    with Habitica credentials is refreshed roughly every ``interval``
+    seconds, spread by +/- ``jitter`` (a fraction of the interval) so
+    workers don't all hit habitica.com at once. With
+    habitica_retention_months set, expired partitions are archived every
+    ``retention_interval`` seconds.
+    """
+
+    def __init__(self, workers=2, interval=0, jitter=0.1, retention_interval=86400, sync=sync_user):
+        self.workers = workers
+        self.interval = interval
+        self.jitter = jitter
+        self.retention_interval = retention_interval
+        self._sync = sync
+        self._queue = queue.Queue()
+        self._next_due = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"habitica-sync-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            if self.interval > 0:
+                thread = threading.Thread(target=self._schedule, name="habitica-sync-scheduler", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            if self.retention_interval > 0 and RETENTION_MONTHS:
+                thread = threading.Thread(target=self._retain, name="habitica-retention", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for _ in range(self.workers):
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, user_id, max_age=None):
+        """Queue a sync for user_id, or return the one in flight in any process"""
+        self.start()
+        job, claimed = claim_job(user_id, max_age)
+        if claimed:
+            self._queue.put(user_id)
+        return job
+
+    def refresh(self, user_id, max_age):
+        """Submit a sync unless one is in flight, finished within max_age
+        seconds, or failed recently enough to still be backing off"""
+        return self.submit(user_id, max_age)
+
+    def status(self, user_id):
+        return load_job(user_id)
+
+    def _work(self):
+        while not self._stop.is_set():
+            user_id = self._queue.get()
+            if user_id is None:
+                break
+            try:
+                run_job(user_id, self._sync)
+            except Exception:
+                logger.exception("Habitica sync worker error")
+            finally:
+                self._queue.task_done()
+
+    def _due_in(self):
+        spread = self.interval * self.jitter
+        return self.interval + random.uniform(-spread, spread)
+
+    def _schedule(self):
+        while not self._stop.is_set():
+            try:
+                now = time.time()
+                for user_id in habitica_user_ids():
+                    if user_id not in self._next_due:
+                        # Spread the first round across one interval
+                        self._next_due[user_id] = now + random.uniform(0, self.interval)
+                    elif self._next_due[user_id] <= now:
+                        # Other workers run the same sweep; the shared job
+                        # state keeps it to one sync per user per interval
+                        self.refresh(user_id, self.interval * (1 - self.jitter))
+                        self._next_due[user_id] = now + self._due_in()
+            except Exception as e:
+                logger.exception("Habitica sync scheduler error")
+            self._stop.wait(min(self.interval, 60))
+
+    def _retain(self):
+        while not self._stop.is_set():
+            try:
+                apply_retention()
+            except Exception:
+                logger.exception("Habitica retention error")
+            self._stop.wait(self.retention_interval)
+
+HABITICA_USERS_SQL = """
+    SELECT DISTINCT users_id
+    FROM api_records
+    WHERE api_type = 'habitica'
+"""
+
+def habitica_user_ids():
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(HABITICA_USERS_SQL)
+        user_ids = [r[0] for r in cursor.fetchall()]
+        cursor.close()
+    return user_ids
+
+scheduler = SyncScheduler(
+    workers=int(os.getenv('habitica_sync_workers', 2)),
+    interval=float(os.getenv('habitica_sync_interval', 0)),
+    jitter=float(os.getenv('habitica_sync_jitter', 0.1)),
+    retention_interval=float(os.getenv('habitica_retention_interval', 86400))
+)
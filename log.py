@@ -0,0 +1,122 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Set per request (thread or task) and stamped onto every record logged under it
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request_id and extra fields"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+class _QueueHandler(QueueHandler):
+    """Hands records to the listener thread with only cheap work done here.
+
+    Unlike the stdlib handler it keeps extra fields as-is and leaves final
+    formatting to the listener; args are merged and tracebacks rendered so
+    the record no longer references request-thread objects.
+    """
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+_listener = None
+
+def configure_logging():
+    """Route all logging through a queue to a stderr writer thread.
+
+    log_level sets the level (default INFO); log_format is json (default)
+    or text. Safe to call more than once.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    if os.getenv('log_format', 'json').lower() == 'text':
+        formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s')
+    else:
+        formatter = JsonFormatter()
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(RequestIdFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(os.getenv('log_level', 'INFO').upper())
+
+    _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+access_logger = logging.getLogger('access')
+
+def log_request(method, path, status, started):
+    access_logger.info("%s %s %s", method, path, status, extra={
+        "method": method,
+        "path": path,
+        "status": status,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+    })
+
+def install_request_logging(app):
+    """Give each Flask request an ID (from X-Request-ID or new) and log it on completion"""
+    from flask import g, request
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id_token = request_id_var.set(request.headers.get('X-Request-ID') or uuid.uuid4().hex)
+        g.request_log_started = time.perf_counter()
+
+    @app.after_request
+    def log_response(response):
+        response.headers['X-Request-ID'] = request_id_var.get() or ''
+        started = g.get('request_log_started')
+        if started is not None:
+            log_request(request.method, request.full_path.rstrip('?'), response.status_code, started)
+        return response
+
+    @app.teardown_request
+    def reset_request_id(exc):
+        token = g.pop('request_id_token', None)
+        if token is not None:
+            request_id_var.reset(token)
@@ -1,24 +1,29 @@
 from flask import Flask, jsonify, request, session, g
 from flask_cors import CORS
-from auth import register_user, login_user
-from db import connect_to_postgres
-import jwt
-import datetime
-from datetime import UTC
-from functools import wraps
+from auth import register_user, login_user, token_required, issue_token, JWT_SECRET
 from api_page import api_bp
 from habitica import habitica_bp
 from sleep import sleep_bp  # Add sleep blueprint
 from dotenv import load_dotenv
 import os
+import threading
 from gym import gym_bp  # Add this import
+from dashboard import dashboard_bp
+from habitica_sync import scheduler as habitica_sync_scheduler
+from schema import ensure_schema
+from metrics import metrics_bp, instrument_app
+from log import configure_logging, install_request_logging
+from serialization import install_serialization
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables first
 load_dotenv('.env.local')
+configure_logging()
 
 # Get secrets after loading env vars
 secret_key_flask = os.getenv('secret_key_flask')
-JWT_SECRET = os.getenv('secret_key_jwt')
 
 if not secret_key_flask or not JWT_SECRET:
     raise RuntimeError("Missing required secret keys in environment variables")
@@ -26,20 +31,9 @@ if not secret_key_flask or not JWT_SECRET:
 app = Flask(__name__)
 app.config['SECRET_KEY'] = secret_key_flask  # Changed from app.secret_key to app.config
 cors = CORS(app, origins="*")
-
-def token_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = request.headers.get('Authorization')
-        if not token:
-            return jsonify({'message': 'Token is missing'}), 401
-        try:
-            token = token.split()[1]  # Remove 'Bearer ' prefix
-            data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-            return f(data['user_id'], *args, **kwargs)  # Pass user_id from token
-        except:
-            return jsonify({'message': 'Token is invalid'}), 401
-    return decorated
+instrument_app(app)
+install_request_logging(app)
+install_serialization(app)
 
 @app.route('/register', methods=['POST'])
 def register():
@@ -48,6 +42,8 @@ def register():
     password = data.get('password')
     email = data.get('email')
     result = register_user(username, password, email)
+    if result.get('error_type') == 'busy':
+        return jsonify(result), 503
     return jsonify(result)  # Return the complete result object
 
 @app.route('/login', methods=['POST'])
@@ -57,11 +53,9 @@ def login():
     password = data.get('password')
     result = login_user(username, password)
     if result['status'] == 'success':
-        token = jwt.encode({
-            'user_id': result['user_id'],
-            'exp': datetime.datetime.now(UTC) + datetime.timedelta(hours=24)  # Updated this line
-        }, JWT_SECRET)
-        result['token'] = token
+        result['token'] = issue_token(result['user_id'])
+    elif result.get('error_type') == 'busy':
+        return jsonify(result), 503
     return jsonify(result)
 
 @app.route('/logout', methods=['POST'])
@@ -73,6 +67,35 @@ app.register_blueprint(api_bp)
 app.register_blueprint(habitica_bp)
 app.register_blueprint(sleep_bp)
 app.register_blueprint(gym_bp)  # Add this line with other blueprints
+app.register_blueprint(dashboard_bp)
+app.register_blueprint(metrics_bp)
+
+# Startup work runs once per serving process, never at import: the password
+# hashing pool spawns children that re-import __main__, and they must not
+# migrate the schema or start sync threads
+_services_started = False
+_services_lock = threading.Lock()
+
+def start_background_services():
+    global _services_started
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+    # Create app-owned tables and indexes up front; retried lazily if the DB is down
+    try:
+        ensure_schema()
+    except Exception as e:
+        logger.error("Schema setup failed: %s", e)
+    # Periodic Habitica refresh (no-op unless habitica_sync_interval is set)
+    habitica_sync_scheduler.start()
+
+@app.before_request
+def ensure_background_services():
+    # WSGI servers import main:app without running the __main__ block
+    if not _services_started:
+        start_background_services()
 
 if __name__ == "__main__":
+    start_background_services()
     app.run(debug=True, port=5000)
@@ -0,0 +1,253 @@
+import contextvars
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import Blueprint, Response, request, g
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_registry = []
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+class Counter:
+    """Monotonic counter per label set"""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, key), value
+
+class Histogram:
+    """Cumulative histogram per label set, in Prometheus' bucket layout"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield (self.name + '_bucket',
+                       _format_labels(self.labelnames, key, [('le', _format_value(bound))]),
+                       cumulative)
+            yield self.name + '_sum', _format_labels(self.labelnames, key), total
+            yield self.name + '_count', _format_labels(self.labelnames, key), count
+
+class Gauge:
+    """Gauge read at scrape time; each callback returns {label values tuple: value}"""
+
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callbacks = []
+        _registry.append(self)
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+        return callback
+
+    def samples(self):
+        values = {}
+        for callback in self.callbacks:
+            try:
+                values.update(callback() or {})
+            except Exception as e:
+                logger.error("Metrics collection error for %s: %s", self.name, e)
+        for key, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, key), value
+
+def render():
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+request_latency = Histogram(
+    'http_request_duration_seconds', 'Request latency by route',
+    ('method', 'route', 'status')
+)
+query_latency = Histogram(
+    'db_query_duration_seconds', 'Query latency by statement and table',
+    ('statement', 'table')
+)
+query_rows = Counter(
+    'db_query_rows_total', 'Rows returned or affected by queries',
+    ('statement', 'table')
+)
+habitica_stage_latency = Histogram(
+    'habitica_stage_duration_seconds', 'Habitica sync stage latency; fetch includes the parse of a streamed download',
+    ('stage',), buckets=DEFAULT_BUCKETS + (30.0, 60.0)
+)
+
+cache_lookups = Gauge('cache_lookups', 'Cache lookups by result', ('cache', 'result'))
+cache_hit_ratio = Gauge('cache_hit_ratio', 'Cache hits / lookups since start', ('cache',))
+
+def register_cache(name, stats):
+    """Export a cache's stats() hits, misses and hit_ratio, labelled cache=name"""
+    cache_lookups.add_callback(lambda: {
+        (name, result): stats()[result] for result in ('hits', 'misses')
+    })
+    cache_hit_ratio.add_callback(lambda: {(name,): stats()['hit_ratio']})
+
+_STATEMENT = re.compile(r'^\s*(?:WITH\b.*?\)\s*)?(\w+)', re.IGNORECASE | re.DOTALL)
+_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE|COPY)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?"?(\w+)', re.IGNORECASE)
+
+def query_labels(query):
+    """Low-cardinality labels for a statement: its verb and first table"""
+    if not isinstance(query, str):
+        query = query.decode() if isinstance(query, bytes) else str(query)
+    statement = _STATEMENT.match(query)
+    table = _TABLE.search(query)
+    return {
+        "statement": statement.group(1).upper() if statement else 'UNKNOWN',
+        "table": table.group(1).lower() if table else ''
+    }
+
+# One entry per statement run by the current request; the list is shared with
+# threads the request hands work to, and append is atomic across them
+request_queries_var = contextvars.ContextVar('request_queries', default=None)
+# Raise instead of logging when a route runs more statements than its budget
+QUERY_BUDGET_STRICT = os.getenv('query_budget_strict', '0') != '0'
+
+request_queries = Histogram(
+    'http_request_queries', 'SQL statements run per request by route',
+    ('route',), buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 32)
+)
+
+class QueryBudgetExceeded(AssertionError):
+    """A route ran more SQL statements than its query_budget allows"""
+
+def count_query():
+    counter = request_queries_var.get()
+    if counter is not None:
+        counter.append(None)
+
+def queries_so_far():
+    counter = request_queries_var.get()
+    return len(counter) if counter is not None else 0
+
+def query_budget(limit):
+    """Flag a view that runs more than `limit` statements in one call.
+
+    Over-budget calls are logged, or raise QueryBudgetExceeded with
+    query_budget_strict=1 so a round-trip regression fails loudly in
+    development and in the benchmarks.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            before = queries_so_far()
+            result = f(*args, **kwargs)
+            used = queries_so_far() - before
+            if used > limit:
+                message = f"{request.method} {request.path} ran {used} queries, budget is {limit}"
+                if QUERY_BUDGET_STRICT:
+                    raise QueryBudgetExceeded(message)
+                logger.warning(message, extra={"queries": used, "query_budget": limit})
+            return result
+        return decorated
+    return decorator
+
+def observe_request(method, route, status, seconds):
+    request_latency.observe(seconds, method=method, route=route, status=str(status))
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(render(), content_type=CONTENT_TYPE)
+
+def instrument_app(app):
+    """Time every request of a Flask app and count its queries, labelled by URL rule"""
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        g.request_queries_token = request_queries_var.set([])
+
+    @app.after_request
+    def record_latency(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            observe_request(request.method, route, response.status_code, time.perf_counter() - started)
+            request_queries.observe(queries_so_far(), route=route)
+        return response
+
+    @app.teardown_request
+    def reset_query_count(exc):
+        token = g.pop('request_queries_token', None)
+        if token is not None:
+            request_queries_var.reset(token)
@@ -0,0 +1,187 @@
+"""Monthly partitions of habitica_records: creation on ingest and retention.
+
+Partitions are named habitica_records_YYYY_MM and created on demand by
+ensure_partitions() before rows are written. With habitica_retention_months
+set, apply_retention() detaches (or, with habitica_retention_action=drop,
+drops) every partition that ended before the cutoff. Detached partitions
+are renamed with a _detached_<timestamp> suffix, which frees the month for
+a new partition. Ingest refreshes the rollups in the same transaction as
+the rows, so detached months stay in the year view; only the per-day
+records go.
+
+    python partitions.py list
+    python partitions.py retention [--dry-run]
+"""
+from psycopg2 import sql
+from datetime import date, datetime
+from db import get_connection
+import argparse
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+PARENT = 'habitica_records'
+# 0 keeps every month; otherwise at least 2 so the 30-day window is never cut
+RETENTION_MONTHS = int(os.getenv('habitica_retention_months', 0))
+RETENTION_ACTION = os.getenv('habitica_retention_action', 'detach').lower()
+
+# pg_advisory_lock key held by the one process applying retention
+RETENTION_LOCK_ID = 72010423
+
+# Months this process already knows to have a partition. Another process
+# may detach one of them; reload_known_months() resyncs after a failed insert
+_known_months = set()
+_known_lock = threading.Lock()
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+def add_months(day, months):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month):
+    return f"{PARENT}_{month:%Y_%m}"
+
+def archive_name(name, now=None):
+    """Name a detached partition is kept under, e.g. habitica_records_2024_01_detached_20260301120000"""
+    return f"{name}_detached_{now or datetime.now():%Y%m%d%H%M%S}"
+
+def retention_cutoff(today=None):
+    """First day still kept, or None when retention is off"""
+    if not RETENTION_MONTHS:
+        return None
+    if RETENTION_MONTHS < 2:
+        raise ValueError("habitica_retention_months must be 0 (off) or at least 2")
+    return add_months(month_start(today or date.today()), -RETENTION_MONTHS)
+
+def ensure_partitions(first_day, last_day):
+    """Create any missing monthly partitions covering first_day..last_day"""
+    months = []
+    month = month_start(first_day)
+    while month <= last_day:
+        months.append(month)
+        month = add_months(month, 1)
+    with _known_lock:
+        missing = [m for m in months if m not in _known_months]
+    if not missing:
+        return 0
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT habitica_records_ensure_partitions(%s, %s)",
+                [missing[0], missing[-1]]
+            )
+            created = cursor.fetchone()[0]
+            conn.commit()
+        finally:
+            cursor.close()
+    with _known_lock:
+        _known_months.update(missing)
+    if created:
+        logger.info("Created %d habitica_records partitions", created, extra={
+            "first_month": str(missing[0]), "last_month": str(missing[-1])
+        })
+    return created
+
+def reload_known_months():
+    """Replace the cached months with the partitions attached right now"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            attached = {month for month, name in list_partitions(cursor)}
+        finally:
+            cursor.close()
+    with _known_lock:
+        _known_months.clear()
+        _known_months.update(attached)
+
+def list_partitions(cursor):
+    """[(month, name)] of partitions attached to habitica_records, oldest first"""
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+    """, [PARENT])
+    partitions = []
+    for (name,) in cursor.fetchall():
+        suffix = name[len(PARENT) + 1:]
+        try:
+            year, month = (int(part) for part in suffix.split('_'))
+        except ValueError:
+            continue
+        partitions.append((date(year, month, 1), name))
+    return sorted(partitions)
+
+def apply_retention(cutoff=None, dry_run=False):
+    """Detach or drop partitions that end before the cutoff; returns their names.
+
+    Every worker runs this on a timer, so it is skipped (returns []) while
+    another process holds the retention lock.
+    """
+    cutoff = cutoff or retention_cutoff()
+    if cutoff is None:
+        return []
+    if RETENTION_ACTION not in ('detach', 'drop'):
+        raise ValueError(f"Unknown habitica_retention_action: {RETENTION_ACTION}")
+    expired = []
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", [RETENTION_LOCK_ID])
+        locked = cursor.fetchone()[0]
+        conn.commit()
+        if not locked:
+            cursor.close()
+            logger.info("Retention already running in another process")
+            return []
+        try:
+            for month, name in list_partitions(cursor):
+                if add_months(month, 1) > cutoff:
+                    break
+                expired.append(name)
+                if dry_run:
+                    continue
+                cursor.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(
+                    sql.Identifier(PARENT), sql.Identifier(name)
+                ))
+                if RETENTION_ACTION == 'drop':
+                    cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
+                else:
+                    # Free the partition name, so the month can be created again
+                    # if retention is lengthened or old records are re-ingested
+                    cursor.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(
+                        sql.Identifier(name), sql.Identifier(archive_name(name))
+                    ))
+                conn.commit()
+                with _known_lock:
+                    _known_months.discard(month)
+                logger.info("Retention: %s %s", 'dropped' if RETENTION_ACTION == 'drop' else 'detached', name)
+        finally:
+            conn.rollback()
+            cursor.execute("SELECT pg_advisory_unlock(%s)", [RETENTION_LOCK_ID])
+            conn.commit()
+            cursor.close()
+    return expired
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=['list', 'retention'])
+    parser.add_argument('--dry-run', action='store_true', help="Only report what retention would remove")
+    args = parser.parse_args()
+    if args.command == 'list':
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            for month, name in list_partitions(cursor):
+                print(f"{month:%Y-%m}  {name}")
+            cursor.close()
+    else:
+        expired = apply_retention(dry_run=args.dry_run)
+        verb = 'Would remove' if args.dry_run else 'Removed'
+        print(f"{verb} {len(expired)} partitions (cutoff {retention_cutoff()}): {', '.join(expired) or '-'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+"""Database schema as an ordered list of versioned migrations.
+
+Each migration runs once, in its own transaction, and is recorded in
+schema_migrations. Workers starting together serialize on an advisory
+lock, so every migration is applied exactly once.
+
+    python schema.py migrate        apply pending migrations
+    python schema.py status         list applied and pending migrations
+    python schema.py check-indexes  EXPLAIN the hot queries, fail on seq scans
+"""
+from db import get_connection
+import logging
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+# pg_advisory_lock key shared by every process running migrations
+MIGRATION_LOCK_ID = 72010421
+
+# (version, name, statements). Never edit an applied migration; add a new one.
+# The early ones use IF NOT EXISTS because they describe tables that
+# databases created before the runner already have.
+MIGRATIONS = [
+    (1, "base tables", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            password TEXT NOT NULL,
+            email TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS api_records (
+            api_record_id SERIAL PRIMARY KEY,
+            users_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            api_type TEXT NOT NULL,
+            api_id TEXT NOT NULL,
+            api_key TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS sleep_records (
+            sleep_record_id SERIAL PRIMARY KEY,
+            users_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            hours INTEGER NOT NULL,
+            record_date DATE NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS gym_records (
+            gym_record_id SERIAL PRIMARY KEY,
+            users_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            start_time TIMESTAMPTZ NOT NULL,
+            end_time TIMESTAMPTZ NOT NULL,
+            exercise_title TEXT NOT NULL,
+            exercise_notes TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS habitica_records (
+            users_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            task_id TEXT NOT NULL,
+            record_date DATE NOT NULL,
+            task_name TEXT NOT NULL,
+            task_type TEXT NOT NULL,
+            task_value DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (users_id, task_id, record_date)
+        )
+        """,
+    ]),
+    (2, "sync state, rollups and data versions", [
+        """
+        CREATE TABLE IF NOT EXISTS habitica_sync_state (
+            users_id INTEGER PRIMARY KEY,
+            last_record_date DATE,
+            history_hash TEXT,
+            synced_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        """,
+        # Validators of the last ingested export, for conditional re-downloads
+        "ALTER TABLE habitica_sync_state ADD COLUMN IF NOT EXISTS upstream_etag TEXT",
+        "ALTER TABLE habitica_sync_state ADD COLUMN IF NOT EXISTS upstream_last_modified TEXT",
+        """
+        CREATE TABLE IF NOT EXISTS habitica_rollups (
+            users_id INTEGER NOT NULL,
+            bucket TEXT NOT NULL,
+            period_start DATE NOT NULL,
+            task_type TEXT NOT NULL,
+            task_name TEXT NOT NULL,
+            task_value DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (users_id, bucket, period_start, task_type, task_name)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_data_versions (
+            users_id INTEGER NOT NULL,
+            domain TEXT NOT NULL,
+            version BIGINT NOT NULL,
+            PRIMARY KEY (users_id, domain)
+        )
+        """,
+        # Superseded key-only indexes from before the runner
+        "DROP INDEX IF EXISTS sleep_records_user_date_idx",
+        "DROP INDEX IF EXISTS gym_records_user_start_idx",
+    ]),
+    (3, "sleep records unique per user and date", [
+        # record_date used to be unique on its own, so two users could not
+        # log the same night. Drop whatever enforced that, under any name.
+        """
+        DO $$
+        DECLARE
+            target record;
+            date_attnum int2 := (
+                SELECT attnum FROM pg_attribute
+                WHERE attrelid = 'sleep_records'::regclass AND attname = 'record_date'
+            );
+        BEGIN
+            FOR target IN
+                SELECT conname FROM pg_constraint
+                WHERE conrelid = 'sleep_records'::regclass
+                AND contype = 'u' AND conkey = ARRAY[date_attnum]
+            LOOP
+                EXECUTE format('ALTER TABLE sleep_records DROP CONSTRAINT %I', target.conname);
+            END LOOP;
+            FOR target IN
+                SELECT indexrelid::regclass AS index_name FROM pg_index
+                WHERE indrelid = 'sleep_records'::regclass
+                AND indisunique AND NOT indisprimary AND indkey::int2[] = ARRAY[date_attnum]
+            LOOP
+                EXECUTE format('DROP INDEX %s', target.index_name);
+            END LOOP;
+        END $$
+        """,
+        # Conflict target of the sleep upserts; also covers pages, exports and series
+        "CREATE UNIQUE INDEX IF NOT EXISTS sleep_records_user_date_key ON sleep_records (users_id, record_date) INCLUDE (hours)",
+        "DROP INDEX IF EXISTS sleep_records_user_date_hours_idx",
+    ]),
+    (4, "indexes for hot queries", [
+        # Login and registration look users up by name
+        "CREATE UNIQUE INDEX IF NOT EXISTS users_name_key ON users (name)",
+        # Credential lookups and the API page, by user then type
+        "CREATE INDEX IF NOT EXISTS api_records_user_type_idx ON api_records (users_id, api_type) INCLUDE (api_id, api_key)",
+        # Scheduler sweep: every user with Habitica credentials
+        "CREATE INDEX IF NOT EXISTS api_records_type_user_idx ON api_records (api_type, users_id)",
+        # Gym pages, exports and series, newest first per user
+        "CREATE INDEX IF NOT EXISTS gym_records_user_start_end_idx ON gym_records (users_id, start_time DESC) INCLUDE (end_time)",
+        # Recent Habitica window per user, covering the charted columns
+        """
+        CREATE INDEX IF NOT EXISTS habitica_records_user_date_idx
+        ON habitica_records (users_id, record_date DESC) INCLUDE (task_name, task_value, task_type)
+        """,
+    ]),
+    (5, "monthly partitions for habitica_records", [
+        # Creates missing habitica_records_YYYY_MM partitions for a date
+        # range; the lock only serializes workers that actually create one
+        """
+        CREATE OR REPLACE FUNCTION habitica_records_ensure_partitions(first_day date, last_day date)
+        RETURNS integer AS $$
+        DECLARE
+            part_month date;
+            part_name text;
+            created integer := 0;
+        BEGIN
+            FOR part_month IN
+                SELECT generate_series(date_trunc('month', first_day), date_trunc('month', last_day), interval '1 month')::date
+            LOOP
+                part_name := format('habitica_records_%s', to_char(part_month, 'YYYY_MM'));
+                CONTINUE WHEN to_regclass(part_name) IS NOT NULL;
+                PERFORM pg_advisory_xact_lock(hashtext('habitica_records_partitions'));
+                CONTINUE WHEN to_regclass(part_name) IS NOT NULL;
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF habitica_records FOR VALUES FROM (%L) TO (%L)',
+                    part_name, part_month, (part_month + interval '1 month')::date
+                );
+                created := created + 1;
+            END LOOP;
+            RETURN created;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        # Rebuild the table partitioned by record_date and move the rows over.
+        # Keys and indexes are added afterwards, once the old names are free.
+        """
+        DO $$
+        DECLARE
+            bounds record;
+        BEGIN
+            ALTER TABLE habitica_records RENAME TO habitica_records_unpartitioned;
+            CREATE TABLE habitica_records (
+                users_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+                task_id TEXT NOT NULL,
+                record_date DATE NOT NULL,
+                task_name TEXT NOT NULL,
+                task_type TEXT NOT NULL,
+                task_value DOUBLE PRECISION NOT NULL
+            ) PARTITION BY RANGE (record_date);
+            SELECT MIN(record_date) AS first_day, MAX(record_date) AS last_day
+            INTO bounds FROM habitica_records_unpartitioned;
+            IF bounds.first_day IS NOT NULL THEN
+                PERFORM habitica_records_ensure_partitions(bounds.first_day, bounds.last_day);
+            END IF;
+            INSERT INTO habitica_records (users_id, task_id, record_date, task_name, task_type, task_value)
+            SELECT users_id, task_id, record_date, task_name, task_type, task_value
+            FROM habitica_records_unpartitioned;
+            DROP TABLE habitica_records_unpartitioned;
+        END $$
+        """,
+        "ALTER TABLE habitica_records ADD PRIMARY KEY (users_id, task_id, record_date)",
+        """
+        CREATE INDEX habitica_records_user_date_idx
+        ON habitica_records (users_id, record_date DESC) INCLUDE (task_name, task_value, task_type)
+        """,
+    ]),
+    (6, "shared habitica sync job state", [
+        # A row may now track a queued job before any data was ingested
+        "ALTER TABLE habitica_sync_state ALTER COLUMN synced_at DROP NOT NULL",
+        "ALTER TABLE habitica_sync_state ALTER COLUMN synced_at DROP DEFAULT",
+        # Job status, visible to every worker; sync_retry_at is the failure backoff
+        """
+        ALTER TABLE habitica_sync_state
+            ADD COLUMN IF NOT EXISTS sync_status TEXT,
+            ADD COLUMN IF NOT EXISTS sync_queued_at TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS sync_started_at TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS sync_finished_at TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS sync_result JSONB,
+            ADD COLUMN IF NOT EXISTS sync_error TEXT,
+            ADD COLUMN IF NOT EXISTS sync_failures INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS sync_retry_at TIMESTAMPTZ
+        """,
+    ]),
+    (7, "gym keyset index with id tiebreaker", [
+        # Gym pages order by (start_time, gym_record_id); exports and series use the prefix
+        """
+        CREATE INDEX IF NOT EXISTS gym_records_user_start_id_idx
+        ON gym_records (users_id, start_time DESC, gym_record_id DESC) INCLUDE (end_time)
+        """,
+        "DROP INDEX IF EXISTS gym_records_user_start_end_idx",
+    ]),
+    (8, "recreate partitions whose month was detached", [
+        # A month counts as present only while a partition is attached. A
+        # table left under the partition name (detached before retention
+        # renamed on detach) is moved aside to an archive name first
+        """
+        CREATE OR REPLACE FUNCTION habitica_records_ensure_partitions(first_day date, last_day date)
+        RETURNS integer AS $$
+        DECLARE
+            part_month date;
+            part_name text;
+            created integer := 0;
+        BEGIN
+            FOR part_month IN
+                SELECT generate_series(date_trunc('month', first_day), date_trunc('month', last_day), interval '1 month')::date
+            LOOP
+                part_name := format('habitica_records_%s', to_char(part_month, 'YYYY_MM'));
+                CONTINUE WHEN EXISTS (
+                    SELECT 1 FROM pg_inherits
+                    WHERE inhparent = 'habitica_records'::regclass AND inhrelid = to_regclass(part_name)
+                );
+                PERFORM pg_advisory_xact_lock(hashtext('habitica_records_partitions'));
+                CONTINUE WHEN EXISTS (
+                    SELECT 1 FROM pg_inherits
+                    WHERE inhparent = 'habitica_records'::regclass AND inhrelid = to_regclass(part_name)
+                );
+                IF to_regclass(part_name) IS NOT NULL THEN
+                    EXECUTE format('ALTER TABLE %I RENAME TO %I', part_name,
+                                   part_name || '_detached_' || to_char(clock_timestamp(), 'YYYYMMDDHH24MISS'));
+                END IF;
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF habitica_records FOR VALUES FROM (%L) TO (%L)',
+                    part_name, part_month, (part_month + interval '1 month')::date
+                );
+                created := created + 1;
+            END LOOP;
+            RETURN created;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+    ]),
+]
+
+def migrate():
+    """Apply pending migrations in order; returns the versions applied"""
+    applied = []
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        # Session-level lock, held across the per-migration commits
+        cursor.execute("SELECT pg_advisory_lock(%s)", [MIGRATION_LOCK_ID])
+        try:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+                )
+            """)
+            cursor.execute("SELECT version FROM schema_migrations")
+            done = {r[0] for r in cursor.fetchall()}
+            conn.commit()
+            for version, name, statements in MIGRATIONS:
+                if version in done:
+                    continue
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                    [version, name]
+                )
+                conn.commit()
+                logger.info("Applied migration %d: %s", version, name)
+                applied.append(version)
+        finally:
+            conn.rollback()
+            cursor.execute("SELECT pg_advisory_unlock(%s)", [MIGRATION_LOCK_ID])
+            conn.commit()
+            cursor.close()
+    return applied
+
+def migration_status():
+    """[(version, name, applied_at or None)] for every known migration"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+            applied = {}
+            if cursor.fetchone()[0]:
+                cursor.execute("SELECT version, applied_at FROM schema_migrations")
+                applied = dict(cursor.fetchall())
+        finally:
+            cursor.close()
+    return [(version, name, applied.get(version)) for version, name, _ in MIGRATIONS]
+
+_ensured = False
+_lock = threading.Lock()
+
+def ensure_schema():
+    """Migrate once per process, before the first query that needs it"""
+    global _ensured
+    if _ensured:
+        return
+    with _lock:
+        if _ensured:
+            return
+        migrate()
+        _ensured = True
+
+def index_checks():
+    """(description, query, params, index the plan must use) per hot query.
+
+    The queries are the route modules' own SQL constants, with a keyset
+    cursor set where a page takes one, so a query change is checked as
+    shipped. Imported here rather than at module level: the route modules
+    import this one. Run with `python schema.py check-indexes` against a
+    migrated DB.
+    """
+    from datetime import date, datetime, timezone
+    from auth import LOGIN_SQL
+    from Fetch_Habitica import CREDENTIALS_SQL, USER_DATA_SQL, ROLLUP_DATA_SQL, rollup_periods
+    from habitica_sync import HABITICA_USERS_SQL
+    from versions import DATA_VERSIONS_SQL
+    from series import SERIES_SQL, series_params
+    from sleep import SLEEP_PAGE_SQL, SLEEP_SERIES_AGGREGATE
+    from gym import GYM_PAGE_SQL, GYM_SERIES_AGGREGATE
+    return [
+        ("login by name", LOGIN_SQL, ['someone'], 'users_name_key'),
+        ("habitica credentials", CREDENTIALS_SQL, [1], 'api_records_user_type_idx'),
+        ("habitica users sweep", HABITICA_USERS_SQL, [], 'api_records_type_user_idx'),
+        ("sleep page", SLEEP_PAGE_SQL,
+         {"user_id": 1, "before": date.today(), "limit": 30}, 'sleep_records_user_date_key'),
+        ("sleep series", SERIES_SQL.format(aggregate=SLEEP_SERIES_AGGREGATE),
+         series_params(1, 365, 'week'), 'sleep_records_user_date_key'),
+        ("gym page", GYM_PAGE_SQL, {
+            "user_id": 1, "before": datetime.now(timezone.utc), "before_id": 1, "limit": 30
+        }, 'gym_records_user_start_id_idx'),
+        ("gym series", SERIES_SQL.format(aggregate=GYM_SERIES_AGGREGATE),
+         series_params(1, 365, 'week'), 'gym_records_user_start_id_idx'),
+        ("habitica recent window", USER_DATA_SQL, {"user_id": 1}, 'habitica_records_user_date_idx'),
+        ("habitica rollups", ROLLUP_DATA_SQL,
+         [1, 'week', rollup_periods('week')[0].date()], 'habitica_rollups_pkey'),
+        ("data versions", DATA_VERSIONS_SQL, [1, ['sleep', 'gym']], 'user_data_versions_pkey'),
+    ]
+
+def plan_indexes(plan):
+    """Names of every index an EXPLAIN (FORMAT JSON) plan node tree uses"""
+    found = set()
+    if 'Index Name' in plan:
+        found.add(plan['Index Name'])
+    for child in plan.get('Plans', []):
+        found |= plan_indexes(child)
+    return found
+
+def check_indexes():
+    """EXPLAIN each index_checks() query; returns [(description, ok, indexes used)].
+
+    Sequential scans are disabled for the check, so on small tables it asks
+    whether the index can serve the query rather than what the planner
+    picks today; a missing or unusable index still shows up as a seq scan.
+    """
+    results = []
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            for description, query, params, index in index_checks():
+                cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+                used = plan_indexes(cursor.fetchone()[0][0]['Plan'])
+                if used:
+                    # Scans of partition indexes count for their parent index
+                    cursor.execute("""
+                        SELECT DISTINCT COALESCE(pg_partition_root(name::regclass), name::regclass)::text
+                        FROM unnest(%s::text[]) AS name
+                    """, [sorted(used)])
+                    used = {r[0] for r in cursor.fetchall()}
+                results.append((description, index in used, sorted(used)))
+        finally:
+            conn.rollback()
+            cursor.close()
+    return results
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else 'migrate'
+    if command == 'migrate':
+        applied = migrate()
+        print(f"Applied {applied}" if applied else "Schema is up to date")
+    elif command == 'status':
+        for version, name, applied_at in migration_status():
+            print(f"{version:>4}  {'applied ' + str(applied_at) if applied_at else 'pending':<36} {name}")
+    elif command == 'check-indexes':
+        failed = 0
+        for description, ok, used in check_indexes():
+            print(f"{'ok' if ok else 'FAIL':<5} {description}: {', '.join(used) or 'no index (seq scan)'}")
+            failed += not ok
+        return 1 if failed else 0
+    else:
+        print(__doc__)
+        return 2
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,134 @@
+"""JSON encoding, column-oriented payloads and response compression.
+
+OrjsonProvider replaces Flask's json-module provider (Quart uses the same
+class). NumPy arrays and scalars, dates and datetimes are serialized
+natively, so routes can hand over raw query values and arrays instead of
+building Python lists and strings first.
+
+Responses of at least response_compression_min_bytes are gzip or brotli
+encoded (brotli needs the optional `brotli` package), whichever the
+client's Accept-Encoding prefers; response_compression=0 turns this off.
+Encoded bodies of responses with an ETag are kept in a small cache, so
+repeat requests for the same data version skip the compressor.
+"""
+import decimal
+import gzip
+import os
+import numpy as np
+import orjson
+from flask import request
+from flask.json.provider import JSONProvider
+from cache import TTLCache
+from metrics import register_cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+class OrjsonProvider(JSONProvider):
+    """orjson-backed provider; keys are sorted, as with Flask's default"""
+
+    option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS
+    mimetype = 'application/json'
+
+    @staticmethod
+    def default(value):
+        if isinstance(value, decimal.Decimal):
+            return str(value)
+        if isinstance(value, np.ndarray):
+            # Object arrays (e.g. strings) are not handled natively
+            return value.tolist()
+        if hasattr(value, 'isoformat'):
+            # pandas Timestamp and other date/datetime subclasses
+            return value.isoformat()
+        if hasattr(value, '__html__'):
+            return str(value.__html__())
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    def _encode(self, obj):
+        option = (self.option | orjson.OPT_INDENT_2) if self._app.debug else self.option
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        return self._encode(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Bytes straight into the response, without a round trip through str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._encode(obj), mimetype=self.mimetype)
+
+def rows_payload(columns, rows, args):
+    """Rows as [{column: value}], or {column: [values]} when `args` has format=columns"""
+    if args.get('format') != 'columns':
+        return [dict(zip(columns, row)) for row in rows]
+    values = list(zip(*rows)) or [()] * len(columns)
+    return {column: list(column_values) for column, column_values in zip(columns, values)}
+
+COMPRESSION = os.getenv('response_compression', '1') != '0'
+COMPRESSION_MIN_BYTES = int(os.getenv('response_compression_min_bytes', 1024))
+COMPRESSIBLE_TYPES = ('application/json', 'text/csv', 'text/plain')
+
+# Mid-range levels: most of the size win for a fraction of the CPU of the maximum
+ENCODERS = {'gzip': lambda body: gzip.compress(body, compresslevel=6, mtime=0)}
+if brotli is not None:
+    ENCODERS['br'] = lambda body: brotli.compress(body, quality=5)
+# Preferred first when the client rates several encodings equally
+ENCODING_PREFERENCE = tuple(e for e in ('br', 'gzip') if e in ENCODERS)
+
+compressed_cache = TTLCache(
+    ttl=float(os.getenv('response_cache_ttl', 300)),
+    max_entries=4096,
+    max_bytes=int(os.getenv('compressed_cache_mb', 16)) * 1024 * 1024,
+    sizeof=len,
+    copy=lambda v: v
+)
+register_cache('compressed', compressed_cache.stats)
+
+def compressible(response, method):
+    """Whether a finished, in-memory response should be considered for encoding"""
+    return (
+        COMPRESSION
+        and method != 'HEAD'
+        and response.status_code == 200
+        and response.mimetype in COMPRESSIBLE_TYPES
+        and 'Content-Encoding' not in response.headers
+        and (response.content_length or 0) >= COMPRESSION_MIN_BYTES
+    )
+
+def negotiate_encoding(accept_encodings):
+    """The best encoding the client accepts, or None for identity"""
+    return accept_encodings.best_match(ENCODING_PREFERENCE)
+
+def encode_body(body, encoding, etag=None):
+    """Compress a body, reusing the stored result for a known ETag"""
+    if etag is None:
+        return ENCODERS[encoding](body)
+    return compressed_cache.get_or_load((etag, encoding), lambda: ENCODERS[encoding](body))
+
+def apply_encoding(response, body, encoding):
+    etag, weak = response.get_etag()
+    response.set_data(encode_body(body, encoding, etag and (etag, weak)))
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        # Same data, different bytes: only weakly equal to the identity body
+        response.set_etag(etag, weak=True)
+
+def install_serialization(app):
+    """Use OrjsonProvider for the app and compress its responses per request"""
+    app.json = OrjsonProvider(app)
+
+    @app.after_request
+    def compress_response(response):
+        if response.direct_passthrough or response.is_streamed:
+            return response
+        if not compressible(response, request.method):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate_encoding(request.accept_encodings)
+        if encoding is not None:
+            apply_encoding(response, response.get_data(), encoding)
+        return response
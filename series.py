@@ -0,0 +1,69 @@
+from psycopg2 import sql
+from datetime import date, timedelta
+from db import get_connection
+
+# Named ?range= values, in days; plain day counts are accepted too
+SERIES_RANGES = {'week': 7, 'month': 30, 'year': 365}
+SERIES_BUCKETS = ('day', 'week', 'month')
+MAX_SERIES_DAYS = 3660
+
+# Every bucket in the window, left-joined to the per-bucket aggregate so
+# empty buckets come back as 0 without any filling in Python. Buckets
+# start where date_trunc puts them (weeks on Monday).
+SERIES_SQL = """
+    SELECT s.period::date, COALESCE(a.value, 0)::float8
+    FROM generate_series(
+        date_trunc(%(bucket)s, %(start)s::timestamp),
+        %(end)s::timestamp,
+        ('1 ' || %(bucket)s)::interval
+    ) AS s(period)
+    LEFT JOIN ({aggregate}) a ON a.period = s.period
+    ORDER BY s.period
+"""
+
+def series_window(range_arg, bucket):
+    """Days covered by ?range= and ?bucket=, or (None, error message)"""
+    if bucket not in SERIES_BUCKETS:
+        return None, "Invalid bucket"
+    days = SERIES_RANGES.get(range_arg)
+    if days is None:
+        try:
+            days = int(range_arg)
+        except (TypeError, ValueError):
+            return None, "Invalid range"
+    if not 1 <= days <= MAX_SERIES_DAYS:
+        return None, "Invalid range"
+    return days, None
+
+def series_params(user_id, days, bucket='day', end=None):
+    """SERIES_SQL parameters for the `days` days ending on `end` (today)"""
+    end = end or date.today()
+    return {
+        "user_id": user_id,
+        "bucket": bucket,
+        "start": end - timedelta(days=days - 1),
+        "end": end,
+    }
+
+def series_payload(records):
+    return {
+        "dates": [r[0].strftime('%Y-%m-%d') for r in records],
+        "hours": [r[1] for r in records]
+    }
+
+def date_series(user_id, aggregate, days, bucket='day', end=None):
+    """Zero-filled {"dates", "hours"} for the `days` days ending on `end` (today).
+
+    `aggregate` selects (period, value) for %(user_id)s between
+    %(start)s and %(end)s, grouped by date_trunc(%(bucket)s, ...).
+    """
+    params = series_params(user_id, days, bucket, end)
+    query = sql.SQL(SERIES_SQL).format(aggregate=sql.SQL(aggregate))
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, params)
+            records = cursor.fetchall()
+        finally:
+            cursor.close()
+    return series_payload(records)
@@ -1,7 +1,19 @@
 from flask import Blueprint, jsonify, request
-from db import connect_to_postgres
-from api_page import token_required
+from db import get_connection
+from auth import token_required
+from versions import bump_data_version, conditional_get
+from cache import cached_response, notify_user_data_changed
+from batch import read_batch_payload, item_field, chunked, batch_result
+from export import page_limit, export_response
+from series import date_series, series_window
+from serialization import rows_payload
+from psycopg2.extras import execute_values
 from datetime import datetime
+import numpy as np
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
 
 sleep_bp = Blueprint('sleep', __name__)
 
@@ -21,100 +33,189 @@ def add_sleep_record(current_user_id):
     except (ValueError, TypeError):
         return jsonify({"error": "Invalid data format"}), 400
         
-    conn = connect_to_postgres()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
     
-    try:
-        cursor.execute("""
-            INSERT INTO sleep_records (users_id, hours, record_date)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (record_date)
-            DO UPDATE SET hours = EXCLUDED.hours
-            RETURNING sleep_record_id
-        """, (current_user_id, hours, date))
+        try:
+            cursor.execute("""
+                INSERT INTO sleep_records (users_id, hours, record_date)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (users_id, record_date)
+                DO UPDATE SET hours = EXCLUDED.hours
+                RETURNING sleep_record_id
+            """, (current_user_id, hours, date))
         
-        record_id = cursor.fetchone()[0]
-        conn.commit()
-        return jsonify({"message": "Sleep record saved", "id": record_id}), 200
+            record_id = cursor.fetchone()[0]
+            bump_data_version(cursor, current_user_id, 'sleep')
+            conn.commit()
+            notify_user_data_changed(current_user_id, 'sleep')
+            return jsonify({"message": "Sleep record saved", "id": record_id}), 200
         
-    except Exception as e:
-        conn.rollback()
-        return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"error": str(e)}), 500
+        finally:
+            cursor.close()
+
+@sleep_bp.route('/user/sleep/batch', methods=['POST'])
+@token_required
+def add_sleep_records_batch(current_user_id):
+    """Save many sleep records in one transaction; body is a JSON array or NDJSON"""
+    items, error = read_batch_payload()
+    if error:
+        return jsonify({"error": error}), 400
+
+    raw_hours = pd.Series(item_field(items, 'hours'), dtype=object)
+    raw_dates = pd.Series(item_field(items, 'date'), dtype=object)
+    hours = pd.to_numeric(raw_hours, errors='coerce').astype(np.float64)
+    dates = pd.to_datetime(raw_dates, format='%Y-%m-%d', errors='coerce')
+
+    # Same rules as add_sleep_record, applied to the whole batch at once
+    missing = ~(raw_hours.astype(bool) & raw_dates.astype(bool))
+    # Whole, finite hours that fit the INTEGER column: "7.5" and "1e400"
+    # are rejected rather than truncated or overflowing int()
+    whole_hours = hours.notna() & np.isfinite(hours) & (hours == hours.round()) & (hours.abs() < 2**31)
+    invalid = ~missing & (~whole_hours | dates.isna())
+    valid = ~missing & ~invalid
+    # One record per date: later items in the batch win
+    superseded = valid & dates.where(valid).duplicated(keep='last')
+    to_write = valid & ~superseded
+
+    rows = [
+        (current_user_id, int(h), d.date())
+        for h, d in zip(hours[to_write], dates[to_write])
+    ]
+    saved_ids = {}
+    if rows:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                for chunk in chunked(rows):
+                    returned = execute_values(cursor, """
+                        INSERT INTO sleep_records (users_id, hours, record_date)
+                        VALUES %s
+                        ON CONFLICT (users_id, record_date)
+                        DO UPDATE SET hours = EXCLUDED.hours
+                        RETURNING sleep_record_id, record_date
+                    """, chunk, page_size=len(chunk), fetch=True)
+                    saved_ids.update({r[1]: r[0] for r in returned})
+                bump_data_version(cursor, current_user_id, 'sleep')
+                conn.commit()
+                notify_user_data_changed(current_user_id, 'sleep')
+            except Exception as e:
+                conn.rollback()
+                return jsonify({"error": str(e)}), 500
+            finally:
+                cursor.close()
+
+    statuses = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            statuses.append({"index": index, "status": "error", "error": "Item must be a JSON object"})
+        elif missing[index]:
+            statuses.append({"index": index, "status": "error", "error": "Missing required fields"})
+        elif invalid[index]:
+            statuses.append({"index": index, "status": "error", "error": "Invalid data format"})
+        elif superseded[index]:
+            statuses.append({"index": index, "status": "superseded"})
+        else:
+            statuses.append({"index": index, "status": "saved", "id": saved_ids.get(dates[index].date())})
+    body, status = batch_result(statuses)
+    return jsonify(body), status
+
+# Keyset page, newest first; record_date is unique per user
+SLEEP_PAGE_SQL = """
+    SELECT hours, record_date
+    FROM sleep_records
+    WHERE users_id = %(user_id)s
+    AND (%(before)s::date IS NULL OR record_date < %(before)s::date)
+    ORDER BY record_date DESC
+    LIMIT %(limit)s
+"""
 
 @sleep_bp.route('/user/sleep', methods=['GET'])
 @token_required
+@conditional_get('sleep')
+@cached_response('sleep')
 def get_sleep_records(current_user_id):
-    conn = connect_to_postgres()
-    cursor = conn.cursor()
-    
+    """Newest records first; page back with ?before=<YYYY-MM-DD>&limit=N, ?format=columns for arrays"""
+    limit = page_limit()
+    before = request.args.get('before')
     try:
-        cursor.execute("""
-            SELECT hours, record_date
-            FROM sleep_records
-            WHERE users_id = %s
-            ORDER BY record_date DESC
-            LIMIT 30
-        """, (current_user_id,))
+        before = datetime.strptime(before, '%Y-%m-%d').date() if before else None
+    except ValueError:
+        return jsonify({"error": "Invalid data format"}), 400
+    if limit is None:
+        return jsonify({"error": "Invalid data format"}), 400
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+    
+        try:
+            cursor.execute(SLEEP_PAGE_SQL, {"user_id": current_user_id, "before": before, "limit": limit})
         
-        records = cursor.fetchall()
-        result = [{"hours": r[0], "date": r[1].strftime('%Y-%m-%d')} for r in records]
-        return jsonify(result), 200
+            records = cursor.fetchall()
+            response = jsonify(rows_payload(['hours', 'date'], records, request.args))
+            if len(records) == limit:
+                response.headers['X-Next-Before'] = records[-1][1].isoformat()
+            return response, 200
         
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        finally:
+            cursor.close()
+
+@sleep_bp.route('/user/sleep/export', methods=['GET'])
+@token_required
+def export_sleep_records(current_user_id):
+    """Full sleep history, streamed as JSON or ?format=csv"""
+    return export_response("""
+        SELECT hours, record_date
+        FROM sleep_records
+        WHERE users_id = %s
+        ORDER BY record_date DESC
+    """, (current_user_id,), 'sleep_records', ['hours', 'date'],
+        lambda r: (r[0], r[1].strftime('%Y-%m-%d')))
+
+# Average hours per recorded night in each bucket
+SLEEP_SERIES_AGGREGATE = """
+    SELECT date_trunc(%(bucket)s, record_date::timestamp) AS period, AVG(hours) AS value
+    FROM sleep_records
+    WHERE users_id = %(user_id)s
+    AND record_date BETWEEN date_trunc(%(bucket)s, %(start)s::timestamp)::date AND %(end)s
+    GROUP BY 1
+"""
+
+def sleep_series(user_id, days, bucket='day'):
+    return date_series(user_id, SLEEP_SERIES_AGGREGATE, days, bucket)
+
+def weekly_sleep_series(user_id):
+    """Hours slept per day for the last 7 days, zero-filled"""
+    return sleep_series(user_id, 7)
 
 @sleep_bp.route('/user/sleep/week', methods=['GET'])
 @token_required
+@conditional_get('sleep')
+@cached_response('sleep')
 def get_weekly_sleep(current_user_id):
-    from datetime import datetime, timedelta
-    
-    conn = connect_to_postgres()
-    cursor = conn.cursor()
-    
     try:
-        # Calculate date range for the last 7 days
-        end_date = datetime.now().date()
-        start_date = end_date - timedelta(days=6)
-        
-        # Get the latest 7 days of records
-        cursor.execute("""
-            SELECT record_date, hours
-            FROM sleep_records
-            WHERE users_id = %s 
-            AND record_date BETWEEN %s AND %s
-            ORDER BY record_date DESC
-        """, (current_user_id, start_date, end_date))
-        
-        records = cursor.fetchall()
-        
-        # Create date range with zeros for missing dates
-        date_range = {(start_date + timedelta(days=x)).strftime('%Y-%m-%d'): 0 
-                     for x in range(7)}
-        
-        # Fill in actual values
-        for record in records:
-            date_str = record[0].strftime('%Y-%m-%d')
-            if date_str in date_range:
-                date_range[date_str] = record[1]
-        
-        # Sort dates and create response
-        sorted_dates = sorted(date_range.keys())
-        result = {
-            "dates": sorted_dates,
-            "hours": [date_range[date] for date in sorted_dates]
-        }
-        
-        return jsonify(result), 200
-        
+        return jsonify(weekly_sleep_series(current_user_id)), 200
+    except Exception as e:
+        logger.exception("Error in get_weekly_sleep")
+        return jsonify({"error": str(e)}), 500
+
+@sleep_bp.route('/user/sleep/series', methods=['GET'])
+@token_required
+@conditional_get('sleep')
+@cached_response('sleep')
+def get_sleep_series(current_user_id):
+    """Average nightly hours per day/week/month; ?range=week|month|year|<days>&bucket=day|week|month"""
+    bucket = request.args.get('bucket', 'day')
+    days, error = series_window(request.args.get('range', 'month'), bucket)
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        return jsonify(sleep_series(current_user_id, days, bucket)), 200
     except Exception as e:
-        print(f"Error in get_weekly_sleep: {e}")  # Add logging
+        logger.exception("Error in get_sleep_series")
         return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
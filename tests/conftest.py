@@ -0,0 +1,26 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Importing the app needs its secrets; no connection is opened up front
+os.environ.setdefault('secret_key_flask', 'test-flask-secret')
+os.environ.setdefault('secret_key_jwt', 'test-jwt-secret-that-is-long-enough-for-hs256')
+os.environ.setdefault('db_pool_min', '0')
+
+import pytest
+
+@pytest.fixture(scope='session')
+def database():
+    """A reachable, migrated PostgreSQL database; skips the test otherwise"""
+    import schema
+    from db import get_connection
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+    except Exception:
+        pytest.skip("no PostgreSQL database configured")
+    schema.migrate()
@@ -0,0 +1,102 @@
+"""The ASGI app (asgi.py) answers browsers the way the Flask app (main.py) does."""
+import asyncio
+import pytest
+
+PREFLIGHT = {
+    'Origin': 'https://client.example',
+    'Access-Control-Request-Method': 'GET',
+    'Access-Control-Request-Headers': 'Authorization, Content-Type',
+}
+CORS_HEADERS = [
+    'Access-Control-Allow-Origin',
+    'Access-Control-Allow-Headers',
+    'Access-Control-Allow-Methods',
+]
+
+@pytest.fixture
+def asgi_app():
+    import asgi
+    return asgi.app
+
+@pytest.fixture
+def flask_client(monkeypatch):
+    import main
+    monkeypatch.setattr(main, '_services_started', True)
+    return main.app.test_client()
+
+def asgi_request(app, method, path, headers=None):
+    async def send():
+        return await app.test_client().open(path, method=method, headers=headers or {})
+    return asyncio.run(send())
+
+@pytest.mark.parametrize('path', ['/user/sleep', '/user/gym/week', '/user/habitica/daily', '/login'])
+def test_preflight_allows_authorization(asgi_app, flask_client, path):
+    response = asgi_request(asgi_app, 'OPTIONS', path, PREFLIGHT)
+    assert response.status_code == 200
+    assert response.headers['Access-Control-Allow-Origin'] == PREFLIGHT['Origin']
+    assert 'Authorization' in response.headers['Access-Control-Allow-Headers']
+    assert 'GET' in response.headers['Access-Control-Allow-Methods'].split(', ')
+
+    expected = flask_client.options(path, headers=PREFLIGHT)
+    assert {name: response.headers.get(name) for name in CORS_HEADERS} == \
+        {name: expected.headers.get(name) for name in CORS_HEADERS}
+
+def test_simple_request_without_origin_gets_wildcard(asgi_app):
+    response = asgi_request(asgi_app, 'GET', '/metrics')
+    assert response.headers['Access-Control-Allow-Origin'] == '*'
+    assert 'Access-Control-Allow-Methods' not in response.headers
+
+def flask_routes():
+    import main
+    return [
+        (rule.rule, method)
+        for rule in main.app.url_map.iter_rules() if rule.endpoint != 'static'
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'})
+    ]
+
+@pytest.mark.parametrize('rule,method', flask_routes())
+def test_every_flask_route_is_served_or_not_ported(asgi_app, rule, method):
+    from async_routes import SYNC_ONLY_ROUTES
+    path = rule.replace('<', '').replace('>', '')
+    endpoint, _ = asgi_app.url_map.bind('localhost').match(path, method)
+    if endpoint.startswith('async_fallback.'):
+        assert (rule, [method]) in SYNC_ONLY_ROUTES
+        response = asgi_request(asgi_app, method, rule)
+        assert response.status_code == 501
+
+@pytest.fixture
+def sleep_week(monkeypatch):
+    import async_routes
+    from cache import response_cache
+    calls = []
+
+    async def data_versions(user_id, domains):
+        return [3 for domain in domains]
+
+    async def date_series(user_id, aggregate, days, bucket='day'):
+        calls.append(days)
+        return {"Keys": ["2026-01-01"], "Values": [7.0]}
+    monkeypatch.setattr(async_routes, 'data_versions', data_versions)
+    monkeypatch.setattr(async_routes, 'date_series', date_series)
+    response_cache.clear()
+    yield calls
+    response_cache.clear()
+
+def test_conditional_get_and_response_cache(asgi_app, sleep_week):
+    from auth import issue_token
+    from versions import version_tag
+    headers = {'Authorization': f'Bearer {issue_token(1)}'}
+
+    first = asgi_request(asgi_app, 'GET', '/user/sleep/week', headers)
+    assert first.status_code == 200
+    # The tag main.py would send for the same versions and path
+    assert first.headers['ETag'] == f'"{version_tag(1, ("sleep",), [3], "/user/sleep/week?")}"'
+    assert first.headers['X-Cache'] == 'MISS'
+
+    second = asgi_request(asgi_app, 'GET', '/user/sleep/week', headers)
+    assert second.headers['X-Cache'] == 'HIT'
+
+    revalidated = asgi_request(asgi_app, 'GET', '/user/sleep/week',
+                               {**headers, 'If-None-Match': first.headers['ETag']})
+    assert revalidated.status_code == 304
+    assert sleep_week == [7]
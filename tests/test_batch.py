@@ -0,0 +1,86 @@
+"""Per-item validation of the batch endpoints."""
+from contextlib import contextmanager
+import pytest
+
+import gym
+
+START = '2026-01-05T10:00:00Z'
+END = '2026-01-05T11:00:00Z'
+
+class StubCursor:
+    def execute(self, query, params=None):
+        pass
+
+    def close(self):
+        pass
+
+class StubConnection:
+    def cursor(self):
+        return StubCursor()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+@pytest.fixture
+def inserted(monkeypatch):
+    rows = []
+
+    @contextmanager
+    def get_connection():
+        yield StubConnection()
+
+    def execute_values(cursor, query, chunk, page_size=None, fetch=False):
+        rows.extend(chunk)
+        return [(len(rows) - len(chunk) + i + 1,) for i in range(len(chunk))]
+    monkeypatch.setattr(gym, 'get_connection', get_connection)
+    monkeypatch.setattr(gym, 'execute_values', execute_values)
+    return rows
+
+@pytest.fixture
+def client(monkeypatch):
+    import main
+    monkeypatch.setattr(main, '_services_started', True)
+    main.app.config['TESTING'] = True
+    return main.app.test_client()
+
+@pytest.fixture
+def headers():
+    from auth import issue_token
+    return {'Authorization': f'Bearer {issue_token(1)}'}
+
+def gym_item(**fields):
+    item = {"start_time": START, "end_time": END, "exercise_title": "Squats"}
+    item.update(fields)
+    return item
+
+@pytest.mark.parametrize('fields', [
+    {"exercise_title": 5},
+    {"exercise_title": {"name": "Squats"}},
+    {"exercise_title": ["Squats"]},
+    {"exercise_notes": {"sets": 3}},
+    {"exercise_notes": ["heavy"]},
+    {"exercise_notes": 3},
+])
+def test_gym_batch_rejects_non_text_fields(client, headers, inserted, fields):
+    response = client.post('/user/gym/batch', headers=headers, json=[gym_item(), gym_item(**fields)])
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["saved"] == 1
+    assert body["items"][1] == {"index": 1, "status": "error", "error": "Invalid data format"}
+    assert len(inserted) == 1
+
+def test_gym_batch_empty_title_is_missing(client, headers, inserted):
+    response = client.post('/user/gym/batch', headers=headers,
+                           json=[gym_item(exercise_title={}), gym_item(exercise_title=[])])
+    assert response.status_code == 400
+    assert [i["error"] for i in response.get_json()["items"]] == ["Missing required fields"] * 2
+    assert inserted == []
+
+def test_gym_batch_accepts_text_and_null_notes(client, headers, inserted):
+    response = client.post('/user/gym/batch', headers=headers,
+                           json=[gym_item(exercise_notes=None), gym_item(exercise_notes="felt good")])
+    assert response.get_json()["saved"] == 2
+    assert [row[4] for row in inserted] == [None, "felt good"]
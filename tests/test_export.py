@@ -0,0 +1,29 @@
+"""Streamed exports encode JSON exactly like the app's OrjsonProvider."""
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+import numpy as np
+
+from export import json_stream
+
+ROWS = [
+    (datetime(2026, 1, 5, 10, 0, tzinfo=timezone.utc), date(2026, 1, 5), "Squats", None),
+    (datetime(2026, 1, 4, 9, 30, 15, 250000, tzinfo=timezone(timedelta(hours=2))),
+     date(2026, 1, 4), "Bänkdrücken \"heavy\"", "notes\nline two"),
+    (datetime(2026, 1, 3, 8, 0), date(2026, 1, 3), Decimal('7.50'), np.float64(1.25)),
+]
+COLUMNS = ['start_time', 'date', 'title', 'notes']
+
+def to_dict(row):
+    return dict(zip(COLUMNS, row))
+
+def test_json_stream_matches_provider():
+    import main
+    expected = main.app.json.dumps([to_dict(r) for r in ROWS]).encode()
+    # Chunk boundaries must not change the output
+    for chunks in ([ROWS], [ROWS[:1], ROWS[1:]], [[r] for r in ROWS]):
+        assert b''.join(json_stream(iter(chunks), to_dict)) == expected
+
+def test_json_stream_empty():
+    import main
+    assert b''.join(json_stream(iter([]), to_dict)) == main.app.json.dumps([]).encode()
@@ -0,0 +1,99 @@
+"""Golden comparison of the grid formatter against the original per-cell loop."""
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from Fetch_Habitica import filter_and_format_data
+from habitica_history import HabiticaHistory
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TASK_TYPES = (None, 'daily', 'habit', 'todo')
+TIME_RANGES = ('day', 'month', 'year', 'week')
+
+def baseline_filter_and_format_data(df, task_type=None, time_range='month'):
+    """filter_and_format_data as it was before vectorization, minus its prints"""
+    if df.empty:
+        return {"Keys": [], "Values": [], "Dates": []}
+    today = pd.Timestamp.today()
+    if time_range.lower() == 'day':
+        latest_date = df['record_date'].max()
+        if pd.isnull(latest_date):
+            return {"Keys": [], "Values": [], "Dates": []}
+        threshold = latest_date.replace(hour=0, minute=0, second=0)
+        end_date = threshold + pd.Timedelta(days=1)
+    elif time_range.lower() == 'month':
+        threshold = today - pd.Timedelta(days=30)
+        end_date = today
+    elif time_range.lower() == 'year':
+        threshold = today - pd.Timedelta(days=365)
+        end_date = today
+    else:
+        threshold = today - pd.Timedelta(days=30)
+        end_date = today
+
+    filtered_df = df[(df['record_date'] >= threshold) & (df['record_date'] < end_date)]
+    if filtered_df.empty:
+        return {"Keys": [], "Values": [], "Dates": []}
+    if task_type:
+        filtered_df = filtered_df[filtered_df['task_type'].str.lower() == task_type.lower()]
+    unique_tasks = filtered_df['task_name'].unique()
+    if time_range.lower() == 'day':
+        date_range = [threshold]
+    else:
+        date_range = pd.date_range(start=threshold, end=end_date)
+
+    keys, values, dates = [], [], []
+    for date in date_range:
+        for task in unique_tasks:
+            record = filtered_df[
+                (filtered_df['record_date'].dt.date == date.date()) &
+                (filtered_df['task_name'] == task)
+            ]
+            keys.append(task)
+            values.append(record['task_value'].values[0] if not record.empty else 0.0)
+            dates.append(date.strftime('%Y-%m-%d'))
+    return {"Keys": keys, "Values": [float(v) for v in values], "Dates": dates}
+
+def as_lists(result):
+    return {key: list(np.asarray(value).tolist()) for key, value in result.items()}
+
+def bundled_history():
+    """history.csv shifted so its newest record is today, as fetch_user_data returns it"""
+    export = pd.read_csv(os.path.join(ROOT, 'history.csv'))
+    days = pd.to_datetime(export['Date']).dt.normalize()
+    days += pd.Timestamp.today().normalize() - days.max()
+    return pd.DataFrame({
+        'task_name': export['Task Name'],
+        'task_value': export['Value'].astype(float),
+        'record_date': days,
+        'task_type': export['Task Type'],
+    }).sort_values('record_date', ascending=False, kind='stable', ignore_index=True)
+
+def synthetic_history(seed):
+    rng = np.random.default_rng(seed)
+    rows = int(rng.integers(1, 200))
+    today = pd.Timestamp.today().normalize()
+    return pd.DataFrame({
+        'task_name': rng.choice([f"Task {i}" for i in range(12)] + ['NA', ''], rows),
+        'task_value': rng.normal(size=rows).round(3),
+        'record_date': today - pd.to_timedelta(rng.integers(-1, 400, rows), unit='D'),
+        'task_type': rng.choice(['daily', 'Habit', 'todo'], rows),
+    }).sort_values('record_date', ascending=False, kind='stable', ignore_index=True)
+
+FRAMES = [pytest.param(bundled_history, id='history.csv')] + [
+    pytest.param(lambda seed=seed: synthetic_history(seed), id=f'synthetic-{seed}') for seed in range(3)
+]
+
+@pytest.mark.parametrize('make_frame', FRAMES)
+@pytest.mark.parametrize('task_type', TASK_TYPES)
+@pytest.mark.parametrize('time_range', TIME_RANGES)
+def test_matches_baseline(make_frame, task_type, time_range):
+    df = make_frame()
+    expected = baseline_filter_and_format_data(df, task_type, time_range)
+    actual = filter_and_format_data(HabiticaHistory.from_frame(df), task_type, time_range)
+    assert as_lists(actual) == expected
+
+def test_empty_history():
+    empty = HabiticaHistory.from_frame(pd.DataFrame(columns=['task_name', 'task_value', 'record_date', 'task_type']))
+    assert filter_and_format_data(empty) == {"Keys": [], "Values": [], "Dates": []}
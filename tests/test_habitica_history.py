@@ -0,0 +1,44 @@
+"""HabiticaHistory.from_csv against COPY ... (FORMAT csv) output."""
+from io import BytesIO
+import pandas as pd
+
+from habitica_history import HabiticaHistory, EPOCH
+
+# Task names pandas would read as NaN by default
+NA_LIKE_NAMES = ['NA', 'N/A', 'None', 'null', 'NULL', 'nan', '', 'Read']
+
+def copy_field(value):
+    """One field as PostgreSQL's CSV COPY writes it: NULL is empty, '' is quoted"""
+    if value is None:
+        return ''
+    value = str(value)
+    if value == '' or any(c in value for c in ',"\n\r'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+def copy_csv(rows):
+    return BytesIO(''.join(','.join(copy_field(v) for v in row) + '\n' for row in rows).encode())
+
+def test_na_like_task_names_round_trip():
+    rows = [
+        (20000, name, float(i), 20000 - i, 'habit' if i % 2 else 'daily')
+        for i, name in enumerate(NA_LIKE_NAMES)
+    ]
+    history = HabiticaHistory.from_csv(copy_csv(rows))
+
+    assert len(history) == len(NA_LIKE_NAMES)
+    assert [history.task_names[c] for c in history.name_codes] == NA_LIKE_NAMES
+    assert history.values.tolist() == [float(i) for i in range(len(NA_LIKE_NAMES))]
+    assert history.days.tolist() == [20000 - i for i in range(len(NA_LIKE_NAMES))]
+    assert history.attrs['watermark'] == (EPOCH + pd.Timedelta(days=20000)).date()
+
+def test_watermark_only_row():
+    history = HabiticaHistory.from_csv(copy_csv([(20000, None, None, None, None)]))
+    assert history.empty
+    assert history.attrs['watermark'] == (EPOCH + pd.Timedelta(days=20000)).date()
+
+def test_rollup_rows_without_watermark():
+    rows = [(None, 'null', 2.0, 20000, 'daily'), (None, 'NA', 1.0, 19993, 'daily')]
+    history = HabiticaHistory.from_csv(copy_csv(rows))
+    assert history.attrs['watermark'] is None
+    assert list(history.task_names) == ['null', 'NA']
@@ -0,0 +1,12 @@
+"""Hot queries against a live, migrated database; skipped without one."""
+import pytest
+import schema
+
+@pytest.fixture(scope='module')
+def index_results(database):
+    return {description: (ok, used) for description, ok, used in schema.check_indexes()}
+
+@pytest.mark.parametrize('description', [check[0] for check in schema.index_checks()])
+def test_query_uses_its_index(index_results, description):
+    ok, used = index_results[description]
+    assert ok, f"{description} used {used or 'no index (seq scan)'}"
@@ -0,0 +1,66 @@
+"""Partition retention and re-creation against a live database; skipped without one."""
+from datetime import date, datetime
+import pytest
+
+import partitions
+from db import get_connection
+
+# Far enough back that no real partition or record is touched
+MONTH = date(1990, 1, 1)
+
+def attached_months():
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        months = {month for month, name in partitions.list_partitions(cursor)}
+        cursor.close()
+    return months
+
+def drop_test_tables():
+    name = partitions.partition_name(MONTH)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT relname FROM pg_class WHERE relkind IN ('r', 'p') AND relname LIKE %s",
+                       [name + '%'])
+        for (table,) in cursor.fetchall():
+            cursor.execute(f'DROP TABLE IF EXISTS "{table}"')
+        conn.commit()
+        cursor.close()
+
+@pytest.fixture
+def test_month(database, monkeypatch):
+    monkeypatch.setattr(partitions, 'RETENTION_ACTION', 'detach')
+    drop_test_tables()
+    partitions.reload_known_months()
+    yield MONTH
+    drop_test_tables()
+    partitions.reload_known_months()
+
+def test_detached_month_is_created_again(test_month):
+    assert partitions.ensure_partitions(test_month, test_month) == 1
+    assert test_month in attached_months()
+
+    # Only the test month ends before this cutoff
+    expired = partitions.apply_retention(cutoff=date(1990, 2, 1))
+    assert expired == [partitions.partition_name(test_month)]
+    assert test_month not in attached_months()
+
+    assert partitions.ensure_partitions(test_month, test_month) == 1
+    assert test_month in attached_months()
+
+def test_legacy_detached_table_is_moved_aside(test_month):
+    # A month detached without the rename keeps the partition name
+    name = partitions.partition_name(test_month)
+    partitions.ensure_partitions(test_month, test_month)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'ALTER TABLE habitica_records DETACH PARTITION "{name}"')
+        conn.commit()
+        cursor.close()
+    partitions.reload_known_months()
+
+    assert partitions.ensure_partitions(test_month, test_month) == 1
+    assert test_month in attached_months()
+
+def test_archive_name():
+    assert partitions.archive_name('habitica_records_2024_01', datetime(2026, 3, 1, 12, 0, 5)) == \
+        'habitica_records_2024_01_detached_20260301120005'
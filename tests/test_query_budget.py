@@ -0,0 +1,139 @@
+"""Habitica and dashboard routes stay within their query budgets (strict mode).
+
+The database is replaced at the pool: every pooled connection is a
+StubConnection whose cursor answers the routes' statements from canned
+rows and counts each one for the request, like db.InstrumentedCursor.
+Caches start cold, so each request pays for every load it can make.
+"""
+from datetime import date, datetime, timezone
+import pytest
+
+import db
+import metrics
+import schema
+from habitica_history import day_number
+
+TODAY = day_number(date.today())
+# HabiticaHistory.CSV_COLUMNS rows, as the COPY of USER_DATA_SQL returns them
+HISTORY_CSV = (
+    f"{TODAY - 1},Read,1.0,{TODAY - 1},daily\n"
+    f"{TODAY - 1},Stretch,0.5,{TODAY - 2},habit\n"
+).encode()
+
+class StubCursor:
+    def __init__(self, statements):
+        self.statements = statements
+        self.rowcount = -1
+        self._rows = []
+
+    def _answer(self, query, params):
+        text = query if isinstance(query, str) else repr(query)
+        if 'FROM api_records' in text:
+            return [('api-id', 'api-key')]
+        if 'WITH claimed' in text:
+            now = datetime.now(timezone.utc)
+            return [(False, 'done', now, now, now, {"written": 0}, None, 0, None)]
+        if 'FROM user_data_versions' in text:
+            return [(domain, 1) for domain in params[1]]
+        return []
+
+    def execute(self, query, params=None):
+        metrics.count_query()
+        self.statements.append(query)
+        self._rows = self._answer(query, params)
+
+    def mogrify(self, query, params=None):
+        return query.encode()
+
+    def copy_expert(self, query, buffer, size=8192):
+        metrics.count_query()
+        self.statements.append(query)
+        if 'habitica_records' in query:
+            buffer.write(HISTORY_CSV)
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+class StubConnection:
+    closed = False
+
+    def __init__(self, statements):
+        self.statements = statements
+
+    def cursor(self, *args, **kwargs):
+        return StubCursor(self.statements)
+
+    def get_transaction_status(self):
+        return 0
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def statements(monkeypatch):
+    executed = []
+    monkeypatch.setattr(db, '_pool', db.ConnectionPool(
+        minconn=0, maxconn=8, health_check=False, connect=lambda: StubConnection(executed)
+    ))
+    monkeypatch.setattr(schema, '_ensured', True)
+    monkeypatch.setattr(metrics, 'QUERY_BUDGET_STRICT', True)
+    return executed
+
+@pytest.fixture
+def client(statements, monkeypatch):
+    import main
+    from cache import response_cache
+    from habitica import user_data_cache
+    from habitica_sync import scheduler
+    # No migrations or sync threads; the claim above never queues a job
+    monkeypatch.setattr(main, '_services_started', True)
+    monkeypatch.setattr(scheduler, 'start', lambda: None)
+    user_data_cache.clear()
+    response_cache.clear()
+    main.app.config['TESTING'] = True
+    return main.app.test_client()
+
+@pytest.fixture
+def headers():
+    from auth import issue_token
+    return {'Authorization': f'Bearer {issue_token(1)}'}
+
+@pytest.mark.parametrize('path', [
+    '/user/habitica',
+    '/user/habitica?time_range=year',
+    '/user/habitica/daily',
+    '/user/habitica/habit?time_range=week',
+    '/user/habitica/daily?time_range=year&bucket=month',
+    '/user/dashboard',
+    '/user/dashboard?time_range=year',
+])
+def test_route_within_query_budget(client, headers, statements, path):
+    # Over-budget requests raise QueryBudgetExceeded, which TESTING propagates
+    response = client.get(path, headers=headers)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert statements, "the stub pool was not used"
+
+def test_budget_overrun_raises(client, headers, monkeypatch):
+    import habitica
+    original = habitica.habitica_frame
+
+    def load_twice(user_id, time_range, bucket, version=None):
+        habitica.user_data_cache.clear()
+        original(user_id, time_range, bucket, version)
+        habitica.user_data_cache.clear()
+        return original(user_id, time_range, bucket, version)
+    monkeypatch.setattr(habitica, 'habitica_frame', load_twice)
+    with pytest.raises(metrics.QueryBudgetExceeded):
+        client.get('/user/habitica/daily', headers=headers)
@@ -0,0 +1,78 @@
+from flask import current_app, request, g
+from functools import wraps
+from datetime import date
+import hashlib
+from db import get_connection
+from schema import ensure_schema
+
+def bump_data_version(cursor, user_id, domain):
+    """Mark a user's data in `domain` as changed; call inside the writing transaction"""
+    cursor.execute("""
+        INSERT INTO user_data_versions (users_id, domain, version)
+        VALUES (%s, %s, 1)
+        ON CONFLICT (users_id, domain)
+        DO UPDATE SET version = user_data_versions.version + 1
+    """, (user_id, domain))
+
+DATA_VERSIONS_SQL = """
+    SELECT domain, version
+    FROM user_data_versions
+    WHERE users_id = %s AND domain = ANY(%s)
+"""
+
+def data_versions(user_id, domains):
+    """Current version per domain for a user (0 if never written)"""
+    ensure_schema()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(DATA_VERSIONS_SQL, (user_id, list(domains)))
+            versions = dict(cursor.fetchall())
+        finally:
+            cursor.close()
+    return [versions.get(domain, 0) for domain in domains]
+
+def current_version(user_id, domain):
+    """The user's version of `domain`, as already read by conditional_get
+    for this request, or from the database"""
+    known = g.get('data_versions') or {}
+    if domain in known:
+        return known[domain]
+    return data_versions(user_id, [domain])[0]
+
+def version_tag(user_id, domains, versions, full_path):
+    """ETag of the user's `domains` at `versions`, for this path and query, today"""
+    return hashlib.sha1(f"{user_id}|{domains}|{versions}|{full_path}|{date.today()}".encode()).hexdigest()
+
+def conditional_get(*domains):
+    """Answer If-None-Match with 304 from the user's data versions alone.
+
+    The ETag covers the versions of `domains`, the request path and query,
+    and today's date (several views are windows relative to today), so the
+    handler only runs when one of those changed. Non-GET requests pass through.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(current_user_id, *args, **kwargs):
+            if request.method != 'GET':
+                return f(current_user_id, *args, **kwargs)
+            versions = data_versions(current_user_id, domains)
+            g.data_versions = dict(zip(domains, versions))
+            tag = version_tag(current_user_id, domains, versions, request.full_path)
+            # Lets cached_response key shared entries on the version too. The
+            # handler's own per-process caches key on g.data_versions, so a
+            # worker that missed an invalidation reloads instead of storing a
+            # stale body under the new tag
+            g.data_version_tag = tag
+            # Weak comparison: compressed responses carry the tag as W/"..."
+            if request.if_none_match.contains_weak(tag):
+                response = current_app.response_class(status=304)
+                response.set_etag(tag)
+                return response
+            response = current_app.make_response(f(current_user_id, *args, **kwargs))
+            # No ETag for responses flagged by cache.mark_uncacheable()
+            if response.status_code == 200 and not g.get('response_uncacheable'):
+                response.set_etag(tag)
+            return response
+        return decorated
+    return decorator